@@ -3,14 +3,20 @@ AudioCi - Backend API
 Sistema annunci nave via web
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, UploadFile, File, Form
+import time
+_MODULE_LOAD_START = time.perf_counter()
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, UploadFile, File, Form, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.datastructures import Default
+from starlette.background import BackgroundTask
+from starlette.websockets import WebSocketState
 from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime, timedelta
+from typing import Optional, List, Dict
+from datetime import datetime, timedelta, timezone, time as dt_time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import aiosqlite
@@ -19,9 +25,48 @@ import json
 import asyncio
 import re
 import tempfile
+import heapq
+import logging
+import bisect
+import sqlite3
+import contextvars
+import sys
+import cProfile
+import threading
+import queue
+import random
+import itertools
+import struct
+import shutil
+import base64
+import hashlib
+import hmac
+import tarfile
+import mmap
+from email.utils import formatdate
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-import edge_tts
-from deep_translator import GoogleTranslator
+from collections import deque, OrderedDict
+import contextlib
+
+try:
+    import orjson  # encoder JSON veloce, opzionale (fallback: json della stdlib)
+except ImportError:
+    orjson = None
+
+# Moduli pesanti caricati al primo uso: l'avvio non ne paga l'import
+edge_tts = None          # TTS (vedi _load_tts)
+GoogleTranslator = None  # traduzione (vedi _load_tts)
+np = None                # NumPy, caricato solo se il mixer lato server viene usato
+
+def _load_tts():
+    """Import di edge_tts e deep_translator alla prima generazione TTS"""
+    global edge_tts, GoogleTranslator
+    if edge_tts is None:
+        import edge_tts as edge_tts_module
+        from deep_translator import GoogleTranslator as translator_class
+        edge_tts, GoogleTranslator = edge_tts_module, translator_class
+    return edge_tts, GoogleTranslator
 
 def sanitize_filename(filename):
     """Remove or replace characters that are problematic in filenames"""
@@ -34,21 +79,197 @@ def sanitize_filename(filename):
     return filename
 
 # Configurazione
-BASE_DIR = Path("/home/ies/audioci")
+BASE_DIR = Path(os.environ.get("AUDIOCI_BASE_DIR", "/home/ies/audioci"))
 AUDIO_DIR = BASE_DIR / "audio"
 ANNOUNCEMENTS_DIR = AUDIO_DIR / "announcements"
 MUSIC_DIR = AUDIO_DIR / "music"
 DB_PATH = BASE_DIR / "audioci.db"
+PROFILES_DIR = BASE_DIR / "profiles"
+RECORDINGS_DIR = BASE_DIR / "recordings"
+UPLOADS_DIR = BASE_DIR / "uploads"
+
+# Versione dello schema DB (PRAGMA user_version): va incrementata a ogni
+# modifica di tabelle, indici o trigger in _apply_schema()
+SCHEMA_VERSION = 4
 
 SECRET_KEY = "audioci-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 ore
 
+# Scheduler annunci programmati
+SCHEDULER_MISFIRE_GRACE = 60         # secondi di ritardo oltre i quali un'esecuzione e' "persa"
+SCHEDULER_CATCHUP_MAX_AGE = 3600     # con catch_up="fire_once" non si recuperano esecuzioni piu' vecchie
+SCHEDULER_DEFER_SECONDS = 5          # intervallo di riprova mentre il Master e' attivo
+SCHEDULER_MAX_DEFER = 600            # oltre questo rinvio l'esecuzione viene saltata
+SCHEDULER_MAX_SLEEP = 60             # risveglio massimo (tollera salti dell'orologio di sistema)
+
+# Log utilizzo (scrittura differita a lotti)
+PLAY_LOG_QUEUE_SIZE = 10000          # eventi in coda oltre i quali si scarta (e si conta l'overflow)
+PLAY_LOG_BATCH_SIZE = 200            # flush al raggiungimento di N eventi...
+PLAY_LOG_FLUSH_INTERVAL = 2.0        # ...oppure dopo N secondi dal primo evento in coda
+
+# Registrazione annunci Master
+RECORDER_QUEUE_CHUNKS = 600          # chunk in attesa di scrittura (~60s a 100ms/chunk) prima di scartare
+RECORDINGS_MAX_AGE_DAYS = 90         # registrazioni piu' vecchie vengono eliminate
+RECORDINGS_MAX_TOTAL_BYTES = 2 * 1024 ** 3  # spazio massimo occupato dalle registrazioni
+
+# Stream live HTTP (/stream/live)
+LIVE_RING_BYTES = 1024 * 1024        # buffer circolare condiviso da tutti gli ascoltatori
+LIVE_STREAM_IDLE_WAIT = 15           # risveglio periodico degli ascoltatori in attesa
+
+# Heartbeat WebSocket
+WS_HEARTBEAT_INTERVAL = 15           # secondi tra un ping applicativo e il successivo
+WS_HEARTBEAT_TIMEOUT = 45            # connessioni senza messaggi da N secondi vengono chiuse
+
+# Avvio sincronizzato dei player: i comandi "play" portano l'istante di avvio in ora del server
+PLAYER_START_LEAD = 0.5              # anticipo minimo (caricamento del file sul player)
+PLAYER_START_LEAD_MAX = 2.0          # anticipo massimo, anche con player a RTT elevato
+
+# Mixer lato server (una programmazione continua per zona, /stream/zone/{zona})
+MIXER_ENABLED = os.environ.get("AUDIOCI_MIXER", "0") == "1"
+MIXER_SAMPLE_RATE = 44100
+MIXER_CHANNELS = 2
+MIXER_BLOCK_SECONDS = 0.1            # durata di un blocco di mix
+MIXER_LEAD_SECONDS = 0.5             # anticipo del mix rispetto al tempo reale
+MIXER_CROSSFADE_SECONDS = 3.0        # crossfade tra brani consecutivi
+MIXER_DUCK_GAIN = 0.25               # volume della musica durante un annuncio
+MIXER_DUCK_SECONDS = 0.4             # durata della rampa di ducking
+MIXER_MP3_BITRATE = "128k"           # bitrate dell'encoder ffmpeg (se disponibile)
+MIXER_DECODE_AHEAD_SECONDS = 10.0    # PCM di un brano decodificato in anticipo (la memoria non dipende dalla durata)
+MIXER_DECODE_CHUNK_SECONDS = 1.0     # blocco di decodifica dei brani
+MIXER_MASTER_BUFFER_SECONDS = 10.0   # PCM del Master decodificato trattenuto per le zone
+MIXER_MASTER_JITTER_SECONDS = 0.3    # audio del Master accumulato prima di iniziare a mixarlo
+
+# Backend TTS/traduzione: "edge" (edge-tts + Google Translate) o "local" (sostituto offline deterministico)
+TTS_BACKEND = os.environ.get("AUDIOCI_TTS_BACKEND", "edge")
+TTS_TRANSLATE_TIMEOUT = 10           # secondi per tradurre tutte le lingue di una richiesta
+TTS_SYNTH_TIMEOUT = 30               # secondi per la sintesi di una lingua
+TTS_BREAKER_FAILURES = 3             # errori consecutivi che aprono il circuito
+TTS_BREAKER_COOLDOWN = 60            # secondi a circuito aperto prima di una chiamata di prova
+TTS_TRANSLATE_WORKERS = 4            # thread per le traduzioni: quelli bloccati dopo un timeout non si moltiplicano
+
+# Coda di riproduzione (arbitraggio dei comandi verso i player)
+PLAYBACK_PRIORITIES = {"announcement": 1, "safety": 2}   # la musica (0) e' sottofondo, il Master (3) sospende tutto
+PLAYBACK_COALESCE_SECONDS = 2.0      # richieste identiche entro N secondi vengono fuse in una
+PLAYBACK_QUEUE_MAX = 50              # annunci in attesa oltre i quali le richieste sono rifiutate
+PLAYBACK_END_GRACE = 5.0             # margine oltre la durata stimata se i player non segnalano la fine
+PLAYBACK_FALLBACK_SECONDS = 60.0     # durata presunta di un file senza peaks
+PLAYBACK_RECENT_MAX = 1000           # richieste recenti ricordate per la fusione dei duplicati
+PLAYLIST_LOOKAHEAD = 2               # brani successivi indicati ai player per il precaricamento
+
+# Layout a shard delle directory audio: <dir>/ab/cd/<nome>, con ab/cd dall'hash del nome
+SHARD_MIGRATION_BATCH = 200          # file spostati per fetta dalla migrazione online dal layout piatto
+SHARD_MIGRATION_PAUSE = 0.05         # pausa tra una fetta e la successiva
+SHARD_MIGRATION_START_DELAY = 30     # la migrazione parte N secondi dopo l'avvio
+
+# Cache dei file audio piccoli e richiesti spesso (annunci ricorrenti), mappati in memoria
+AUDIO_CACHE_MAX_BYTES = 64 * 1024 * 1024   # byte residenti complessivi (LRU)
+AUDIO_CACHE_MAX_FILE = 4 * 1024 * 1024     # file piu' grandi restano in streaming dal disco
+
+# Upload riprendibili a blocchi (brani grandi su Wi-Fi instabile)
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024   # dimensione dei blocchi proposta al client
+UPLOAD_MIN_CHUNK = 256 * 1024
+UPLOAD_MAX_CHUNK = 16 * 1024 * 1024
+UPLOAD_MAX_BYTES = 2 * 1024 ** 3      # dimensione massima di un file
+UPLOAD_SESSION_TTL = 24 * 3600        # sessioni senza attivita' da N secondi vengono eliminate
+UPLOAD_CLEANUP_INTERVAL = 600         # controllo delle sessioni scadute ogni N secondi
+
+# Limiti sui comandi dei controller: ruolo -> (comandi al secondo, raffica massima)
+CONTROLLER_RATE_LIMITS = {
+    "admin": (10.0, 20),
+    "master": (10.0, 20),
+    "operator": (5.0, 10),
+}
+CONTROLLER_ANONYMOUS_LIMIT = (2.0, 5)    # connessioni senza token valido
+CONTROLLER_USER_FACTOR = 2               # il bucket per utente (tutte le sue connessioni) vale N connessioni
+CONTROLLER_TOGGLE_WINDOW = 0.5           # pause/resume/shuffle entro N secondi: vince l'ultimo
+
+# Pool di processi per decodifica e analisi audio (mixer, forme d'onda, impronte)
+AUDIO_POOL_WORKERS = max(2, os.cpu_count() or 2)
+AUDIO_ANALYSIS_WORKERS = AUDIO_POOL_WORKERS - 1   # analisi/import in parallelo: un processo resta al mixer
+
+# Forme d'onda precalcolate per l'anteprima (file <audio>.peaks accanto all'audio)
+PEAKS_SUFFIX = ".peaks"
+PEAKS_MAGIC = b"ACPK"
+PEAKS_VERSION = 1
+PEAKS_SAMPLE_RATE = 22050            # frequenza di decodifica per l'analisi (mono)
+PEAKS_LEVELS = (2048, 512, 128)      # coppie min/max per livello; ogni livello divide il precedente
+PEAKS_BACKFILL_DELAY = 120           # generazione di peaks e impronte mancanti dopo l'avvio
+
+# Impronte acustiche per i duplicati all'import: FINGERPRINT_SEGMENTS x FINGERPRINT_BANDS bit
+FINGERPRINT_SEGMENTS = 32            # segmenti di durata
+FINGERPRINT_BANDS = 8                # bande di frequenza (logaritmiche)
+FINGERPRINT_MIN_HZ = 300
+FINGERPRINT_MAX_HZ = 5000
+FINGERPRINT_FRAME = 1024             # campioni per finestra FFT (a PEAKS_SAMPLE_RATE)
+FINGERPRINT_SILENCE = 0.01           # silenzio iniziale/finale scartato (-40 dB dal picco)
+FINGERPRINT_FLOOR = 0.01             # pavimento di energia (-20 dB dalla media del file)
+FINGERPRINT_MARGIN = 0.1             # bit a 1 solo oltre 1 dB sopra la media della banda
+FINGERPRINT_MAX_DISTANCE = 32        # bit diversi (su 256) entro cui due file sono duplicati
+FINGERPRINT_DURATION_TOLERANCE = 0.5 # secondi (o 2% della durata) tra file candidati
+
+# Cataloghi (musica, annunci): paginazione a chiave
+CATALOG_MAX_LIMIT = 1000             # righe massime per pagina
+MUSIC_FIELDS = ("id", "title", "artist", "file_path", "duration")
+ANNOUNCEMENT_FIELDS = ("id", "name", "group_id", "color", "position", "files")
+
+# Ricerca full-text: rowid dell'indice = id * SEARCH_ROWID_STRIDE + codice del tipo
+SEARCH_ROWID_STRIDE = 4
+SEARCH_SOURCES = {
+    # tipo: (codice, tabella, colonna titolo, colonna sottotitolo)
+    "announcement": (1, "announcements", "name", None),
+    "sequence": (2, "sequences", "name", None),
+    "music": (3, "music", "title", "artist"),
+}
+SEARCH_MAX_LIMIT = 100
+
+# Backup / restore online
+BACKUP_FORMAT_VERSION = 1
+BACKUP_DB_NAME = "audioci.db"        # nomi delle voci speciali nell'archivio tar
+BACKUP_MANIFEST_NAME = "manifest.json"
+BACKUP_CHUNK_BYTES = 256 * 1024      # blocchi di lettura/scrittura in streaming
+BACKUP_RESTORE_QUEUE_CHUNKS = 64     # chunk del corpo in attesa dell'estrazione (backpressure)
+
+# Riconciliazione storage (file orfani)
+QUARANTINE_DIR = BASE_DIR / "quarantine"
+STORAGE_SCAN_INTERVAL = 6 * 3600     # una scansione completa ogni N secondi
+STORAGE_SCAN_START_DELAY = 300       # prima scansione dopo l'avvio (non rallenta lo startup)
+STORAGE_SCAN_BATCH = 500             # voci di directory per fetta di scansione
+STORAGE_SCAN_PAUSE = 0.05            # pausa tra una fetta e la successiva
+STORAGE_MIN_AGE = 600                # file piu' recenti ignorati (upload non ancora registrato)
+STORAGE_REPORT_LIMIT = 500           # elementi elencati per categoria nel report
+
+# Profiling on-demand (solo admin)
+PROFILE_MAX_REQUESTS = 100           # richieste profilabili per singola attivazione
+PROFILE_MAX_SECONDS = 300            # durata massima di un profilo (sessioni WebSocket lunghe)
+PROFILE_MAX_FILES = 50               # profili conservati in PROFILES_DIR
+
+# /metrics richiede un admin oppure, per lo scraper Prometheus, questo token (Authorization: Bearer)
+METRICS_TOKEN = os.environ.get("AUDIOCI_METRICS_TOKEN")
+
+logger = logging.getLogger("audioci")
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
-app = FastAPI(title="AudioCi", version="1.0.0")
+def json_dumps(obj) -> str:
+    """JSON compatto (orjson se disponibile)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serializzata con orjson quando disponibile"""
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return super().render(content)
+
+# Default(...) mantiene il percorso veloce di FastAPI (serializzazione diretta
+# via Pydantic) per gli endpoint con response_model; gli altri usano orjson.
+app = FastAPI(title="AudioCi", version="1.0.0", default_response_class=Default(FastJSONResponse))
 
 # CORS per sviluppo
 app.add_middleware(
@@ -59,83 +280,481 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============== METRICHE (/metrics, formato Prometheus) ==============
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """
+    Registro metriche minimale in memoria. inc()/observe() costano un lookup
+    in un dict e qualche somma; la serializzazione in testo avviene solo quando
+    qualcuno interroga /metrics. Le gauge (connessioni, RSS, code) sono calcolate
+    al momento dello scrape dai collector registrati.
+    """
+
+    def __init__(self):
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, help_text: str, labelnames: tuple = ()):
+        self._meta[name] = (kind, help_text, labelnames)
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float):
+        key = (name, labels)
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = Histogram(LATENCY_BUCKETS)
+        hist.observe(value)
+
+    def collector(self, fn):
+        """fn() -> iterabile di (nome, labels, valore) letti al momento dello scrape"""
+        self._collectors.append(fn)
+        return fn
+
+    def _labels(self, name: str, values: tuple, extra: str = "") -> str:
+        names = self._meta.get(name, (None, None, ()))[2]
+        parts = [f'{k}="{str(v)}"' for k, v in zip(names, values)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        samples = {}
+        for key, value in self._counters.items():
+            samples.setdefault(key[0], []).append((key[1], value))
+        for fn in self._collectors:
+            for name, labels, value in fn():
+                samples.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, kind_help in self._meta.items():
+            kind, help_text, _ = kind_help
+            if kind == "histogram":
+                series = [(k[1], h) for k, h in self._histograms.items() if k[0] == name]
+            else:
+                series = samples.get(name, [])
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in series:
+                    lines.append(f"{name}{self._labels(name, labels)} {value}")
+                continue
+            for labels, hist in series:
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{name}_bucket{self._labels(name, labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{self._labels(name, labels, le)} {hist.count}")
+                lines.append(f"{name}_sum{self._labels(name, labels)} {hist.sum}")
+                lines.append(f"{name}_count{self._labels(name, labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("audioci_http_request_duration_seconds", "histogram", "Latenza richieste REST per route", ("method", "route", "status"))
+metrics.describe("audioci_ws_messages_in_total", "counter", "Messaggi WebSocket ricevuti per ruolo", ("role",))
+metrics.describe("audioci_ws_messages_out_total", "counter", "Messaggi WebSocket inviati per ruolo", ("role",))
+metrics.describe("audioci_ws_send_errors_total", "counter", "Invii WebSocket falliti per ruolo", ("role",))
+metrics.describe("audioci_ws_evictions_total", "counter", "Connessioni rimosse per timeout heartbeat o invio fallito", ("reason",))
+metrics.describe("audioci_ws_broadcast_seconds", "histogram", "Durata fan-out dei broadcast", ("target",))
+metrics.describe("audioci_ws_connections", "gauge", "Connessioni WebSocket attive per ruolo", ("role",))
+metrics.describe("audioci_player_start_skew_seconds", "histogram", "Scarto (assoluto) tra l'avvio di un player e l'istante richiesto")
+metrics.describe("audioci_master_active", "gauge", "1 se un annuncio Master e' in corso")
+metrics.describe("audioci_master_chunks_total", "counter", "Chunk audio Master ricevuti")
+metrics.describe("audioci_master_bytes_in_total", "counter", "Byte audio Master ricevuti")
+metrics.describe("audioci_master_bytes_out_total", "counter", "Byte audio Master inoltrati ai player")
+metrics.describe("audioci_master_relay_seconds", "histogram", "Latenza inoltro di un chunk Master a tutti i player")
+metrics.describe("audioci_master_recorder_total", "counter", "Registrazioni Master: file, byte, chunk scartati, eliminazioni", ("kind",))
+metrics.describe("audioci_live_listeners", "gauge", "Ascoltatori collegati a /stream/live")
+metrics.describe("audioci_live_stream_total", "counter", "Stream live: byte in/out, salti in avanti, ascoltatori", ("kind",))
+metrics.describe("audioci_storage_reclaimable_bytes", "gauge", "Byte occupati da file non referenziati (ultima scansione)")
+metrics.describe("audioci_storage_issues", "gauge", "Problemi rilevati dall'ultima scansione dello storage", ("kind",))
+metrics.describe("audioci_storage_cleaned_total", "counter", "File e righe rimossi dalla pulizia dello storage", ("kind",))
+metrics.describe("audioci_mixer_listeners", "gauge", "Ascoltatori collegati allo stream della zona", ("zone",))
+metrics.describe("audioci_mixer_render_seconds_total", "counter", "Tempo CPU speso nel mix della zona", ("zone",))
+metrics.describe("audioci_mixer_audio_seconds_total", "counter", "Secondi di audio prodotti dal mixer della zona", ("zone",))
+metrics.describe("audioci_mixer_underruns_total", "counter", "Blocchi senza musica pronta (brano successivo o decodifica in ritardo)", ("zone",))
+metrics.describe("audioci_mixer_decode_errors_total", "counter", "Brani saltati perche' non decodificabili", ("zone",))
+metrics.describe("audioci_audio_analysis_total", "counter", "File audio analizzati (peaks, impronte) per esito", ("outcome",))
+metrics.describe("audioci_audio_analysis_seconds_total", "counter", "Tempo speso nell'analisi dei file audio")
+metrics.describe("audioci_import_duplicates_total", "counter", "Probabili duplicati rilevati all'import", ("kind", "action"))
+metrics.describe("audioci_db_operations_total", "counter", "Operazioni SQLite per endpoint", ("endpoint", "op"))
+metrics.describe("audioci_db_operation_seconds", "histogram", "Durata operazioni SQLite per endpoint", ("endpoint", "op"))
+metrics.describe("audioci_tts_seconds", "histogram", "Durata traduzione e sintesi TTS", ("stage", "lang"))
+metrics.describe("audioci_tts_breaker_state", "gauge", "Circuito del backend TTS: 0 chiuso, 1 in prova, 2 aperto", ("stage",))
+metrics.describe("audioci_tts_calls_total", "counter", "Chiamate al backend TTS per esito", ("stage", "outcome"))
+metrics.describe("audioci_playback_requests_total", "counter", "Richieste di riproduzione per esito", ("kind", "outcome"))
+metrics.describe("audioci_playback_events_total", "counter", "Annunci avviati, conclusi, scaduti, interrotti", ("event",))
+metrics.describe("audioci_playback_queue_depth", "gauge", "Annunci in attesa nella coda di riproduzione")
+metrics.describe("audioci_playlist_tracks_total", "counter", "Cambi di brano delle playlist lato server per motivo", ("reason",))
+metrics.describe("audioci_controller_commands_total", "counter", "Comandi dei controller per ruolo ed esito", ("role", "outcome"))
+metrics.describe("audioci_controller_rate_limit", "gauge", "Limiti dei comandi per ruolo (comandi/s e raffica)", ("role", "param"))
+metrics.describe("audioci_uploads_total", "counter", "Sessioni di upload a blocchi per evento", ("event",))
+metrics.describe("audioci_upload_chunks_total", "counter", "Blocchi ricevuti per esito", ("outcome",))
+metrics.describe("audioci_upload_bytes_total", "counter", "Byte ricevuti dagli upload a blocchi")
+metrics.describe("audioci_audio_cache_requests_total", "counter", "Richieste di file audio per esito della cache", ("result",))
+metrics.describe("audioci_audio_cache_evictions_total", "counter", "File rimossi dalla cache audio per motivo", ("reason",))
+metrics.describe("audioci_audio_cache_resident_bytes", "gauge", "Byte mappati dalla cache audio")
+metrics.describe("audioci_audio_cache_files", "gauge", "File presenti nella cache audio")
+metrics.describe("audioci_shard_migration_files_total", "counter", "File spostati nel layout a shard per esito", ("kind", "outcome"))
+metrics.describe("audioci_shard_migration_pending", "gauge", "Directory audio ancora (anche in parte) nel layout piatto", ("kind",))
+metrics.describe("audioci_scheduler_dispatch_lag_seconds", "histogram", "Ritardo di esecuzione degli annunci programmati")
+metrics.describe("audioci_scheduler_events_total", "counter", "Esiti del scheduler", ("outcome",))
+metrics.describe("audioci_play_log_events_total", "counter", "Eventi del log utilizzo", ("outcome",))
+metrics.describe("audioci_play_log_queue_depth", "gauge", "Eventi del log utilizzo in attesa di scrittura")
+metrics.describe("audioci_process_resident_memory_bytes", "gauge", "Memoria residente del processo")
+
+# Scope ASGI della richiesta in corso, per attribuire le query DB all'endpoint
+current_request_scope = contextvars.ContextVar("current_request_scope", default=None)
+
+def current_endpoint() -> str:
+    scope = current_request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (niente BaseHTTPMiddleware): misura la latenza per route e aggancia il profiler"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        app = self.app
+        if profiler.armed and profiler.claim(scope):
+            app = profiler.wrap(app)
+        token = current_request_scope.set(scope)
+        if scope["type"] == "websocket":
+            try:
+                await app(scope, receive, send)
+            finally:
+                current_request_scope.reset(token)
+            return
+
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await app(scope, receive, send_wrapper)
+        finally:
+            metrics.observe(
+                "audioci_http_request_duration_seconds",
+                (scope["method"], current_endpoint(), status_code[0]),
+                time.perf_counter() - start
+            )
+            current_request_scope.reset(token)
+
+app.add_middleware(MetricsMiddleware)
+
+async def _metered(operation: str, awaitable):
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        labels = (current_endpoint(), operation)
+        metrics.inc("audioci_db_operations_total", labels)
+        metrics.observe("audioci_db_operation_seconds", labels, time.perf_counter() - start)
+
+class MeteredCursor:
+    """Cursore aiosqlite le cui letture sono misurate; il resto (lastrowid, rowcount...) e' quello originale"""
+
+    def __init__(self, cursor: aiosqlite.Cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def fetchone(self):
+        return await _metered("fetchone", self._cursor.fetchone())
+
+    async def fetchmany(self, size: Optional[int] = None):
+        return await _metered("fetchmany", self._cursor.fetchmany(size))
+
+    async def fetchall(self):
+        return await _metered("fetchall", self._cursor.fetchall())
+
+class MeteredConnection(aiosqlite.Connection):
+    """Connessione aiosqlite che misura query, letture e commit (solo API pubblica di aiosqlite)"""
+
+    async def execute(self, sql: str, parameters=None) -> MeteredCursor:
+        return MeteredCursor(await _metered("execute", super().execute(sql, parameters)))
+
+    async def executemany(self, sql: str, parameters) -> MeteredCursor:
+        return MeteredCursor(await _metered("executemany", super().executemany(sql, parameters)))
+
+    async def executescript(self, sql_script: str) -> MeteredCursor:
+        return MeteredCursor(await _metered("executescript", super().executescript(sql_script)))
+
+    async def commit(self):
+        await _metered("commit", super().commit())
+
+    async def rollback(self):
+        await _metered("rollback", super().rollback())
+
+def db_connect():
+    """Equivalente di aiosqlite.connect(DB_PATH) con metriche per endpoint"""
+    path = str(DB_PATH)
+    return MeteredConnection(lambda: sqlite3.connect(path), 64)
+
+def process_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
 # WebSocket connections manager
+class ConnectionInfo:
+    """Metadati di una connessione WebSocket registrata"""
+    __slots__ = ("role", "username", "client", "connected_at", "last_seen", "clock_offset", "clock_rtt", "start_skew")
+
+    def __init__(self, role: str, websocket: WebSocket, username: Optional[str] = None):
+        self.role = role
+        self.username = username
+        self.client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+        self.connected_at = time.time()
+        self.last_seen = time.monotonic()
+        self.clock_offset = None    # ms, ora del server - ora del player (solo player)
+        self.clock_rtt = None       # ms, RTT del campione di sincronizzazione migliore
+        self.start_skew = None      # ms, scarto misurato all'ultimo avvio sincronizzato
+
 class ConnectionManager:
+    """
+    Registri per ruolo come dict websocket -> ConnectionInfo (inserimento e rimozione O(1)).
+    Un heartbeat periodico invia {"type": "ping"} a tutti; ogni messaggio ricevuto
+    (pong compreso) aggiorna last_seen e le connessioni silenziose oltre
+    WS_HEARTBEAT_TIMEOUT vengono chiuse e rimosse. Anche un invio fallito rimuove
+    subito la connessione, cosi' i broadcast non pagano per socket morti.
+    """
+
     def __init__(self):
-        self.players: List[WebSocket] = []
-        self.controllers: List[WebSocket] = []
-        self.masters: List[WebSocket] = []
+        self.players: Dict[WebSocket, ConnectionInfo] = {}
+        self.controllers: Dict[WebSocket, ConnectionInfo] = {}
+        self.masters: Dict[WebSocket, ConnectionInfo] = {}
         self.master_active = False
         self.master_username = None
+        self.evictions = {"timeout": 0, "send_error": 0}
+        self._heartbeat_task = None
 
-    async def connect_player(self, websocket: WebSocket):
+    def _registries(self):
+        return (self.players, self.controllers, self.masters)
+
+    async def connect_player(self, websocket: WebSocket, username: Optional[str] = None):
         await websocket.accept()
-        self.players.append(websocket)
+        self.players[websocket] = ConnectionInfo("player", websocket, username)
         if self.master_active:
             await websocket.send_json({"type": "master_start", "username": self.master_username})
 
-    async def connect_controller(self, websocket: WebSocket):
+    async def connect_controller(self, websocket: WebSocket, username: Optional[str] = None):
         await websocket.accept()
-        self.controllers.append(websocket)
+        self.controllers[websocket] = ConnectionInfo("controller", websocket, username)
         if self.master_active:
             await websocket.send_json({"type": "master_start", "username": self.master_username})
 
-    async def connect_master(self, websocket: WebSocket):
+    async def connect_master(self, websocket: WebSocket, username: Optional[str] = None):
         await websocket.accept()
-        self.masters.append(websocket)
+        self.masters[websocket] = ConnectionInfo("master", websocket, username)
 
     def disconnect_player(self, websocket: WebSocket):
-        if websocket in self.players:
-            self.players.remove(websocket)
+        self.players.pop(websocket, None)
 
     def disconnect_controller(self, websocket: WebSocket):
-        if websocket in self.controllers:
-            self.controllers.remove(websocket)
+        self.controllers.pop(websocket, None)
 
     def disconnect_master(self, websocket: WebSocket):
-        if websocket in self.masters:
-            self.masters.remove(websocket)
+        self.masters.pop(websocket, None)
+
+    def touch(self, websocket: WebSocket):
+        """Da chiamare a ogni messaggio ricevuto: la connessione e' viva"""
+        for registry in self._registries():
+            info = registry.get(websocket)
+            if info is not None:
+                info.last_seen = time.monotonic()
+                return
+
+    async def _evict(self, websocket: WebSocket, reason: str):
+        for registry in self._registries():
+            if registry.pop(websocket, None) is not None:
+                self.evictions[reason] += 1
+                break
+        try:
+            await websocket.close(code=1001)
+        except Exception:
+            pass
+
+    async def _broadcast(self, target: str, recipients: list, message: dict):
+        """Il messaggio viene serializzato una sola volta e lo stesso frame di testo va a tutti"""
+        start = time.perf_counter()
+        frame = {"type": "websocket.send", "text": json_dumps(message)}
+        sent = {}
+        dead = []
+        for ws, info in recipients:
+            try:
+                await ws.send(frame)
+                sent[info.role] = sent.get(info.role, 0) + 1
+            except Exception:
+                metrics.inc("audioci_ws_send_errors_total", (info.role,))
+                dead.append(ws)
+        for role, count in sent.items():
+            metrics.inc("audioci_ws_messages_out_total", (role,), count)
+        metrics.observe("audioci_ws_broadcast_seconds", (target,), time.perf_counter() - start)
+        for ws in dead:
+            await self._evict(ws, "send_error")
+
+    def player_clock(self, websocket: WebSocket, offset_ms, rtt_ms):
+        """Esito della sincronizzazione dell'orologio calcolato dal player"""
+        info = self.players.get(websocket)
+        try:
+            offset_ms, rtt_ms = float(offset_ms), float(rtt_ms)
+        except (TypeError, ValueError):
+            return
+        if info is not None and rtt_ms >= 0:
+            info.clock_offset = offset_ms
+            info.clock_rtt = rtt_ms
+
+    def player_skew(self, websocket: WebSocket, skew_ms):
+        info = self.players.get(websocket)
+        try:
+            skew_ms = float(skew_ms)
+        except (TypeError, ValueError):
+            return
+        if info is not None:
+            info.start_skew = skew_ms
+            metrics.observe("audioci_player_start_skew_seconds", (), abs(skew_ms) / 1000)
+
+    def start_at(self) -> int:
+        """Istante di avvio (ms, ora del server) raggiungibile da tutti i player collegati"""
+        rtts = [info.clock_rtt for info in self.players.values() if info.clock_rtt is not None]
+        lead = min(PLAYER_START_LEAD_MAX, PLAYER_START_LEAD + (max(rtts) / 1000 if rtts else 0))
+        return round((time.time() + lead) * 1000)
 
     async def send_to_players(self, message: dict):
-        for player in self.players:
-            try:
-                await player.send_json(message)
-            except:
-                pass
+        await self._broadcast("players", list(self.players.items()), message)
 
     async def send_to_controllers(self, message: dict):
-        for controller in self.controllers:
-            try:
-                await controller.send_json(message)
-            except:
-                pass
+        await self._broadcast("controllers", list(self.controllers.items()), message)
 
     async def send_to_all(self, message: dict):
-        for ws in self.players + self.controllers + self.masters:
-            try:
-                await ws.send_json(message)
-            except:
-                pass
+        await self._broadcast("all", [*self.players.items(), *self.controllers.items(),
+                                      *self.masters.items()], message)
 
     async def start_master_announcement(self, username: str):
         self.master_active = True
         self.master_username = username
+        live_ring.begin()
+        controller_limiter.cancel_pending()
+        await playback.master_started()
         await self.send_to_all({"type": "master_start", "username": username})
 
     async def stop_master_announcement(self):
         self.master_active = False
         self.master_username = None
+        live_ring.end()
         await self.send_to_all({"type": "master_stop"})
+        await playback.master_stopped()
 
     async def send_audio_to_players(self, audio_data: bytes):
-        for player in self.players:
+        start = time.perf_counter()
+        metrics.inc("audioci_master_chunks_total")
+        metrics.inc("audioci_master_bytes_in_total", (), len(audio_data))
+        live_ring.write(audio_data)
+        dead = []
+        for player in list(self.players):
             try:
                 await player.send_bytes(audio_data)
-            except:
+                metrics.inc("audioci_master_bytes_out_total", (), len(audio_data))
+            except Exception:
+                metrics.inc("audioci_ws_send_errors_total", ("player",))
+                dead.append(player)
+        metrics.observe("audioci_master_relay_seconds", (), time.perf_counter() - start)
+        for player in dead:
+            await self._evict(player, "send_error")
+
+    async def start(self):
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
                 pass
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            deadline = time.monotonic() - WS_HEARTBEAT_TIMEOUT
+            for registry in self._registries():
+                stale = [ws for ws, info in registry.items() if info.last_seen < deadline]
+                for ws in stale:
+                    await self._evict(ws, "timeout")
+            await self.send_to_all({"type": "ping", "ts": time.time()})
+
+    def snapshot(self) -> list:
+        now = time.monotonic()
+        return [
+            {
+                "role": info.role,
+                "username": info.username,
+                "client": info.client,
+                "connected_at": datetime.fromtimestamp(info.connected_at).isoformat(timespec="seconds"),
+                "idle_seconds": round(now - info.last_seen, 1),
+                "clock_offset_ms": info.clock_offset,
+                "clock_rtt_ms": info.clock_rtt,
+                "start_skew_ms": info.start_skew,
+            }
+            for registry in self._registries() for info in registry.values()
+        ]
 
 manager = ConnectionManager()
 
+@metrics.collector
+def _connection_metrics():
+    yield "audioci_ws_connections", ("player",), len(manager.players)
+    yield "audioci_ws_connections", ("controller",), len(manager.controllers)
+    yield "audioci_ws_connections", ("master",), len(manager.masters)
+    yield "audioci_master_active", (), int(manager.master_active)
+    for reason, count in manager.evictions.items():
+        yield "audioci_ws_evictions_total", (reason,), count
+    yield "audioci_process_resident_memory_bytes", (), process_rss_bytes()
+
 # Modelli Pydantic
 class UserCreate(BaseModel):
     username: str
@@ -178,6 +797,15 @@ class AnnouncementResponse(BaseModel):
     position: int
     files: List[str] = []
 
+class AnnouncementFields(BaseModel):
+    """Annuncio in lista: solo i campi chiesti con fields (tutti se omesso)"""
+    id: Optional[int] = None
+    name: Optional[str] = None
+    group_id: Optional[int] = None
+    color: Optional[str] = None
+    position: Optional[int] = None
+    files: Optional[List[str]] = None
+
 class BulkUploadResponse(BaseModel):
     created: int
     announcements: List[AnnouncementResponse]
@@ -218,6 +846,22 @@ class MusicResponse(BaseModel):
     file_path: str
     duration: Optional[int]
 
+class MusicFields(BaseModel):
+    """Brano in lista: solo i campi chiesti con fields (tutti se omesso)"""
+    id: Optional[int] = None
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    file_path: Optional[str] = None
+    duration: Optional[int] = None
+
+class UploadCreate(BaseModel):
+    filename: str
+    size: int
+    chunk_size: Optional[int] = None
+    sha256: Optional[str] = None    # facoltativo: verificato sul file completo
+    title: Optional[str] = None
+    artist: Optional[str] = None
+
 class PlaylistCreate(BaseModel):
     name: str
 
@@ -263,9 +907,75 @@ class TTSResponse(BaseModel):
     sequence_id: Optional[int] = None
     message: str = ""
 
+# Scheduler Models
+class ScheduleCreate(BaseModel):
+    name: str
+    target_type: str  # "announcement" | "sequence"
+    target_id: int
+    rule_type: str  # "once" | "daily" | "cron"
+    rule: str  # ISO datetime, "HH:MM" oppure espressione cron a 5 campi
+    catch_up: str = "skip"  # "skip" | "fire_once"
+    master_policy: str = "defer"  # "defer" | "skip"
+    enabled: bool = True
+
+class PlayLogEntry(BaseModel):
+    id: int
+    event: str
+    username: Optional[str]
+    item_type: Optional[str]
+    item_id: Optional[int]
+    detail: Optional[str]
+    created_at: str
+
+class PlayLogPage(BaseModel):
+    items: List[PlayLogEntry]
+    next_cursor: Optional[int] = None
+
+class BackupResponse(BaseModel):
+    id: int
+    created_at: str
+    kind: str
+    base_id: Optional[int]
+    files: int
+    included: int
+    bytes: int
+
+class SearchResult(BaseModel):
+    type: str
+    id: int
+    title: str
+    subtitle: Optional[str]
+    score: float
+
+class RecordingResponse(BaseModel):
+    id: int
+    username: Optional[str]
+    file_path: str
+    started_at: str
+    ended_at: Optional[str]
+    bytes: int
+    chunks: int
+    dropped_chunks: int
+
+class ScheduleResponse(BaseModel):
+    id: int
+    name: str
+    target_type: str
+    target_id: int
+    rule_type: str
+    rule: str
+    catch_up: str
+    master_policy: str
+    enabled: bool
+    last_run_at: Optional[str] = None
+    last_outcome: Optional[str] = None
+    last_outcome_at: Optional[str] = None
+    next_fire_at: Optional[str] = None
+
 # Database functions
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+async def _apply_schema():
+    """Tabelle, indici e trigger (idempotente: tutto IF NOT EXISTS)"""
+    async with db_connect() as db:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -363,16 +1073,184 @@ async def init_db():
             )
         """)
 
+        # Annunci programmati (one-shot, giornalieri, cron)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS schedules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                target_type TEXT NOT NULL,
+                target_id INTEGER NOT NULL,
+                rule_type TEXT NOT NULL,
+                rule TEXT NOT NULL,
+                catch_up TEXT DEFAULT 'skip',
+                master_policy TEXT DEFAULT 'defer',
+                enabled INTEGER DEFAULT 1,
+                last_run_at TIMESTAMP,
+                last_outcome TEXT,
+                last_outcome_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Colonne aggiunte dopo la prima versione della tabella (DB esistenti)
+        cursor = await db.execute("PRAGMA table_info(schedules)")
+        columns = {row[1] for row in await cursor.fetchall()}
+        for column, ddl in (("last_outcome", "TEXT"), ("last_outcome_at", "TIMESTAMP")):
+            if column not in columns:
+                await db.execute(f"ALTER TABLE schedules ADD COLUMN {column} {ddl}")
+
+        # Log utilizzo: chi ha riprodotto cosa e quando (anche annunci Master)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS play_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event TEXT NOT NULL,
+                username TEXT,
+                item_type TEXT,
+                item_id INTEGER,
+                detail TEXT,
+                created_at TEXT NOT NULL
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_play_log_created ON play_log(created_at)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_play_log_user ON play_log(username, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_play_log_item ON play_log(item_type, item_id, id)")
+
+        # Registrazioni degli annunci Master (collegate al play log tramite file_path)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS recordings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                file_path TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                ended_at TEXT,
+                bytes INTEGER DEFAULT 0,
+                chunks INTEGER DEFAULT 0,
+                dropped_chunks INTEGER DEFAULT 0
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_recordings_user ON recordings(username, id)")
+
+        # Manifest dei backup completati (riferimento per gli incrementali)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS backups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                base_id INTEGER,
+                files INTEGER DEFAULT 0,
+                included INTEGER DEFAULT 0,
+                bytes INTEGER DEFAULT 0,
+                manifest TEXT NOT NULL
+            )
+        """)
+
+        # Impronte acustiche (duplicati all'import); kind: "music" o "announcements"
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS audio_fingerprints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                ref_id INTEGER NOT NULL,
+                file_path TEXT NOT NULL,
+                duration REAL NOT NULL,
+                fingerprint BLOB NOT NULL
+            )
+        """)
+
+        # Upload a blocchi in corso: i blocchi ricevuti sopravvivono ai riavvii
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                sha256 TEXT,
+                title TEXT,
+                artist TEXT,
+                username TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                upload_id TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (upload_id, chunk)
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(updated_at)")
+
+        # Indici per le liste paginate (ordinamento + chiave univoca)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_music_title ON music(title, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_announcements_position ON announcements(position, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_announcements_group ON announcements(group_id, position, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_announcement_files_announcement ON announcement_files(announcement_id, file_order)")
+        # I candidati duplicati si cercano per durata: range scan sull'indice
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_audio_fingerprints_duration ON audio_fingerprints(kind, duration)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_audio_fingerprints_ref ON audio_fingerprints(kind, ref_id)")
+
+        # Ricerca full-text (FTS5), tenuta allineata dai trigger sulle tabelle sorgente
+        cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")
+        search_index_exists = await cursor.fetchone() is not None
+        await db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                title, subtitle, kind UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        """)
+        for kind, (code, table, title, subtitle) in SEARCH_SOURCES.items():
+            rowid = f"id * {SEARCH_ROWID_STRIDE} + {code}"
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS search_{table}_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO search_index (rowid, title, subtitle, kind)
+                    VALUES (NEW.{rowid}, NEW.{title}, {'NEW.' + subtitle if subtitle else 'NULL'}, '{kind}');
+                END
+            """)
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS search_{table}_ad AFTER DELETE ON {table} BEGIN
+                    DELETE FROM search_index WHERE rowid = OLD.{rowid};
+                END
+            """)
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS search_{table}_au AFTER UPDATE OF {title}{', ' + subtitle if subtitle else ''} ON {table} BEGIN
+                    UPDATE search_index SET title = NEW.{title}{', subtitle = NEW.' + subtitle if subtitle else ''}
+                    WHERE rowid = OLD.{rowid};
+                END
+            """)
+            if not search_index_exists:
+                await db.execute(f"""
+                    INSERT INTO search_index (rowid, title, subtitle, kind)
+                    SELECT {rowid}, {title}, {subtitle or 'NULL'}, '{kind}' FROM {table}
+                """)
+
+        await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        await db.commit()
+
+async def init_db() -> bool:
+    """
+    Schema + utente admin di default. Se PRAGMA user_version coincide con
+    SCHEMA_VERSION lo schema e' gia' aggiornato e non viene rieseguito.
+    Ritorna True se lo schema e' stato applicato.
+    """
+    async with db_connect() as db:
+        cursor = await db.execute("PRAGMA user_version")
+        applied = (await cursor.fetchone())[0] != SCHEMA_VERSION
+    if applied:
+        await _apply_schema()
+
+    async with db_connect() as db:
         cursor = await db.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
         count = await cursor.fetchone()
         if count[0] == 0:
-            password_hash = pwd_context.hash("admin")
+            # bcrypt e' volutamente lento: fuori dall'event loop
+            password_hash = await asyncio.to_thread(pwd_context.hash, "admin")
             await db.execute(
                 "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
                 ("admin", password_hash, "admin")
             )
 
         await db.commit()
+    return applied
 
 # Auth functions
 def verify_password(plain_password, hashed_password):
@@ -398,7 +1276,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM users WHERE username = ?", (username,))
         user = await cursor.fetchone()
@@ -406,23 +1284,240 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
         return dict(user)
 
+def username_from_token(token: Optional[str]) -> Optional[str]:
+    """Username dal JWT passato in query string ai WebSocket (solo per il log, non autorizza nulla)"""
+    if not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+async def user_role(username: Optional[str]) -> Optional[str]:
+    """Ruolo dell'utente (per i limiti dei WebSocket); None se anonimo o inesistente"""
+    if not username:
+        return None
+    async with db_connect() as db:
+        cursor = await db.execute("SELECT role FROM users WHERE username = ?", (username,))
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Accesso riservato agli admin")
     return current_user
 
+# ============== LAYOUT FILE AUDIO (shard) ==============
+
+# Directory con file ancora al primo livello (layout piatto): audio_file() vi cerca
+# anche li'; si svuota quando la migrazione online e' completa
+FLAT_AUDIO_DIRS = set()
+
+def shard_path(directory: Path, name: str) -> Path:
+    """
+    Posto di un file nel layout a shard: due livelli di sottodirectory presi
+    dall'hash del nome. Le forme d'onda seguono il loro audio; i file
+    provvisori (nome che inizia con ".") restano al primo livello.
+    """
+    if name.startswith("."):
+        return directory / name
+    digest = hashlib.md5(_storage_owner(name).encode()).hexdigest()
+    return directory / digest[:2] / digest[2:4] / name
+
+def audio_file(directory: Path, name: str) -> Path:
+    """
+    Percorso di un file audio esistente dato il nome registrato nel DB.
+    Durante la migrazione un file puo' essere ancora al primo livello: se non
+    e' nello shard si guarda li', e se nel frattempo e' stato spostato si
+    ricontrolla lo shard. Un file inesistente risolve al suo posto nello shard.
+    """
+    path = shard_path(directory, name)
+    if directory not in FLAT_AUDIO_DIRS or path.exists():
+        return path
+    flat = directory / name
+    return flat if flat.exists() else path
+
+def new_audio_file(directory: Path, name: str) -> Path:
+    """Percorso per un nuovo file audio, con la sua sottodirectory gia' creata"""
+    path = shard_path(directory, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+def iter_audio_entries(directory: Path):
+    """Voci di directory (os.DirEntry) di tutti i file: primo livello e shard"""
+    with os.scandir(directory) as top:
+        for entry in top:
+            if not entry.is_dir(follow_symlinks=False):
+                yield entry
+                continue
+            with os.scandir(entry.path) as level1:
+                for sub in level1:
+                    if sub.is_dir(follow_symlinks=False):
+                        with os.scandir(sub.path) as level2:
+                            yield from level2
+
+def _flat_audio_files(directory: Path, limit: int) -> List[str]:
+    """Fino a `limit` file audio ancora al primo livello (esclusi i provvisori)"""
+    names = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.name.startswith(".") and entry.is_file(follow_symlinks=False):
+                names.append(entry.name)
+                if len(names) >= limit:
+                    break
+    return names
+
+def _shard_files(directory: Path, names: List[str]) -> tuple:
+    """Sposta i file nello shard; ritorna (spostati, nomi rimasti al primo livello)"""
+    moved, failed = 0, []
+    for name in names:
+        target = shard_path(directory, name)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.exists():
+                # Non si sovrascrive mai: il doppione resta al primo livello per la riconciliazione
+                failed.append(name)
+                continue
+            os.rename(directory / name, target)
+            moved += 1
+        except FileNotFoundError:
+            continue    # eliminato nel frattempo
+        except OSError:
+            failed.append(name)
+    return moved, failed
+
+SHARD_DIRS = {"announcements": ANNOUNCEMENTS_DIR, "music": MUSIC_DIR}
+
+class AudioShardMigration:
+    """
+    Migrazione online dal layout piatto a quello a shard. All'avvio basta
+    trovare un file al primo livello perche' la directory entri in
+    FLAT_AUDIO_DIRS; dopo SHARD_MIGRATION_START_DELAY i file vengono spostati
+    a fette di SHARD_MIGRATION_BATCH (rename nello stesso filesystem, quindi
+    atomico e senza copie) con una pausa tra l'una e l'altra. Le richieste
+    continuano a risolvere i vecchi nomi tramite audio_file(); quando il primo
+    livello e' vuoto la directory esce da FLAT_AUDIO_DIRS.
+    I file che non si possono spostare restano al primo livello e ancora
+    raggiungibili (la migrazione riprova al prossimo avvio).
+    """
+
+    def __init__(self):
+        self._task = None
+        self.stats = {kind: {"moved": 0, "failed": 0} for kind in SHARD_DIRS}
+
+    async def start(self):
+        for directory in SHARD_DIRS.values():
+            if await asyncio.to_thread(_flat_audio_files, directory, 1):
+                FLAT_AUDIO_DIRS.add(directory)
+        if FLAT_AUDIO_DIRS:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(SHARD_MIGRATION_START_DELAY)
+        for kind, directory in SHARD_DIRS.items():
+            if directory not in FLAT_AUDIO_DIRS:
+                continue
+            try:
+                await self.migrate(kind, directory)
+            except Exception:
+                logger.exception("Migrazione a shard fallita per %s", directory)
+
+    async def migrate(self, kind: str, directory: Path):
+        logger.info("Migrazione di %s nel layout a shard", directory)
+        stats = self.stats[kind]
+        stuck = set()
+        while True:
+            names = await asyncio.to_thread(_flat_audio_files, directory, SHARD_MIGRATION_BATCH + len(stuck))
+            batch = [name for name in names if name not in stuck][:SHARD_MIGRATION_BATCH]
+            if not batch:
+                break
+            moved, failed = await asyncio.to_thread(_shard_files, directory, batch)
+            stats["moved"] += moved
+            stats["failed"] += len(failed)
+            stuck.update(failed)
+            await asyncio.sleep(SHARD_MIGRATION_PAUSE)
+        if not stuck:
+            FLAT_AUDIO_DIRS.discard(directory)
+        logger.info("Migrazione di %s: %d file spostati, %d rimasti al primo livello",
+                    directory, stats["moved"], len(stuck))
+
+    def status(self) -> dict:
+        return {
+            kind: {"flat_layout": directory in FLAT_AUDIO_DIRS, **self.stats[kind]}
+            for kind, directory in SHARD_DIRS.items()
+        }
+
+shard_migration = AudioShardMigration()
+
+@metrics.collector
+def _shard_metrics():
+    for kind, directory in SHARD_DIRS.items():
+        yield "audioci_shard_migration_pending", (kind,), int(directory in FLAT_AUDIO_DIRS)
+        for outcome in ("moved", "failed"):
+            yield "audioci_shard_migration_files_total", (kind, outcome), shard_migration.stats[kind][outcome]
+
 # API Routes
 
+# Tempi di avvio per fase, esposti in /api/status
+startup_timings = {"import_ms": None, "phases_ms": {}, "total_ms": None, "schema": None}
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings["phases_ms"][name] = round((time.perf_counter() - start) * 1000, 2)
+
 @app.on_event("startup")
 async def startup():
-    ANNOUNCEMENTS_DIR.mkdir(parents=True, exist_ok=True)
-    MUSIC_DIR.mkdir(parents=True, exist_ok=True)
-    await init_db()
+    start = time.perf_counter()
+    with startup_phase("directories"):
+        ANNOUNCEMENTS_DIR.mkdir(parents=True, exist_ok=True)
+        MUSIC_DIR.mkdir(parents=True, exist_ok=True)
+        UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    with startup_phase("init_db"):
+        startup_timings["schema"] = "applied" if await init_db() else "up_to_date"
+    with startup_phase("background_tasks"):
+        await manager.start()
+        await play_log.start()
+        await scheduler.start()
+        await shard_migration.start()
+        await storage_reconciler.start()
+        await analyzer.start()
+        await uploads.start()
+    with startup_phase("recordings_prune"):
+        await recorder.prune()
+    startup_timings["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await scheduler.stop()
+    await shard_migration.stop()
+    await storage_reconciler.stop()
+    await analyzer.stop()
+    await uploads.stop()
+    playback.shutdown()
+    controller_limiter.shutdown()
+    await mixer.shutdown()
+    shutdown_audio_pool()
+    await recorder.stop()
+    await play_log.stop()
+    await manager.stop()
 
 # Auth
 @app.post("/api/auth/login", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM users WHERE username = ?", (form_data.username,)
@@ -447,7 +1542,7 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 # Users (admin only)
 @app.get("/api/users", response_model=List[UserResponse])
 async def get_users(admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT id, username, role FROM users")
         users = await cursor.fetchall()
@@ -456,7 +1551,7 @@ async def get_users(admin: dict = Depends(get_admin_user)):
 @app.post("/api/users", response_model=UserResponse)
 async def create_user(user: UserCreate, admin: dict = Depends(get_admin_user)):
     password_hash = pwd_context.hash(user.password)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         try:
             cursor = await db.execute(
                 "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
@@ -469,7 +1564,7 @@ async def create_user(user: UserCreate, admin: dict = Depends(get_admin_user)):
 
 @app.delete("/api/users/{user_id}")
 async def delete_user(user_id: int, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         await db.execute("DELETE FROM users WHERE id = ? AND username != 'admin'", (user_id,))
         await db.commit()
     return {"status": "ok"}
@@ -477,7 +1572,7 @@ async def delete_user(user_id: int, admin: dict = Depends(get_admin_user)):
 # Groups
 @app.get("/api/groups", response_model=List[GroupResponse])
 async def get_groups(current_user: dict = Depends(get_current_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM groups ORDER BY position")
         groups = await cursor.fetchall()
@@ -485,7 +1580,7 @@ async def get_groups(current_user: dict = Depends(get_current_user)):
 
 @app.post("/api/groups", response_model=GroupResponse)
 async def create_group(group: GroupCreate, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         cursor = await db.execute("SELECT COALESCE(MAX(position), 0) + 1 FROM groups")
         position = (await cursor.fetchone())[0]
         cursor = await db.execute(
@@ -497,7 +1592,7 @@ async def create_group(group: GroupCreate, admin: dict = Depends(get_admin_user)
 
 @app.put("/api/groups/{group_id}", response_model=GroupResponse)
 async def update_group(group_id: int, group: GroupCreate, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         await db.execute(
             "UPDATE groups SET name = ?, color = ?, icon = ? WHERE id = ?",
             (group.name, group.color, group.icon, group_id)
@@ -510,40 +1605,122 @@ async def update_group(group_id: int, group: GroupCreate, admin: dict = Depends(
 
 @app.delete("/api/groups/{group_id}")
 async def delete_group(group_id: int, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         await db.execute("DELETE FROM groups WHERE id = ?", (group_id,))
         await db.commit()
     return {"status": "ok"}
 
 # Announcements
-@app.get("/api/announcements", response_model=List[AnnouncementResponse])
-async def get_announcements(group_id: Optional[int] = None, current_user: dict = Depends(get_current_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        if group_id:
-            cursor = await db.execute(
-                "SELECT * FROM announcements WHERE group_id = ? ORDER BY position", (group_id,)
-            )
+# Paginazione a chiave dei cataloghi: cursor opaco con i valori della chiave
+# dell'ultima riga restituita; X-Total-Count solo sulla prima pagina.
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Cursore non valido")
+    return values
+
+def parse_fields(fields: Optional[str], allowed: tuple) -> List[str]:
+    if not fields:
+        return list(allowed)
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campo non valido: {', '.join(unknown)}")
+    return selected
+
+async def fetch_keyset_page(db, table: str, columns: List[str], key: tuple, conditions: list, params: list,
+                            cursor: Optional[str], limit: Optional[int]):
+    """
+    SELECT ordinata sulla chiave (l'ultima colonna deve essere univoca, di solito id).
+    Ritorna (righe, header di paginazione). Senza limit restituisce tutto.
+    """
+    where = list(conditions)
+    values = list(params)
+    if cursor:
+        where.append(f"({', '.join(key)}) > ({', '.join('?' * len(key))})")
+        values.extend(decode_cursor(cursor, len(key)))
+    sql = f"SELECT {', '.join(dict.fromkeys([*columns, *key]))} FROM {table}"
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    sql += f" ORDER BY {', '.join(key)}"
+    if limit is not None:
+        limit = max(1, min(limit, CATALOG_MAX_LIMIT))
+        sql += " LIMIT ?"
+        values.append(limit + 1)
+
+    db.row_factory = aiosqlite.Row
+    rows = await (await db.execute(sql, values)).fetchall()
+    headers = {}
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([rows[-1][k] for k in key])
+    if not cursor:
+        if "X-Next-Cursor" in headers:
+            count_sql = f"SELECT COUNT(*) FROM {table}"
+            if conditions:
+                count_sql += f" WHERE {' AND '.join(conditions)}"
+            total = (await (await db.execute(count_sql, params)).fetchone())[0]
         else:
-            cursor = await db.execute("SELECT * FROM announcements ORDER BY position")
-        announcements = await cursor.fetchall()
+            total = len(rows)
+        headers["X-Total-Count"] = str(total)
+    return rows, headers
+
+# La risposta e' costruita a mano (FastJSONResponse, campi parziali): lo schema OpenAPI viene da responses
+@app.get("/api/announcements", response_model=None, responses={200: {
+    "model": List[AnnouncementFields],
+    "description": "Annunci con i soli campi chiesti in fields; header X-Next-Cursor se c'e' una pagina successiva",
+}})
+async def get_announcements(
+    group_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Annunci ordinati per posizione. Con limit la risposta e' paginata:
+    la pagina successiva si chiede con cursor = header X-Next-Cursor.
+    fields limita le colonne restituite (es. fields=id,name).
+    """
+    selected = parse_fields(fields, ANNOUNCEMENT_FIELDS)
+    columns = [f for f in selected if f != "files"]
+    async with db_connect() as db:
+        conditions, params = [], []
+        if group_id:
+            conditions.append("group_id = ?")
+            params.append(group_id)
+        rows, headers = await fetch_keyset_page(
+            db, "announcements", columns, ("position", "id"), conditions, params, cursor, limit
+        )
 
-        result = []
-        for a in announcements:
-            cursor = await db.execute(
-                "SELECT file_path FROM announcement_files WHERE announcement_id = ? ORDER BY file_order",
-                (a["id"],)
-            )
-            files = [f["file_path"] for f in await cursor.fetchall()]
-            result.append(AnnouncementResponse(
-                id=a["id"], name=a["name"], group_id=a["group_id"],
-                color=a["color"], position=a["position"], files=files
-            ))
-        return result
+        files = {}
+        if "files" in selected and rows:
+            ids = [r["id"] for r in rows]
+            file_rows = await (await db.execute(
+                f"SELECT announcement_id, file_path FROM announcement_files WHERE announcement_id IN ({','.join('?' * len(ids))}) "
+                "ORDER BY announcement_id, file_order", ids
+            )).fetchall()
+            for r in file_rows:
+                files.setdefault(r["announcement_id"], []).append(r["file_path"])
+
+    items = []
+    for r in rows:
+        item = {c: r[c] for c in columns}
+        if "files" in selected:
+            item["files"] = files.get(r["id"], [])
+        items.append(item)
+    return FastJSONResponse(items, headers=headers)
 
 @app.post("/api/announcements", response_model=AnnouncementResponse)
 async def create_announcement(announcement: AnnouncementCreate, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         cursor = await db.execute(
             "SELECT COALESCE(MAX(position), 0) + 1 FROM announcements WHERE group_id = ?",
             (announcement.group_id,)
@@ -564,18 +1741,38 @@ async def create_announcement(announcement: AnnouncementCreate, admin: dict = De
 async def bulk_upload_announcements(
     group_id: int = Form(...),
     files: List[UploadFile] = File(...),
+    skip_duplicates: bool = Form(False),
     admin: dict = Depends(get_admin_user)
 ):
     """
     Carica multipli file audio e crea automaticamente un annuncio per ognuno.
     Il nome dell'annuncio viene preso dal nome del file (senza estensione).
+    I file vengono prima analizzati in parallelo (impronta acustica): i
+    probabili duplicati di annunci esistenti o di file dello stesso lotto
+    sono elencati in "duplicates" e, con skip_duplicates, non importati.
     """
     created_announcements = []
+    duplicates = []
+    saved = []
     
-    async with aiosqlite.connect(DB_PATH) as db:
-        for file in files:
-            # Estrai nome senza estensione e sanitizza
-            original_filename = sanitize_filename(file.filename)
+    for file in files:
+        # Estrai nome senza estensione e sanitizza
+        original_filename = sanitize_filename(file.filename)
+        # Nome provvisorio fino alla creazione dell'annuncio (il definitivo ne contiene l'id)
+        fd, provisional = tempfile.mkstemp(dir=ANNOUNCEMENTS_DIR, prefix=".import_", suffix="_" + original_filename)
+        await _save_upload(file, os.fdopen(fd, "wb"))
+        saved.append((original_filename, Path(provisional)))
+
+    analyses = await analyzer.analyze_batch([provisional for _, provisional in saved])
+
+    skipped = []
+    async with db_connect() as db:
+        for (original_filename, provisional), analysis in zip(saved, analyses):
+            match = await find_duplicate(db, "announcements", *analysis) if analysis else None
+            if match and skip_duplicates:
+                duplicates.append({"file": original_filename, "duplicate_of": match, "skipped": True})
+                skipped.append(provisional)
+                continue
             name_without_ext = Path(original_filename).stem
             
             # Crea annuncio
@@ -591,19 +1788,22 @@ async def bulk_upload_announcements(
             )
             announcement_id = cursor.lastrowid
             
-            # Salva file
+            # Nome definitivo del file (e della sua forma d'onda)
             safe_filename = f"{announcement_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{original_filename}"
-            filepath = ANNOUNCEMENTS_DIR / safe_filename
-            
-            content = await file.read()
-            with open(filepath, "wb") as f:
-                f.write(content)
+            filepath = new_audio_file(ANNOUNCEMENTS_DIR, safe_filename)
+            os.replace(provisional, filepath)
+            with contextlib.suppress(FileNotFoundError):
+                os.replace(peaks_path(provisional), peaks_path(filepath))
             
             # Registra file in DB
             await db.execute(
                 "INSERT INTO announcement_files (announcement_id, file_path, file_order) VALUES (?, ?, ?)",
                 (announcement_id, safe_filename, 1)
             )
+            if analysis:
+                await register_fingerprint(db, "announcements", announcement_id, safe_filename, *analysis)
+            if match:
+                duplicates.append({"file": original_filename, "id": announcement_id, "duplicate_of": match, "skipped": False})
             
             created_announcements.append(AnnouncementResponse(
                 id=announcement_id,
@@ -615,8 +1815,13 @@ async def bulk_upload_announcements(
             ))
         
         await db.commit()
-    
-    return {"created": len(created_announcements), "announcements": created_announcements}
+
+    await asyncio.to_thread(_unlink_files, skipped)
+    count_duplicates("announcements", duplicates)
+    return {
+        "created": len(created_announcements), "announcements": created_announcements,
+        "duplicates": duplicates, "unchecked": analyses.count(None)
+    }
 
 # Sposta annunci in un altro gruppo
 @app.put("/api/announcements/move")
@@ -626,7 +1831,7 @@ async def move_announcements(
     admin: dict = Depends(get_admin_user)
 ):
     """Sposta uno o piu' annunci in un altro gruppo"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         for ann_id in announcement_ids:
             await db.execute(
                 "UPDATE announcements SET group_id = ? WHERE id = ?",
@@ -635,21 +1840,40 @@ async def move_announcements(
         await db.commit()
     return {"status": "ok", "moved": len(announcement_ids)}
 
+async def _save_upload(file: UploadFile, target):
+    """Copia a blocchi l'upload nel file aperto target (poi chiuso), in un thread: niente file interi in RAM"""
+    def copy():
+        with target:
+            shutil.copyfileobj(file.file, target, 1024 * 1024)
+    await asyncio.to_thread(copy)
+
+def _unlink_files(paths: List[Path]):
+    """Elimina i file audio insieme alle rispettive forme d'onda"""
+    for path in paths:
+        for target in (path, peaks_path(path)):
+            try:
+                target.unlink()
+            except FileNotFoundError:
+                pass
+
 @app.delete("/api/announcements/{announcement_id}")
 async def delete_announcement(announcement_id: int, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT file_path FROM announcement_files WHERE announcement_id = ?", (announcement_id,)
         )
-        files = await cursor.fetchall()
-        for f in files:
-            filepath = ANNOUNCEMENTS_DIR / f["file_path"]
-            if filepath.exists():
-                filepath.unlink()
+        files = [audio_file(ANNOUNCEMENTS_DIR, f["file_path"]) for f in await cursor.fetchall()]
 
+        await db.execute("DELETE FROM sequence_items WHERE announcement_id = ?", (announcement_id,))
+        await db.execute("DELETE FROM announcement_files WHERE announcement_id = ?", (announcement_id,))
+        await db.execute("DELETE FROM audio_fingerprints WHERE kind = 'announcements' AND ref_id = ?", (announcement_id,))
         await db.execute("DELETE FROM announcements WHERE id = ?", (announcement_id,))
         await db.commit()
+    # Rimozione dei file fuori dall'event loop (dopo il commit: al peggio restano
+    # file orfani, che la riconciliazione dello storage recupera)
+    audio_cache.invalidate(files)
+    await asyncio.to_thread(_unlink_files, files)
     return {"status": "ok"}
 
 # File upload
@@ -661,13 +1885,13 @@ async def upload_announcement_file(
 ):
     safe_name = sanitize_filename(file.filename)
     filename = f"{announcement_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{safe_name}"
-    filepath = ANNOUNCEMENTS_DIR / filename
+    filepath = new_audio_file(ANNOUNCEMENTS_DIR, filename)
 
     content = await file.read()
     with open(filepath, "wb") as f:
         f.write(content)
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         cursor = await db.execute(
             "SELECT COALESCE(MAX(file_order), 0) + 1 FROM announcement_files WHERE announcement_id = ?",
             (announcement_id,)
@@ -679,12 +1903,13 @@ async def upload_announcement_file(
         )
         await db.commit()
 
+    analyzer.schedule(filepath, ("announcements", announcement_id))
     return {"filename": filename}
 
 # Sequences API
 @app.get("/api/sequences", response_model=List[SequenceResponse])
 async def get_sequences(current_user: dict = Depends(get_current_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM sequences ORDER BY group_id, position")
         sequences = await cursor.fetchall()
@@ -733,7 +1958,7 @@ async def create_sequence(seq: SequenceCreate, current_user: dict = Depends(get_
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Solo admin può creare sequenze")
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT MAX(position) FROM sequences WHERE group_id = ?", (seq.group_id,))
         max_pos = await cursor.fetchone()
@@ -788,7 +2013,7 @@ async def update_sequence(sequence_id: int, seq: SequenceUpdate, current_user: d
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Solo admin può modificare sequenze")
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
 
         # Update sequence fields
@@ -850,12 +2075,249 @@ async def delete_sequence(sequence_id: int, current_user: dict = Depends(get_cur
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Solo admin può eliminare sequenze")
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         await db.execute("DELETE FROM sequence_items WHERE sequence_id = ?", (sequence_id,))
         await db.execute("DELETE FROM sequences WHERE id = ?", (sequence_id,))
         await db.commit()
     return {"status": "deleted"}
 
+# ============== BACKEND TTS E TRADUZIONE ==============
+
+class TTSUnavailable(Exception):
+    """Backend TTS/traduzione irraggiungibile, in timeout o con circuito aperto"""
+
+class CircuitBreaker:
+    """
+    Dopo TTS_BREAKER_FAILURES errori consecutivi il circuito si apre e le
+    chiamate falliscono subito (senza attendere il timeout) per
+    TTS_BREAKER_COOLDOWN secondi; poi passa una sola chiamata di prova
+    alla volta (le altre sono rifiutate): il successo lo richiude, l'errore
+    lo riapre.
+    """
+
+    def __init__(self, name: str, max_failures: int = TTS_BREAKER_FAILURES, cooldown: float = TTS_BREAKER_COOLDOWN):
+        self.name = name
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False              # chiamata di prova in corso (half_open)
+        self.stats = {"ok": 0, "error": 0, "timeout": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    @property
+    def blocked(self) -> bool:
+        """Una chiamata adesso verrebbe rifiutata"""
+        state = self.state
+        return state == "open" or (state == "half_open" and self._probing)
+
+    async def call(self, factory, timeout: float):
+        if self.blocked:
+            self.stats["rejected"] += 1
+            raise TTSUnavailable(f"{self.name}: servizio non disponibile")
+        probe = self.state == "half_open"
+        if probe:
+            self._probing = True
+        try:
+            result = await asyncio.wait_for(factory(), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeout"] += 1
+            self._failure()
+            raise TTSUnavailable(f"{self.name}: timeout dopo {timeout:g}s")
+        except Exception:
+            self.stats["error"] += 1
+            self._failure()
+            raise
+        finally:
+            if probe:
+                self._probing = False
+        self.stats["ok"] += 1
+        self.failures = 0
+        self.opened_at = None
+        return result
+
+    def _failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures or self.opened_at is not None:
+            if self.opened_at is None:
+                logger.warning("%s: circuito aperto dopo %d errori", self.name, self.failures)
+            self.opened_at = time.monotonic()
+
+    def status(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+
+class TTSBackend:
+    """
+    Interfaccia dei backend TTS/traduzione. translate() riceve tutte le
+    lingue di destinazione in una sola chiamata e ritorna {lingua: testo}
+    (le lingue mancanti usano il testo originale); synthesize() scrive
+    l'audio del testo in path, con estensione `extension`.
+    """
+
+    name = "base"
+    extension = ".mp3"
+    translate_timeout = TTS_TRANSLATE_TIMEOUT
+    synth_timeout = TTS_SYNTH_TIMEOUT
+
+    async def translate(self, text: str, source: str, targets: List[str]) -> Dict[str, str]:
+        raise NotImplementedError
+
+    async def synthesize(self, text: str, voice: str, path: Path):
+        raise NotImplementedError
+
+class EdgeTTSBackend(TTSBackend):
+    """edge-tts per la sintesi, Google Translate (deep_translator) per la traduzione"""
+
+    name = "edge"
+    extension = ".mp3"
+    _translate_pool = None
+
+    @classmethod
+    def translate_pool(cls) -> ThreadPoolExecutor:
+        """
+        Thread dedicati alle traduzioni: wait_for non puo' fermare una chiamata
+        bloccante scaduta, che continua a occupare il suo thread; cosi' ne
+        restano al massimo TTS_TRANSLATE_WORKERS e il pool di default e' salvo.
+        """
+        if cls._translate_pool is None:
+            cls._translate_pool = ThreadPoolExecutor(TTS_TRANSLATE_WORKERS, thread_name_prefix="tts-translate")
+        return cls._translate_pool
+
+    async def translate(self, text: str, source: str, targets: List[str]) -> Dict[str, str]:
+        _, translator_class = await asyncio.to_thread(_load_tts)
+        # deep_translator traduce verso una lingua per volta: le richieste partono in parallelo
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.translate_pool(),
+                                 lambda target=target: translator_class(source=source, target=target).translate(text))
+            for target in targets
+        ), return_exceptions=True)
+        translations = {target: result for target, result in zip(targets, results) if isinstance(result, str)}
+        if not translations:
+            raise next(r for r in results if isinstance(r, BaseException))
+        return translations
+
+    async def synthesize(self, text: str, voice: str, path: Path):
+        edge_tts_module, _ = await asyncio.to_thread(_load_tts)
+        await edge_tts_module.Communicate(text, voice).save(str(path))
+
+class LocalTTSBackend(TTSBackend):
+    """
+    Sostituto offline e deterministico per test e benchmark: la traduzione
+    antepone il codice lingua, la sintesi scrive un WAV con un breve tono per
+    carattere (stesso testo e voce, stesso file). latency e fail simulano un
+    servizio lento o irraggiungibile.
+    """
+
+    name = "local"
+    extension = ".wav"
+    sample_rate = 16000
+    char_seconds = 0.06
+
+    def __init__(self, latency: float = 0.0, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+
+    async def _simulate(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError("backend TTS locale: errore simulato")
+
+    async def translate(self, text: str, source: str, targets: List[str]) -> Dict[str, str]:
+        await self._simulate()
+        return {target: f"[{target}] {text}" for target in targets}
+
+    async def synthesize(self, text: str, voice: str, path: Path):
+        await self._simulate()
+        await asyncio.to_thread(self._write_wav, text, voice, path)
+
+    def _write_wav(self, text: str, voice: str, path: Path):
+        import math
+        import wave
+        from array import array
+
+        offset = hashlib.sha256(voice.encode()).digest()[0]
+        n = int(self.sample_rate * self.char_seconds)
+        fade = [min(1.0, i / 200, (n - i) / 200) for i in range(n)]
+        tones = {}
+        samples = array("h")
+        for ch in text:
+            tone = tones.get(ch)
+            if tone is None:
+                step = 2 * math.pi * (200 + (ord(ch) * 7 + offset) % 600) / self.sample_rate
+                tone = tones[ch] = array("h", (int(12000 * fade[k] * math.sin(step * k)) for k in range(n)))
+            samples.extend(tone)
+        with wave.open(str(path), "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(samples.tobytes())
+
+TTS_BACKENDS = {"edge": EdgeTTSBackend, "local": LocalTTSBackend}
+
+class TTSService:
+    """Backend TTS corrente con timeout e un circuito per la traduzione e uno per la sintesi"""
+
+    def __init__(self, backend: TTSBackend):
+        self.use(backend)
+
+    def use(self, backend: TTSBackend):
+        self.backend = backend
+        self.translate_breaker = CircuitBreaker(f"Traduzione ({backend.name})")
+        self.synth_breaker = CircuitBreaker(f"Sintesi TTS ({backend.name})")
+
+    async def translate(self, text: str, source: str, targets: List[str]) -> Dict[str, str]:
+        """Tutte le lingue in una chiamata; se la traduzione non e' disponibile resta il testo originale"""
+        if not targets:
+            return {}
+        start = time.perf_counter()
+        try:
+            translations = await self.translate_breaker.call(
+                lambda: self.backend.translate(text, source, targets), self.backend.translate_timeout
+            )
+        except Exception as e:
+            logger.warning("Traduzione non disponibile, uso il testo originale: %s", e)
+            translations = {}
+        metrics.observe("audioci_tts_seconds", ("translate", "batch"), time.perf_counter() - start)
+        return {target: translations.get(target) or text for target in targets}
+
+    async def synthesize(self, text: str, voice: str, path: Path, lang: str):
+        start = time.perf_counter()
+        await self.synth_breaker.call(lambda: self.backend.synthesize(text, voice, path), self.backend.synth_timeout)
+        metrics.observe("audioci_tts_seconds", ("synthesize", lang), time.perf_counter() - start)
+
+    def check(self):
+        """Fallisce subito se la sintesi e' a circuito aperto (senza tentare la traduzione)"""
+        if self.synth_breaker.blocked:
+            self.synth_breaker.stats["rejected"] += 1
+            raise TTSUnavailable(f"{self.synth_breaker.name}: servizio non disponibile")
+
+    def status(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "translate": self.translate_breaker.status(),
+            "synthesize": self.synth_breaker.status(),
+        }
+
+if TTS_BACKEND not in TTS_BACKENDS:
+    logger.warning("AUDIOCI_TTS_BACKEND=%s sconosciuto, uso edge", TTS_BACKEND)
+tts = TTSService(TTS_BACKENDS.get(TTS_BACKEND, EdgeTTSBackend)())
+
+TTS_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+@metrics.collector
+def _tts_metrics():
+    for stage, breaker in (("translate", tts.translate_breaker), ("synthesize", tts.synth_breaker)):
+        yield "audioci_tts_breaker_state", (stage,), TTS_BREAKER_STATES[breaker.state]
+        for outcome, count in breaker.stats.items():
+            yield "audioci_tts_calls_total", (stage, outcome), count
+
 # TTS Generation API
 @app.get("/api/tts/languages")
 async def get_tts_languages(current_user: dict = Depends(get_current_user)):
@@ -868,6 +2330,11 @@ async def get_tts_languages(current_user: dict = Depends(get_current_user)):
         "genders": ["male", "female"]
     }
 
+@app.get("/api/tts/status")
+async def get_tts_status(admin: dict = Depends(get_admin_user)):
+    """Backend TTS in uso e stato dei circuiti"""
+    return tts.status()
+
 @app.post("/api/tts/generate", response_model=TTSResponse)
 async def generate_tts(request: TTSRequest, admin: dict = Depends(get_admin_user)):
     """Generate TTS announcements with translation"""
@@ -880,29 +2347,36 @@ async def generate_tts(request: TTSRequest, admin: dict = Depends(get_admin_user
         if not original_text:
             raise HTTPException(status_code=400, detail="Testo vuoto")
 
-        async with aiosqlite.connect(DB_PATH) as db:
+        languages = [lang for lang in dict.fromkeys(request.languages) if lang in TTS_VOICES]
+        tts.check()
+
+        # Traduzione di tutte le lingue in una sola chiamata al backend (l'italiano e' il sorgente)
+        texts = await tts.translate(original_text, "it", [lang for lang in languages if lang != "it"])
+        texts["it"] = original_text
+
+        # Sintesi di tutte le lingue in parallelo, su file provvisori fino alla creazione degli annunci
+        provisional = {}
+        for lang in languages:
+            fd, path = tempfile.mkstemp(dir=ANNOUNCEMENTS_DIR, prefix=".tts_", suffix=tts.backend.extension)
+            os.close(fd)
+            provisional[lang] = Path(path)
+        tasks = [
+            asyncio.ensure_future(tts.synthesize(texts[lang], TTS_VOICES[lang][request.voice_gender], provisional[lang], lang))
+            for lang in languages
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(_unlink_files, list(provisional.values()))
+            raise
+
+        async with db_connect() as db:
             db.row_factory = aiosqlite.Row
 
-            for lang in request.languages:
-                if lang not in TTS_VOICES:
-                    continue
-
-                # Translate text if not Italian (source language)
-                if lang == "it":
-                    text_to_speak = original_text
-                else:
-                    try:
-                        translator = GoogleTranslator(source='it', target=lang)
-                        text_to_speak = translator.translate(original_text)
-                    except Exception as e:
-                        text_to_speak = original_text  # Fallback to original
-
-                # Get voice based on gender
-                voice = TTS_VOICES[lang][request.voice_gender]
-
-                # Generate audio using edge-tts
-                communicate = edge_tts.Communicate(text_to_speak, voice)
-
+            for lang in languages:
                 # Create announcement in database
                 cursor = await db.execute(
                     "SELECT COALESCE(MAX(position), 0) + 1 FROM announcements WHERE group_id = ?",
@@ -918,10 +2392,9 @@ async def generate_tts(request: TTSRequest, admin: dict = Depends(get_admin_user
                 announcement_id = cursor.lastrowid
 
                 # Save audio file
-                filename = f"{announcement_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{lang}.mp3"
-                filepath = ANNOUNCEMENTS_DIR / filename
-
-                await communicate.save(str(filepath))
+                filename = f"{announcement_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{lang}{tts.backend.extension}"
+                filepath = new_audio_file(ANNOUNCEMENTS_DIR, filename)
+                os.replace(provisional[lang], filepath)
 
                 # Add file to database
                 await db.execute(
@@ -930,6 +2403,7 @@ async def generate_tts(request: TTSRequest, admin: dict = Depends(get_admin_user
                 )
 
                 await db.commit()
+                analyzer.schedule(filepath, ("announcements", announcement_id))
 
                 created_announcement_ids.append(announcement_id)
                 created_announcements.append(AnnouncementResponse(
@@ -973,19 +2447,31 @@ async def generate_tts(request: TTSRequest, admin: dict = Depends(get_admin_user
                     (f" e 1 sequenza" if sequence_id else "")
         )
 
+    except HTTPException:
+        raise
+    except TTSUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Servizio TTS non disponibile: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore generazione TTS: {str(e)}")
 
 # ============== MUSIC API ==============
 
 # Get all music tracks
-@app.get("/api/music", response_model=List[MusicResponse])
-async def get_music(current_user: dict = Depends(get_current_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM music ORDER BY title")
-        tracks = await cursor.fetchall()
-        return [MusicResponse(**dict(t)) for t in tracks]
+@app.get("/api/music", response_model=None, responses={200: {
+    "model": List[MusicFields],
+    "description": "Brani con i soli campi chiesti in fields; header X-Next-Cursor se c'e' una pagina successiva",
+}})
+async def get_music(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Brani ordinati per titolo; paginazione e selezione campi come /api/announcements"""
+    columns = parse_fields(fields, MUSIC_FIELDS)
+    async with db_connect() as db:
+        rows, headers = await fetch_keyset_page(db, "music", columns, ("title", "id"), [], [], cursor, limit)
+    return FastJSONResponse([{c: r[c] for c in columns} for r in rows], headers=headers)
 
 # Upload music track
 @app.post("/api/music", response_model=MusicResponse)
@@ -1003,59 +2489,89 @@ async def upload_music(
 
     # Save file
     filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{original_filename}"
-    filepath = MUSIC_DIR / filename
+    filepath = new_audio_file(MUSIC_DIR, filename)
 
     content = await file.read()
     with open(filepath, "wb") as f:
         f.write(content)
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    return await ingest_music(filepath, title, artist)
+
+async def ingest_music(filepath: Path, title: str, artist: Optional[str]) -> MusicResponse:
+    """Registra in libreria un brano gia' salvato in MUSIC_DIR e ne accoda l'analisi"""
+    async with db_connect() as db:
         cursor = await db.execute(
             "INSERT INTO music (title, artist, file_path) VALUES (?, ?, ?)",
-            (title, artist, filename)
+            (title, artist, filepath.name)
         )
         await db.commit()
         music_id = cursor.lastrowid
 
-    return MusicResponse(id=music_id, title=title, artist=artist, file_path=filename, duration=None)
+    analyzer.schedule(filepath, ("music", music_id))
+    return MusicResponse(id=music_id, title=title, artist=artist, file_path=filepath.name, duration=None)
 
 # Bulk upload music
 @app.post("/api/music/bulk-upload")
 async def bulk_upload_music(
     files: List[UploadFile] = File(...),
+    skip_duplicates: bool = Form(False),
     admin: dict = Depends(get_admin_user)
 ):
+    """
+    Importa piu' brani. I file vengono prima analizzati in parallelo
+    (impronta acustica): i probabili duplicati di brani in libreria o di file
+    dello stesso lotto sono elencati in "duplicates" e, con skip_duplicates,
+    non importati.
+    """
     created_tracks = []
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        for file in files:
-            original_filename = sanitize_filename(file.filename)
+    duplicates = []
+    saved = []
+
+    for file in files:
+        original_filename = sanitize_filename(file.filename)
+        filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{original_filename}"
+        filepath = new_audio_file(MUSIC_DIR, filename)
+        await _save_upload(file, open(filepath, "wb"))
+        saved.append((original_filename, filename, filepath))
+
+    analyses = await analyzer.analyze_batch([filepath for _, _, filepath in saved])
+
+    skipped = []
+    async with db_connect() as db:
+        for (original_filename, filename, filepath), analysis in zip(saved, analyses):
+            match = await find_duplicate(db, "music", *analysis) if analysis else None
+            if match and skip_duplicates:
+                duplicates.append({"file": original_filename, "duplicate_of": match, "skipped": True})
+                skipped.append(filepath)
+                continue
             title = Path(original_filename).stem
 
-            filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{original_filename}"
-            filepath = MUSIC_DIR / filename
-
-            content = await file.read()
-            with open(filepath, "wb") as f:
-                f.write(content)
-
             cursor = await db.execute(
                 "INSERT INTO music (title, artist, file_path) VALUES (?, ?, ?)",
                 (title, None, filename)
             )
             music_id = cursor.lastrowid
+            if analysis:
+                await register_fingerprint(db, "music", music_id, filename, *analysis)
+            if match:
+                duplicates.append({"file": original_filename, "id": music_id, "duplicate_of": match, "skipped": False})
             created_tracks.append(MusicResponse(
                 id=music_id, title=title, artist=None, file_path=filename, duration=None
             ))
 
         await db.commit()
 
-    return {"created": len(created_tracks), "tracks": created_tracks}
+    await asyncio.to_thread(_unlink_files, skipped)
+    count_duplicates("music", duplicates)
+    return {
+        "created": len(created_tracks), "tracks": created_tracks,
+        "duplicates": duplicates, "unchecked": analyses.count(None)
+    }
 
 # Update music track
 @app.put("/api/music/{music_id}", response_model=MusicResponse)
 async def update_music(music_id: int, data: MusicCreate, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         await db.execute(
             "UPDATE music SET title = ?, artist = ? WHERE id = ?",
             (data.title, data.artist, music_id)
@@ -1072,18 +2588,274 @@ async def update_music(music_id: int, data: MusicCreate, admin: dict = Depends(g
 # Delete music track
 @app.delete("/api/music/{music_id}")
 async def delete_music(music_id: int, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT file_path FROM music WHERE id = ?", (music_id,))
         track = await cursor.fetchone()
-        if track:
-            filepath = MUSIC_DIR / track["file_path"]
-            if filepath.exists():
-                filepath.unlink()
 
         await db.execute("DELETE FROM playlist_items WHERE music_id = ?", (music_id,))
+        await db.execute("DELETE FROM audio_fingerprints WHERE kind = 'music' AND ref_id = ?", (music_id,))
         await db.execute("DELETE FROM music WHERE id = ?", (music_id,))
         await db.commit()
+    if track:
+        files = [audio_file(MUSIC_DIR, track["file_path"])]
+        audio_cache.invalidate(files)
+        await asyncio.to_thread(_unlink_files, files)
+    return {"status": "ok"}
+
+# ============== UPLOAD RIPRENDIBILI (a blocchi) ==============
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+def _preallocate(path: Path, size: int):
+    """File parziale della dimensione finale, in cui i blocchi vengono scritti al loro posto"""
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+def _write_chunk(path: Path, offset: int, data: bytes, digest: str) -> bool:
+    """Verifica lo SHA-256 del blocco e lo scrive alla sua posizione; False se il checksum non torna"""
+    if hashlib.sha256(data).hexdigest() != digest:
+        return False
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+    return True
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(BACKUP_CHUNK_BYTES):
+            h.update(block)
+    return h.hexdigest()
+
+class ChunkedUploads:
+    """
+    Upload riprendibili: il client crea una sessione, invia i blocchi (anche
+    in parallelo) con PUT all'offset del blocco e lo SHA-256 in X-Chunk-Sha256,
+    chiede lo stato (offset confermato e blocchi mancanti) dopo una
+    disconnessione e infine completa: il file passa in MUSIC_DIR e segue il
+    normale import di un brano. Il file parziale e' preallocato in UPLOADS_DIR
+    e ogni blocco e' scritto al suo posto; i blocchi ricevuti sono nel DB.
+    Le sessioni ferme da UPLOAD_SESSION_TTL vengono eliminate.
+    Scrittura dei blocchi, completamento e annullamento della stessa sessione
+    passano da un lock per upload (la ricezione dei byte resta in parallelo):
+    un secondo complete o un PUT arrivato in ritardo trovano la sessione gia'
+    chiusa e ricevono 404 invece di un errore sul file parziale.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {"created": 0, "completed": 0, "aborted": 0, "expired": 0}
+
+    @staticmethod
+    def part_path(upload_id: str) -> Path:
+        return UPLOADS_DIR / f"{upload_id}.part"
+
+    def _lock(self, upload_id: str) -> asyncio.Lock:
+        """Lock della sessione; da chiedere solo dopo averne verificato l'esistenza"""
+        lock = self._locks.get(upload_id)
+        if lock is None:
+            lock = self._locks[upload_id] = asyncio.Lock()
+        return lock
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.expire()
+            except Exception:
+                logger.exception("Errore pulizia upload scaduti")
+            await asyncio.sleep(UPLOAD_CLEANUP_INTERVAL)
+
+    async def expire(self) -> int:
+        cutoff = (datetime.now() - timedelta(seconds=UPLOAD_SESSION_TTL)).isoformat()
+        async with db_connect() as db:
+            cursor = await db.execute("SELECT id FROM upload_sessions WHERE updated_at < ?", (cutoff,))
+            expired = [row[0] for row in await cursor.fetchall()]
+            for upload_id in expired:
+                await self._delete(db, upload_id)
+                self._locks.pop(upload_id, None)
+            await db.commit()
+        await asyncio.to_thread(_unlink_files, [self.part_path(u) for u in expired])
+        self.stats["expired"] += len(expired)
+        return len(expired)
+
+    @staticmethod
+    async def _delete(db, upload_id: str) -> bool:
+        """Elimina la sessione; False se non c'era piu' (gia' completata, annullata o scaduta)"""
+        await db.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+        cursor = await db.execute("DELETE FROM upload_sessions WHERE id = ?", (upload_id,))
+        return cursor.rowcount > 0
+
+    async def create(self, data: UploadCreate, username: str) -> dict:
+        chunk_size = min(UPLOAD_MAX_CHUNK, max(UPLOAD_MIN_CHUNK, data.chunk_size or UPLOAD_CHUNK_SIZE))
+        upload_id = os.urandom(16).hex()
+        part = self.part_path(upload_id)
+        await asyncio.to_thread(_preallocate, part, data.size)
+        now = datetime.now().isoformat()
+        async with db_connect() as db:
+            await db.execute(
+                """INSERT INTO upload_sessions (id, filename, size, chunk_size, sha256, title, artist,
+                   username, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (upload_id, sanitize_filename(data.filename), data.size, chunk_size,
+                 data.sha256.lower() if data.sha256 else None, data.title, data.artist, username, now, now)
+            )
+            await db.commit()
+        self.stats["created"] += 1
+        metrics.inc("audioci_uploads_total", ("created",))
+        return await self.status(upload_id)
+
+    async def session(self, db, upload_id: str) -> tuple:
+        """(sessione, indici dei blocchi ricevuti); 404 se non esiste"""
+        if not UPLOAD_ID_RE.match(upload_id):
+            raise HTTPException(status_code=404, detail="Upload non trovato")
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("SELECT * FROM upload_sessions WHERE id = ?", (upload_id,))
+        row = await cursor.fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Upload non trovato")
+        cursor = await db.execute("SELECT chunk FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+        return dict(row), {r[0] for r in await cursor.fetchall()}
+
+    @staticmethod
+    def describe(session: dict, chunks: set) -> dict:
+        size, chunk_size = session["size"], session["chunk_size"]
+        total = -(-size // chunk_size)
+        contiguous = 0
+        while contiguous in chunks:
+            contiguous += 1
+        updated = datetime.fromisoformat(session["updated_at"])
+        return {
+            "upload_id": session["id"],
+            "filename": session["filename"],
+            "size": size,
+            "chunk_size": chunk_size,
+            "committed_offset": min(size, contiguous * chunk_size),
+            "received_bytes": sum(min(chunk_size, size - i * chunk_size) for i in chunks),
+            "missing": [i * chunk_size for i in range(total) if i not in chunks],
+            "expires_at": (updated + timedelta(seconds=UPLOAD_SESSION_TTL)).isoformat(timespec="seconds"),
+        }
+
+    async def status(self, upload_id: str) -> dict:
+        async with db_connect() as db:
+            return self.describe(*await self.session(db, upload_id))
+
+    async def put_chunk(self, upload_id: str, offset: int, digest: str, request: Request) -> dict:
+        async with db_connect() as db:
+            session, _ = await self.session(db, upload_id)
+        size, chunk_size = session["size"], session["chunk_size"]
+        if offset < 0 or offset >= size or offset % chunk_size:
+            raise HTTPException(status_code=400, detail="Offset non allineato ai blocchi della sessione")
+        if not digest:
+            raise HTTPException(status_code=400, detail="Checksum del blocco mancante (X-Chunk-Sha256)")
+        expected = min(chunk_size, size - offset)
+        data = bytearray()
+        async for part in request.stream():
+            data += part
+            if len(data) > expected:
+                raise HTTPException(status_code=413, detail="Blocco piu' grande del previsto")
+        if len(data) != expected:
+            raise HTTPException(status_code=400, detail=f"Blocco incompleto: {len(data)} di {expected} byte")
+        async with self._lock(upload_id), db_connect() as db:
+            # La sessione potrebbe essere stata completata mentre arrivavano i byte
+            await self.session(db, upload_id)
+            try:
+                written = await asyncio.to_thread(_write_chunk, self.part_path(upload_id), offset, bytes(data),
+                                                  digest.lower())
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="Upload non trovato")
+            if not written:
+                metrics.inc("audioci_upload_chunks_total", ("bad_checksum",))
+                raise HTTPException(status_code=400, detail="Checksum del blocco non valido")
+            metrics.inc("audioci_upload_chunks_total", ("ok",))
+            metrics.inc("audioci_upload_bytes_total", (), expected)
+            await db.execute(
+                "INSERT OR REPLACE INTO upload_chunks (upload_id, chunk, sha256) VALUES (?, ?, ?)",
+                (upload_id, offset // chunk_size, digest.lower())
+            )
+            await db.execute("UPDATE upload_sessions SET updated_at = ? WHERE id = ?",
+                             (datetime.now().isoformat(), upload_id))
+            await db.commit()
+            return self.describe(*await self.session(db, upload_id))
+
+    async def complete(self, upload_id: str) -> MusicResponse:
+        await self.status(upload_id)
+        async with self._lock(upload_id):
+            async with db_connect() as db:
+                session, chunks = await self.session(db, upload_id)
+            missing = self.describe(session, chunks)["missing"]
+            if missing:
+                raise HTTPException(status_code=409, detail=f"Upload incompleto: mancano {len(missing)} blocchi")
+            part = self.part_path(upload_id)
+            if session["sha256"] and await asyncio.to_thread(_file_sha256, part) != session["sha256"]:
+                raise HTTPException(status_code=400, detail="Checksum del file non valido")
+
+            # La sessione si chiude nel DB prima di spostare il file: vince un solo complete
+            async with db_connect() as db:
+                claimed = await self._delete(db, upload_id)
+                await db.commit()
+            if not claimed:
+                raise HTTPException(status_code=404, detail="Upload non trovato")
+            self._locks.pop(upload_id, None)
+            filepath = new_audio_file(MUSIC_DIR, f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{session['filename']}")
+            try:
+                await asyncio.to_thread(os.replace, part, filepath)
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="Upload non trovato")
+        self.stats["completed"] += 1
+        metrics.inc("audioci_uploads_total", ("completed",))
+        return await ingest_music(filepath, session["title"] or Path(session["filename"]).stem, session["artist"])
+
+    async def abort(self, upload_id: str):
+        await self.status(upload_id)
+        async with self._lock(upload_id), db_connect() as db:
+            await self.session(db, upload_id)
+            await self._delete(db, upload_id)
+            await db.commit()
+            self._locks.pop(upload_id, None)
+        await asyncio.to_thread(_unlink_files, [self.part_path(upload_id)])
+        self.stats["aborted"] += 1
+        metrics.inc("audioci_uploads_total", ("aborted",))
+
+uploads = ChunkedUploads()
+
+@app.post("/api/uploads")
+async def create_upload(data: UploadCreate, admin: dict = Depends(get_admin_user)):
+    """Apre una sessione di upload a blocchi; la risposta indica chunk_size e i blocchi da inviare"""
+    if data.size <= 0 or data.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=400, detail=f"Dimensione non valida (massimo {UPLOAD_MAX_BYTES} byte)")
+    return await uploads.create(data, admin["username"])
+
+@app.get("/api/uploads/{upload_id}")
+async def get_upload(upload_id: str, admin: dict = Depends(get_admin_user)):
+    return await uploads.status(upload_id)
+
+@app.put("/api/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, offset: int, request: Request, admin: dict = Depends(get_admin_user)):
+    """Corpo: i byte del blocco che inizia a offset; header X-Chunk-Sha256 con lo SHA-256 esadecimale"""
+    return await uploads.put_chunk(upload_id, offset, request.headers.get("x-chunk-sha256", ""), request)
+
+@app.post("/api/uploads/{upload_id}/complete", response_model=MusicResponse)
+async def complete_upload(upload_id: str, admin: dict = Depends(get_admin_user)):
+    return await uploads.complete(upload_id)
+
+@app.delete("/api/uploads/{upload_id}")
+async def abort_upload(upload_id: str, admin: dict = Depends(get_admin_user)):
+    await uploads.abort(upload_id)
     return {"status": "ok"}
 
 # ============== PLAYLIST API ==============
@@ -1091,7 +2863,7 @@ async def delete_music(music_id: int, admin: dict = Depends(get_admin_user)):
 # Get all playlists
 @app.get("/api/playlists", response_model=List[PlaylistResponse])
 async def get_playlists(current_user: dict = Depends(get_current_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM playlists ORDER BY name")
         playlists = await cursor.fetchall()
@@ -1115,7 +2887,7 @@ async def get_playlists(current_user: dict = Depends(get_current_user)):
 # Create playlist
 @app.post("/api/playlists", response_model=PlaylistResponse)
 async def create_playlist(playlist: PlaylistCreate, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         cursor = await db.execute(
             "INSERT INTO playlists (name) VALUES (?)",
             (playlist.name,)
@@ -1126,7 +2898,7 @@ async def create_playlist(playlist: PlaylistCreate, admin: dict = Depends(get_ad
 # Update playlist
 @app.put("/api/playlists/{playlist_id}", response_model=PlaylistResponse)
 async def update_playlist(playlist_id: int, data: PlaylistUpdate, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         db.row_factory = aiosqlite.Row
 
         if data.name:
@@ -1164,7 +2936,7 @@ async def update_playlist(playlist_id: int, data: PlaylistUpdate, admin: dict =
 # Delete playlist
 @app.delete("/api/playlists/{playlist_id}")
 async def delete_playlist(playlist_id: int, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         await db.execute("DELETE FROM playlist_items WHERE playlist_id = ?", (playlist_id,))
         await db.execute("DELETE FROM playlists WHERE id = ?", (playlist_id,))
         await db.commit()
@@ -1173,7 +2945,7 @@ async def delete_playlist(playlist_id: int, admin: dict = Depends(get_admin_user
 # Add track to playlist
 @app.post("/api/playlists/{playlist_id}/tracks/{music_id}")
 async def add_track_to_playlist(playlist_id: int, music_id: int, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         cursor = await db.execute(
             "SELECT COALESCE(MAX(position), -1) + 1 FROM playlist_items WHERE playlist_id = ?",
             (playlist_id,)
@@ -1189,7 +2961,7 @@ async def add_track_to_playlist(playlist_id: int, music_id: int, admin: dict = D
 # Remove track from playlist
 @app.delete("/api/playlists/{playlist_id}/tracks/{music_id}")
 async def remove_track_from_playlist(playlist_id: int, music_id: int, admin: dict = Depends(get_admin_user)):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connect() as db:
         await db.execute(
             "DELETE FROM playlist_items WHERE playlist_id = ? AND music_id = ?",
             (playlist_id, music_id)
@@ -1197,100 +2969,3726 @@ async def remove_track_from_playlist(playlist_id: int, music_id: int, admin: dic
         await db.commit()
     return {"status": "ok"}
 
-# ============== Audio file serving ==============
+# ============== RICERCA ==============
+
+def fts_prefix_query(text: str) -> Optional[str]:
+    """Testo libero -> query FTS5: ogni parola in AND, come prefisso"""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+@app.get("/api/search", response_model=List[SearchResult])
+async def search(q: str, types: Optional[str] = None, limit: int = 20, current_user: dict = Depends(get_current_user)):
+    """Ricerca ordinata per rilevanza (bm25) su annunci, sequenze e musica"""
+    match = fts_prefix_query(q)
+    if match is None:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    sql = "SELECT rowid, kind, title, subtitle, bm25(search_index, 10.0, 2.0) FROM search_index WHERE search_index MATCH ?"
+    params = [match]
+    if types:
+        kinds = [t.strip() for t in types.split(",") if t.strip()]
+        unknown = [k for k in kinds if k not in SEARCH_SOURCES]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Tipo non valido: {', '.join(unknown)}")
+        sql += f" AND kind IN ({','.join('?' * len(kinds))})"
+        params.extend(kinds)
+    sql += " ORDER BY 5 LIMIT ?"
+    params.append(limit)
+
+    async with db_connect() as db:
+        cursor = await db.execute(sql, params)
+        rows = await cursor.fetchall()
+    return [
+        {"type": kind, "id": rowid // SEARCH_ROWID_STRIDE, "title": title, "subtitle": subtitle, "score": -score}
+        for rowid, kind, title, subtitle, score in rows
+    ]
+
+# ============== PLAY LOG (log utilizzo) ==============
+
+class PlayLog:
+    """
+    Log utilizzo con scrittura differita: record() mette l'evento in una coda
+    limitata in memoria e ritorna subito, un task in background scrive su SQLite
+    a lotti (per dimensione o per tempo) in un'unica transazione.
+    Se la coda e' piena l'evento viene scartato e conteggiato in "dropped".
+    Allo spegnimento un None in coda chiede al task di scrivere il lotto che
+    sta raccogliendo e terminare (una cancellazione lo perderebbe).
+    """
 
-@app.get("/audio/announcements/{filename}")
-async def get_announcement_audio(filename: str):
-    filepath = ANNOUNCEMENTS_DIR / filename
+    def __init__(self):
+        self._queue = asyncio.Queue(maxsize=PLAY_LOG_QUEUE_SIZE)
+        self._task = None
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "batches": 0, "write_errors": 0}
+
+    def record(self, event: str, username: Optional[str] = None, item_type: Optional[str] = None,
+               item_id: Optional[int] = None, detail: Optional[str] = None):
+        row = (event, username, item_type, item_id, detail, datetime.now().isoformat(timespec="milliseconds"))
+        try:
+            self._queue.put_nowait(row)
+            self.stats["enqueued"] += 1
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            if not self._task.done():
+                await self._queue.put(None)
+            try:
+                await self._task
+            except Exception:
+                logger.exception("Task del play log terminato con errore")
+            self._task = None
+        # Scrive quanto rimasto in coda prima dello spegnimento
+        batch = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not None:
+                batch.append(row)
+        if batch:
+            async with db_connect() as db:
+                await self._write(db, batch)
+
+    async def _run(self):
+        async with db_connect() as db:
+            stopping = False
+            while not stopping:
+                row = await self._queue.get()
+                if row is None:
+                    return
+                batch = [row]
+                deadline = time.monotonic() + PLAY_LOG_FLUSH_INTERVAL
+                while len(batch) < PLAY_LOG_BATCH_SIZE:
+                    try:
+                        row = self._queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        try:
+                            row = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                        except asyncio.TimeoutError:
+                            break
+                    if row is None:
+                        stopping = True
+                        break
+                    batch.append(row)
+                await self._write(db, batch)
+
+    async def _write(self, db, batch: list):
+        try:
+            await db.executemany(
+                "INSERT INTO play_log (event, username, item_type, item_id, detail, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            await db.commit()
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception:
+            self.stats["write_errors"] += 1
+            logger.exception("Errore scrittura play log (%d eventi persi)", len(batch))
+
+    def status(self) -> dict:
+        return {"queue_depth": self._queue.qsize(), "queue_capacity": PLAY_LOG_QUEUE_SIZE, **self.stats}
+
+play_log = PlayLog()
+
+@metrics.collector
+def _play_log_metrics():
+    for outcome in ("enqueued", "written", "dropped", "write_errors"):
+        yield "audioci_play_log_events_total", (outcome,), play_log.stats[outcome]
+    yield "audioci_play_log_queue_depth", (), play_log._queue.qsize()
+
+@app.get("/api/play-log", response_model=PlayLogPage)
+async def get_play_log(
+    username: Optional[str] = None,
+    item_type: Optional[str] = None,
+    item_id: Optional[int] = None,
+    event: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50,
+    admin: dict = Depends(get_admin_user)
+):
+    """
+    Storico riproduzioni, dal piu' recente. Paginazione a chiave: passare
+    come cursor il next_cursor della pagina precedente.
+    since/until sono timestamp ISO (ora locale) confrontati come stringhe.
+    """
+    limit = max(1, min(limit, 500))
+    conditions, params = [], []
+    if username:
+        conditions.append("username = ?")
+        params.append(username)
+    if item_type:
+        conditions.append("item_type = ?")
+        params.append(item_type)
+    if item_id is not None:
+        conditions.append("item_id = ?")
+        params.append(item_id)
+    if event:
+        conditions.append("event = ?")
+        params.append(event)
+    if since:
+        conditions.append("created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("created_at < ?")
+        params.append(until)
+    if cursor is not None:
+        conditions.append("id < ?")
+        params.append(cursor)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    async with db_connect() as db:
+        db.row_factory = aiosqlite.Row
+        rows = await (await db.execute(
+            f"SELECT * FROM play_log {where} ORDER BY id DESC LIMIT ?", (*params, limit + 1)
+        )).fetchall()
+
+    items = [PlayLogEntry(**dict(r)) for r in rows[:limit]]
+    next_cursor = items[-1].id if len(rows) > limit else None
+    return PlayLogPage(items=items, next_cursor=next_cursor)
+
+@app.get("/api/play-log/status")
+async def get_play_log_status(admin: dict = Depends(get_admin_user)):
+    return play_log.status()
+
+# ============== REGISTRAZIONE ANNUNCI MASTER ==============
+
+class _RecordingWriter(threading.Thread):
+    """Thread di scrittura di una registrazione: consuma chunk da una coda limitata"""
+
+    def __init__(self, path: Path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.queue = queue.Queue(maxsize=RECORDER_QUEUE_CHUNKS)
+        self.bytes = 0
+        self.chunks = 0
+        self.error = None
+
+    def _open(self):
+        # Se il prune rimuove la cartella del giorno tra mkdir e open si riprova una volta
+        for attempt in range(2):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                return open(self.path, "wb")
+            except FileNotFoundError:
+                if attempt:
+                    raise
+
+    def run(self):
+        try:
+            with self._open() as f:
+                while True:
+                    chunk = self.queue.get()
+                    if chunk is None:
+                        break
+                    f.write(chunk)
+                    self.bytes += len(chunk)
+                    self.chunks += 1
+        except OSError as e:
+            self.error = str(e)
+            # Svuota la coda cosi' feed() non resta mai bloccato
+            while self.queue.get() is not None:
+                pass
+
+class MasterRecorder:
+    """
+    Registra gli annunci Master per la revisione di sicurezza.
+    feed() mette il chunk in una coda limitata senza mai attendere: la scrittura
+    su disco avviene in un thread dedicato, quindi l'inoltro ai player non dipende
+    dal disco. Se la coda e' piena il chunk viene scartato (e contato).
+    Le registrazioni ruotano in sottocartelle giornaliere e vengono eliminate
+    per eta' (RECORDINGS_MAX_AGE_DAYS) e per spazio totale (RECORDINGS_MAX_TOTAL_BYTES).
+    """
+
+    def __init__(self):
+        self._writer = None
+        self._current = None
+        self._finalizers = set()          # finalizzazioni in corso, attese allo shutdown
+        self.stats = {"recordings": 0, "bytes": 0, "dropped_chunks": 0, "pruned": 0, "errors": 0}
+
+    def start(self, username: str) -> str:
+        """Apre una nuova registrazione e ne ritorna il path relativo a RECORDINGS_DIR"""
+        self.finish()
+        now = datetime.now()
+        safe_user = re.sub(r"[^A-Za-z0-9_-]+", "_", username or "master")
+        relative = f"{now.strftime('%Y-%m-%d')}/{now.strftime('%H%M%S%f')}_{safe_user}.webm"
+        # _current prima del thread: _prune_files non tocca la cartella della registrazione attiva
+        self._current = {"username": username, "file_path": relative,
+                         "started_at": now.isoformat(timespec="milliseconds"), "dropped": 0}
+        self._writer = _RecordingWriter(RECORDINGS_DIR / relative)
+        self._writer.start()
+        return relative
+
+    def feed(self, chunk: bytes):
+        if self._writer is None:
+            return
+        try:
+            self._writer.queue.put_nowait(chunk)
+        except queue.Full:
+            self._current["dropped"] += 1
+            self.stats["dropped_chunks"] += 1
+
+    def finish(self):
+        """Chiude la registrazione in corso; la finalizzazione prosegue in background"""
+        if self._writer is None:
+            return
+        writer, current = self._writer, self._current
+        self._writer = self._current = None
+        task = asyncio.create_task(self._finalize(writer, current))
+        self._finalizers.add(task)
+        task.add_done_callback(self._finalizers.discard)
+
+    async def stop(self):
+        """Chiude la registrazione in corso e attende che file e righe in DB siano completi"""
+        self.finish()
+        for result in await asyncio.gather(*self._finalizers, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error("Finalizzazione registrazione Master fallita: %s", result)
+
+    async def _finalize(self, writer: _RecordingWriter, current: dict):
+        await asyncio.to_thread(writer.queue.put, None)
+        await asyncio.to_thread(writer.join)
+        if writer.error:
+            self.stats["errors"] += 1
+            logger.error("Registrazione Master fallita (%s): %s", current["file_path"], writer.error)
+            return
+        self.stats["recordings"] += 1
+        self.stats["bytes"] += writer.bytes
+        async with db_connect() as db:
+            await db.execute(
+                """INSERT INTO recordings (username, file_path, started_at, ended_at, bytes, chunks, dropped_chunks)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (current["username"], current["file_path"], current["started_at"],
+                 datetime.now().isoformat(timespec="milliseconds"), writer.bytes, writer.chunks, current["dropped"])
+            )
+            await db.commit()
+        await self.prune()
+
+    async def prune(self):
+        removed = await asyncio.to_thread(self._prune_files)
+        if not removed:
+            return
+        self.stats["pruned"] += len(removed)
+        async with db_connect() as db:
+            await db.executemany("DELETE FROM recordings WHERE file_path = ?", [(r,) for r in removed])
+            await db.commit()
+
+    def _prune_files(self) -> List[str]:
+        if not RECORDINGS_DIR.exists():
+            return []
+        active = self._current["file_path"] if self._current else None
+        files = []
+        for path in RECORDINGS_DIR.glob("*/*.webm"):
+            relative = path.relative_to(RECORDINGS_DIR).as_posix()
+            if relative != active:
+                st = path.stat()
+                files.append((st.st_mtime, st.st_size, path, relative))
+        files.sort()
+        total = sum(f[1] for f in files)
+        min_mtime = time.time() - RECORDINGS_MAX_AGE_DAYS * 86400
+        removed = []
+        for mtime, size, path, relative in files:
+            if mtime >= min_mtime and total <= RECORDINGS_MAX_TOTAL_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed.append(relative)
+        # Mai la cartella di oggi ne' quella della registrazione attiva: una nuova
+        # registrazione potrebbe averla appena creata e non ancora aperto il file
+        keep = {datetime.now().strftime("%Y-%m-%d")}
+        if active:
+            keep.add(active.split("/", 1)[0])
+        for day_dir in RECORDINGS_DIR.iterdir():
+            if day_dir.is_dir() and day_dir.name not in keep and not any(day_dir.iterdir()):
+                day_dir.rmdir()
+        return removed
+
+recorder = MasterRecorder()
+
+@metrics.collector
+def _recorder_metrics():
+    for key in ("recordings", "bytes", "dropped_chunks", "pruned", "errors"):
+        yield "audioci_master_recorder_total", (key,), recorder.stats[key]
+
+@app.get("/api/recordings", response_model=List[RecordingResponse])
+async def get_recordings(username: Optional[str] = None, limit: int = 100, admin: dict = Depends(get_admin_user)):
+    async with db_connect() as db:
+        db.row_factory = aiosqlite.Row
+        if username:
+            cursor = await db.execute(
+                "SELECT * FROM recordings WHERE username = ? ORDER BY id DESC LIMIT ?", (username, limit)
+            )
+        else:
+            cursor = await db.execute("SELECT * FROM recordings ORDER BY id DESC LIMIT ?", (limit,))
+        return [RecordingResponse(**dict(r)) for r in await cursor.fetchall()]
+
+@app.get("/api/recordings/{recording_id}/audio")
+async def get_recording_audio(recording_id: int, admin: dict = Depends(get_admin_user)):
+    async with db_connect() as db:
+        cursor = await db.execute("SELECT file_path FROM recordings WHERE id = ?", (recording_id,))
+        row = await cursor.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Registrazione non trovata")
+    filepath = RECORDINGS_DIR / row[0]
     if not filepath.exists():
         raise HTTPException(status_code=404, detail="File non trovato")
-    return FileResponse(filepath, media_type="audio/mpeg")
+    return FileResponse(filepath, media_type="audio/webm", filename=filepath.name)
 
-@app.get("/audio/music/{filename}")
-async def get_music_audio(filename: str):
-    filepath = MUSIC_DIR / filename
+# ============== STREAM LIVE HTTP (ascoltatori passivi) ==============
+
+class LiveStreamRing:
+    """
+    Buffer circolare condiviso con l'audio Master dell'annuncio in corso.
+    Un solo bytearray preallocato: ogni ascoltatore ha solo il proprio cursore
+    (offset assoluto) e riceve slice memoryview dello stesso buffer, senza copie
+    per ascoltatore. Chi resta indietro di quasi un giro viene riportato al chunk
+    piu' recente. Il primo chunk (intestazione WebM) e' conservato a parte per
+    chi si collega ad annuncio gia' iniziato.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._guard = capacity // 4
+        self._chunk_starts = deque(maxlen=256)
+        self._changed = None
+        self.head = 0
+        self.epoch = 0
+        self.active = False
+        self.header = None
+        self.listeners = 0
+        self.stats = {"bytes_in": 0, "bytes_out": 0, "skips": 0, "listeners_total": 0}
+
+    def _notify(self):
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+    async def wait(self, timeout: float):
+        """Attende la prossima scrittura o cambio di stato (un solo future condiviso da tutti)"""
+        if self._changed is None:
+            self._changed = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._changed), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def begin(self, header: Optional[bytes] = None):
+        """
+        Nuovo stream. Senza header il primo chunk scritto fa da intestazione
+        (WebM del Master); con header esplicito (anche b"") tutti i chunk
+        vanno nel buffer.
+        """
+        self.epoch += 1
+        self.head = 0
+        self.header = header
+        self._chunk_starts.clear()
+        self.active = True
+        self._notify()
+
+    def end(self):
+        self.active = False
+        self._notify()
+
+    def write(self, chunk: bytes):
+        if not self.active:
+            return
+        self.stats["bytes_in"] += len(chunk)
+        if self.header is None:
+            self.header = bytes(chunk)
+            self._notify()
+            return
+        data = memoryview(chunk)
+        if len(data) > self.capacity:
+            self.head += len(data) - self.capacity
+            data = data[-self.capacity:]
+        n = len(data)
+        self._chunk_starts.append(self.head)
+        pos = self.head % self.capacity
+        first = min(n, self.capacity - pos)
+        self._buffer[pos:pos + first] = data[:first]
+        if first < n:
+            self._buffer[:n - first] = data[first:]
+        self.head += n
+        self._notify()
+
+    def live_cursor(self) -> int:
+        """Cursore iniziale per un nuovo ascoltatore: inizio del chunk piu' recente"""
+        return self._chunk_starts[-1] if self._chunk_starts else self.head
+
+    def read(self, cursor: int):
+        """Ritorna (nuovo_cursore, [memoryview, ...]) con i dati da cursor fino alla testa"""
+        if self.head - cursor > self.capacity - self._guard:
+            cursor = self.live_cursor()
+            self.stats["skips"] += 1
+        length = self.head - cursor
+        if length <= 0:
+            return cursor, []
+        start = cursor % self.capacity
+        if start + length <= self.capacity:
+            parts = [self._view[start:start + length]]
+        else:
+            parts = [self._view[start:], self._view[:length - (self.capacity - start)]]
+        self.stats["bytes_out"] += length
+        return self.head, parts
+
+live_ring = LiveStreamRing(LIVE_RING_BYTES)
+
+@metrics.collector
+def _live_stream_metrics():
+    yield "audioci_live_listeners", (), live_ring.listeners
+    for key, value in live_ring.stats.items():
+        yield "audioci_live_stream_total", (key,), value
+
+async def _ring_stream_body(ring: LiveStreamRing):
+    ring.listeners += 1
+    ring.stats["listeners_total"] += 1
+    try:
+        # Tra un annuncio e l'altro la connessione resta in attesa del prossimo
+        while not (ring.active and ring.header is not None):
+            await ring.wait(LIVE_STREAM_IDLE_WAIT)
+        epoch = ring.epoch
+        if ring.header:
+            yield ring.header
+        cursor = ring.live_cursor()
+        while ring.epoch == epoch:
+            cursor, parts = ring.read(cursor)
+            for part in parts:
+                yield part
+            if not parts:
+                if not ring.active:
+                    return
+                await ring.wait(LIVE_STREAM_IDLE_WAIT)
+    finally:
+        ring.listeners -= 1
+
+@app.get("/stream/live")
+async def stream_live():
+    """
+    Audio Master in streaming HTTP chunked per dispositivi semplici e diffusori di cabina.
+    Ogni risposta contiene un annuncio (WebM/Opus): se nessun annuncio e' in corso
+    la connessione attende il prossimo; a fine annuncio la risposta termina e il
+    client si ricollega.
+    """
+    return StreamingResponse(
+        _ring_stream_body(live_ring),
+        media_type="audio/webm",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    )
+
+# ============== CODA DI RIPRODUZIONE (comandi ai player) ==============
+
+def estimate_duration(audio_path: Path) -> Optional[float]:
+    """Durata dall'intestazione del file dei peaks (frame / frequenza), senza decodificare l'audio"""
+    try:
+        with open(peaks_path(audio_path), "rb") as f:
+            magic, version, _, _, rate, frames = struct.unpack("<4sBBHII", f.read(16))
+    except (OSError, struct.error):
+        return None
+    if magic != PEAKS_MAGIC or version != PEAKS_VERSION or not rate:
+        return None
+    return frames / rate
+
+class PlaybackItem:
+    """Annuncio in coda: messaggio per i player gia' pronto e durata stimata"""
+    __slots__ = ("level", "seq", "priority", "key", "message", "username", "log", "duration")
+
+    def __init__(self, priority: str, seq: int, key: tuple, message: dict, username: Optional[str],
+                 log: tuple = ()):
+        self.level = PLAYBACK_PRIORITIES[priority]
+        self.seq = seq
+        self.priority = priority
+        self.key = key
+        self.message = message
+        self.username = username
+        self.log = log                  # argomenti per play_log.record("play", ...) alla prima partenza
+        self.duration = sum(estimate_duration(audio_file(ANNOUNCEMENTS_DIR, f)) or PLAYBACK_FALLBACK_SECONDS
+                            for f in message.get("files", []))
+
+    def __lt__(self, other):
+        return (-self.level, self.seq) < (-other.level, other.seq)
+
+    def describe(self) -> dict:
+        return {"priority": self.priority, "id": self.message.get("id"), "files": self.message.get("files", []),
+                "username": self.username, "duration": round(self.duration, 1)}
+
+class PlaylistCursor:
+    """
+    Playlist in riproduzione, tenuta dal server: i brani vengono da
+    playlist_items e l'ordine casuale si ricostruisce dal seed (una
+    permutazione per giro con random.Random("seed:giro"); attivando lo shuffle
+    durante l'ascolto il brano corrente resta in testa). Ai player va solo il
+    brano corrente con i PLAYLIST_LOOKAHEAD successivi da precaricare; ogni
+    cambio di brano prende una nuova generation (unica fra tutti i cursori),
+    cosi' la fine del brano segnalata da piu' player, o in ritardo per una
+    playlist gia' sostituita, fa avanzare il cursore una volta sola.
+    """
+
+    _generations = itertools.count(1)
+
+    def __init__(self, playlist_id: int, tracks: List[dict], shuffle: bool, loop: bool, seed: Optional[int]):
+        self.playlist_id = playlist_id
+        self.tracks = tracks
+        self.shuffle = shuffle
+        self.loop = loop
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.cycle = 0
+        self.anchor = None          # brano tenuto in testa al giro corrente (shuffle attivato in ascolto)
+        self.order = self._order(0, None)
+        self.position = 0
+        self.generation = next(self._generations)
+        self.start_at = None        # avvio del brano corrente (ms, ora del server), spostato dalle pause
+        self.paused_at = None
+
+    @classmethod
+    async def load(cls, playlist_id: int, shuffle: bool, loop: bool,
+                   seed: Optional[int] = None) -> Optional["PlaylistCursor"]:
+        """Cursore all'inizio della playlist, None se non esiste o e' vuota"""
+        async with db_connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT m.file_path, m.title, m.artist FROM music m
+                JOIN playlist_items pi ON m.id = pi.music_id
+                WHERE pi.playlist_id = ?
+                ORDER BY pi.position
+            """, (playlist_id,))
+            tracks = [dict(row) for row in await cursor.fetchall()]
+        return cls(playlist_id, tracks, shuffle, loop, seed) if tracks else None
+
+    def _order(self, cycle: int, anchor: Optional[int]) -> List[int]:
+        order = list(range(len(self.tracks)))
+        if not self.shuffle:
+            return order
+        if anchor is not None:
+            order.remove(anchor)
+        random.Random(f"{self.seed}:{cycle}").shuffle(order)
+        return order if anchor is None else [anchor] + order
+
+    def upcoming(self) -> List[str]:
+        """Prossimi brani (anche del giro successivo, in loop) da precaricare"""
+        ahead = self.order[self.position + 1:self.position + 1 + PLAYLIST_LOOKAHEAD]
+        if self.loop and len(ahead) < PLAYLIST_LOOKAHEAD:
+            ahead += self._order(self.cycle + 1, None)[:PLAYLIST_LOOKAHEAD - len(ahead)]
+        return [self.tracks[i]["file_path"] for i in ahead]
+
+    def step(self, delta: int, wrap: bool = True) -> bool:
+        """
+        Brano successivo (+1) o precedente (-1). Oltre la fine si passa al giro
+        successivo (in loop, con un nuovo ordine) o si torna al primo brano
+        (wrap, comandi manuali); False se la playlist e' finita.
+        """
+        position = self.position + delta
+        if 0 <= position < len(self.order):
+            self.position = position
+        elif position < 0:
+            self.position = len(self.order) - 1
+        elif self.loop:
+            self.cycle += 1
+            self.anchor = None
+            self.order = self._order(self.cycle, None)
+            self.position = 0
+        elif wrap:
+            self.position = 0
+        else:
+            return False
+        self.generation = next(self._generations)
+        return True
+
+    def toggle_shuffle(self):
+        """Cambia l'ordine dei brani successivi senza interrompere quello corrente"""
+        current = self.order[self.position]
+        self.shuffle = not self.shuffle
+        if self.shuffle:
+            self.seed = random.getrandbits(32)
+            self.cycle = 0
+            self.anchor = current
+            self.order = self._order(0, current)
+            self.position = 0
+        else:
+            self.anchor = None
+            self.order = self._order(0, None)
+            self.position = current
+
+    def play(self, start_at: int):
+        self.start_at = start_at
+        self.paused_at = None
+
+    def pause(self):
+        if self.start_at is not None and self.paused_at is None:
+            self.paused_at = round(time.time() * 1000)
+
+    def resume(self):
+        if self.paused_at is not None:
+            self.start_at += round(time.time() * 1000) - self.paused_at
+            self.paused_at = None
+
+    def message(self) -> dict:
+        track = self.tracks[self.order[self.position]]
+        message = {
+            "type": "play_playlist",
+            "playlist_id": self.playlist_id,
+            "generation": self.generation,
+            "position": self.position,
+            "length": len(self.order),
+            "track": track["file_path"],
+            "title": track["title"],
+            "artist": track["artist"],
+            "lookahead": self.upcoming(),
+            "shuffle": self.shuffle,
+            "loop": self.loop,
+            "start_at": self.start_at,
+        }
+        if self.paused_at is not None:
+            message["paused_at"] = self.paused_at
+        return message
+
+    def describe(self) -> dict:
+        return {"playlist_id": self.playlist_id, "position": self.position, "length": len(self.order),
+                "track": self.tracks[self.order[self.position]]["file_path"], "generation": self.generation,
+                "shuffle": self.shuffle, "seed": self.seed, "cycle": self.cycle, "anchor": self.anchor,
+                "loop": self.loop}
+
+class PlaybackQueue:
+    """
+    Unico punto da cui partono i comandi di riproduzione verso i player, che
+    ricevono solo il flusso gia' risolto.
+    Priorita': Master > sicurezza > annuncio > musica. Gli annunci vanno in
+    una coda (a parita' di priorita' in ordine di arrivo) e ne suona uno alla
+    volta; uno di priorita' maggiore interrompe quello in corso, che torna in
+    coda e riparte dall'inizio. La musica e' uno stato di sottofondo (vince
+    l'ultimo comando): durante gli annunci viene abbassata e rialzata quando
+    la coda si svuota. Il Master sospende tutto; al termine la musica riprende
+    e la coda riparte. Richieste identiche entro PLAYBACK_COALESCE_SECONDS
+    vengono fuse in una sola (contano solo quelle accettate, non le rifiutate).
+    Il registro riproduzioni riceve "play" quando un elemento parte davvero,
+    non quando viene accodato.
+    La fine di un annuncio la segnalano i player (status "stopped"); se non
+    arriva, vale la durata stimata dai peaks piu' PLAYBACK_END_GRACE.
+    Le playlist sono un PlaylistCursor: avanti, indietro, shuffle e fine del
+    brano aggiornano il cursore, che poi invia ai player il nuovo brano.
+    """
+
+    def __init__(self):
+        self._heap: List[PlaybackItem] = []
+        self._seq = 0
+        self._lock = asyncio.Lock()
+        self._recent: Dict[tuple, float] = {}   # chiave richiesta -> ultima accettazione (monotonic)
+        self._waiting = set()                   # player che non hanno ancora finito l'annuncio corrente
+        self._timer = None
+        self.current: Optional[PlaybackItem] = None
+        self.music = None                       # ultimo comando musica (dict o PlaylistCursor), da ripetere dopo il Master
+        self.music_paused = False
+        self._music_pending = False             # comando musica arrivato durante il Master
+        self._music_log = None                  # (username, log) del comando musica in attesa
+        self.ducked = False
+        self.stats = {"played": 0, "completed": 0, "expired": 0, "preempted": 0}
+
+    def _coalesced(self, key: tuple) -> bool:
+        last = self._recent.get(key)
+        return last is not None and time.monotonic() - last < PLAYBACK_COALESCE_SECONDS
+
+    def _remember(self, key: tuple):
+        now = time.monotonic()
+        if len(self._recent) > PLAYBACK_RECENT_MAX:
+            self._recent = {k: t for k, t in self._recent.items() if now - t < PLAYBACK_COALESCE_SECONDS}
+        self._recent[key] = now
+
+    async def submit(self, kind: str, message: dict, key: tuple, username: Optional[str] = None,
+                     priority: str = "announcement", log: tuple = ()) -> dict:
+        """
+        kind "announcement" (priority "announcement" o "safety") oppure "music".
+        log: argomenti per play_log.record("play", username, ...) quando parte.
+        Ritorna {"status": played | queued | coalesced | rejected, ...}
+        """
+        key = (kind, priority) + key
+        async with self._lock:
+            if self._coalesced(key):
+                result = {"status": "coalesced"}
+            elif kind == "music":
+                result = await self._set_music(message, username, log)
+            else:
+                result = await self._enqueue(PlaybackItem(priority, self._seq, key, message, username, log))
+                self._seq += 1
+            if result["status"] in ("played", "queued"):
+                self._remember(key)
+        metrics.inc("audioci_playback_requests_total", (kind, result["status"]))
+        return result
+
+    async def _set_music(self, music, username: Optional[str], log: tuple) -> dict:
+        self.music = music
+        self.music_paused = False
+        if manager.master_active:
+            self._music_pending = True
+            self._music_log = (username, log)
+            return {"status": "queued", "position": 0, "reason": "master_active"}
+        self._music_log = None
+        await self._send_music()
+        if log:
+            play_log.record("play", username, *log)
+        return {"status": "played"}
+
+    def _playlist(self) -> Optional[PlaylistCursor]:
+        return self.music if isinstance(self.music, PlaylistCursor) else None
+
+    async def _send_music(self):
+        """Avvia sui player la musica corrente (per una playlist: il brano del cursore)"""
+        start_at = manager.start_at()
+        playlist = self._playlist()
+        if playlist is not None:
+            playlist.play(start_at)
+            await manager.send_to_players(playlist.message())
+        else:
+            await manager.send_to_players(dict(self.music, start_at=start_at))
+
+    async def _enqueue(self, item: PlaybackItem) -> dict:
+        if manager.master_active or (self.current is not None and self.current.level >= item.level):
+            if len(self._heap) >= PLAYBACK_QUEUE_MAX:
+                return {"status": "rejected", "reason": "queue_full"}
+            heapq.heappush(self._heap, item)
+            position = sum(1 for queued in self._heap if queued < item) + 1
+            return {"status": "queued", "position": position,
+                    "reason": "master_active" if manager.master_active else "busy"}
+        if self.current is not None:
+            self.stats["preempted"] += 1
+            heapq.heappush(self._heap, self.current)
+            self._stop_timer()
+        if not await self._start(item):
+            await self._advance()
+        return {"status": "played"}
+
+    async def _start(self, item: PlaybackItem) -> bool:
+        """Invia l'annuncio; False se non c'e' nessun player che debba terminarlo"""
+        self.current = item
+        self._waiting = set(manager.players)
+        self.stats["played"] += 1
+        if self.music is not None and not self.music_paused and not self.ducked:
+            self.ducked = True
+            await manager.send_to_players({"type": "duck", "gain": MIXER_DUCK_GAIN})
+        await manager.send_to_players(dict(item.message, start_at=manager.start_at()))
+        if item.log:
+            # Solo la prima partenza: la ripresa dopo un'interruzione non e' una nuova richiesta
+            play_log.record("play", item.username, *item.log)
+            item.log = ()
+        if not self._waiting:
+            self.current = None
+            return False
+        self._timer = asyncio.create_task(self._expire(item, item.duration + PLAYBACK_END_GRACE))
+        return True
+
+    async def _advance(self):
+        """Annuncio corrente concluso: parte il successivo oppure si rialza la musica"""
+        self._stop_timer()
+        self.current = None
+        self._waiting = set()
+        while self._heap and not manager.master_active:
+            if await self._start(heapq.heappop(self._heap)):
+                return
+        if self.ducked and not manager.master_active:
+            self.ducked = False
+            await manager.send_to_players({"type": "unduck"})
+
+    def _stop_timer(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+    async def _expire(self, item: PlaybackItem, delay: float):
+        await asyncio.sleep(delay)
+        async with self._lock:
+            if self.current is item:
+                self.stats["expired"] += 1
+                await self._advance()
+
+    async def player_report(self, websocket: WebSocket, status: Optional[str]):
+        """Status dal player (o sua disconnessione): l'annuncio finisce quando tutti l'hanno concluso"""
+        if status != "stopped" or websocket not in self._waiting:
+            return
+        async with self._lock:
+            self._waiting.discard(websocket)
+            if self.current is not None and not self._waiting:
+                self.stats["completed"] += 1
+                await self._advance()
+
+    async def music_command(self, action: str):
+        """
+        music_next, music_prev, music_shuffle, pause, resume. Con una playlist
+        in corso avanti/indietro/shuffle muovono il cursore; altrimenti (e per
+        pause/resume) il comando viene inoltrato ai player come e'.
+        Durante il Master il comando viene scartato: puo' arrivare in ritardo
+        (toggle fuso, inviato a fine finestra) e non deve far ripartire la musica.
+        """
+        async with self._lock:
+            if manager.master_active:
+                return
+            playlist = self._playlist()
+            if action == "pause":
+                self.music_paused = True
+                if playlist is not None:
+                    playlist.pause()
+            elif action == "resume":
+                self.music_paused = False
+                if playlist is not None:
+                    playlist.resume()
+            elif playlist is not None and action in ("music_next", "music_prev"):
+                playlist.step(1 if action == "music_next" else -1)
+                self.music_paused = False
+                metrics.inc("audioci_playlist_tracks_total", (action[len("music_"):],))
+                await self._send_music()
+                return
+            elif playlist is not None and action == "music_shuffle":
+                playlist.toggle_shuffle()
+                # Il brano corrente continua: ai player va solo il nuovo lookahead
+                await manager.send_to_players(dict(playlist.message(), type="playlist_window"))
+                return
+            await manager.send_to_players({"type": action})
+
+    async def track_ended(self, generation):
+        """Fine del brano segnalata da un player: il primo fa avanzare la playlist, gli altri sono duplicati"""
+        async with self._lock:
+            playlist = self._playlist()
+            if (playlist is None or generation != playlist.generation
+                    or self.music_paused or manager.master_active):
+                return
+            if playlist.step(1, wrap=False):
+                metrics.inc("audioci_playlist_tracks_total", ("ended",))
+                await self._send_music()
+            else:
+                self.music = None    # fine della playlist: i player si fermano da soli
+
+    async def player_joined(self, websocket: WebSocket):
+        """Un player (ri)collegato riprende la playlist in corso dal punto in cui si trova"""
+        playlist = self._playlist()
+        if playlist is None or playlist.start_at is None or manager.master_active or self._music_pending:
+            return
+        await websocket.send_json(playlist.message())
+        if self.ducked:
+            await websocket.send_json({"type": "duck", "gain": MIXER_DUCK_GAIN})
+
+    async def stop(self):
+        """Stop generale: svuota la coda e ferma annunci e musica"""
+        async with self._lock:
+            self._heap.clear()
+            self._stop_timer()
+            self.current = None
+            self._waiting = set()
+            self.music = None
+            self._music_pending = False
+            self._music_log = None
+            self.ducked = False
+            await manager.send_to_players({"type": "stop"})
+
+    async def master_started(self):
+        """Il Master interrompe l'annuncio in corso, che ripartira' al termine"""
+        async with self._lock:
+            playlist = self._playlist()
+            if playlist is not None and not self.music_paused:
+                playlist.pause()
+            if self.current is not None:
+                self.stats["preempted"] += 1
+                heapq.heappush(self._heap, self.current)
+                self._stop_timer()
+                self.current = None
+                self._waiting = set()
+
+    async def master_stopped(self):
+        """Fine del Master: riprende la musica (sospesa dai player) e poi la coda"""
+        async with self._lock:
+            if self._music_pending:
+                self._music_pending = False
+                await self._send_music()
+                if self._music_log and self._music_log[1]:
+                    play_log.record("play", self._music_log[0], *self._music_log[1])
+                self._music_log = None
+            elif self.music is not None and not self.music_paused:
+                if self._playlist() is not None:
+                    self.music.resume()
+                await manager.send_to_players({"type": "resume"})
+            await self._advance()
+
+    def shutdown(self):
+        self._stop_timer()
+
+    def status(self) -> dict:
+        return {
+            "current": self.current.describe() if self.current else None,
+            "waiting_players": len(self._waiting),
+            "queue": [item.describe() for item in sorted(self._heap)],
+            "music": self.music.describe() if self._playlist() else self.music,
+            "music_paused": self.music_paused,
+            "ducked": self.ducked,
+            "stats": dict(self.stats),
+        }
+
+playback = PlaybackQueue()
+
+@metrics.collector
+def _playback_metrics():
+    yield "audioci_playback_queue_depth", (), len(playback._heap)
+    for event, value in playback.stats.items():
+        yield "audioci_playback_events_total", (event,), value
+
+@app.get("/api/playback")
+async def get_playback_status(current_user: dict = Depends(get_current_user)):
+    return playback.status()
+
+# ============== LIMITI DEI CONTROLLER ==============
+
+class TokenBucket:
+    """Bucket classico: `rate` gettoni al secondo fino a `burst`; ogni comando ne consuma uno"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class ToggleSlot:
+    __slots__ = ("sent", "sent_at", "pending", "task")
+
+    def __init__(self):
+        self.sent = None
+        self.sent_at = 0.0
+        self.pending = None
+        self.task = None
+
+class ControllerLimiter:
+    """
+    Protegge i player dai controller che inviano troppi comandi.
+    Ogni comando consuma un gettone dal bucket della connessione e da quello
+    dell'utente (condiviso tra tutte le sue connessioni); senza gettoni il
+    comando viene scartato e il controller riceve {"type": "throttled"}.
+    I comandi idempotenti (pause/resume, shuffle) vengono fusi: il primo parte
+    subito, quelli entro CONTROLLER_TOGGLE_WINDOW si sovrascrivono e alla fine
+    della finestra parte solo l'ultimo, se cambia lo stato gia' inviato.
+    """
+
+    TOGGLE_GROUPS = {"pause": "transport", "resume": "transport", "music_shuffle": "shuffle"}
+
+    def __init__(self):
+        self._users: Dict[str, TokenBucket] = {}
+        self._toggles: Dict[str, ToggleSlot] = {}
+        self.throttled_users: Dict[str, int] = {}
+
+    @staticmethod
+    def limits(role: Optional[str]) -> tuple:
+        return CONTROLLER_RATE_LIMITS.get(role, CONTROLLER_ANONYMOUS_LIMIT)
+
+    def connection_bucket(self, role: Optional[str]) -> TokenBucket:
+        return TokenBucket(*self.limits(role))
+
+    def _user_bucket(self, username: str, role: Optional[str]) -> TokenBucket:
+        bucket = self._users.get(username)
+        if bucket is None:
+            rate, burst = self.limits(role)
+            bucket = self._users[username] = TokenBucket(rate * CONTROLLER_USER_FACTOR, burst * CONTROLLER_USER_FACTOR)
+        return bucket
+
+    def check(self, bucket: TokenBucket, username: Optional[str], role: Optional[str]) -> Optional[dict]:
+        """None se il comando e' ammesso, altrimenti il motivo del rifiuto"""
+        now = time.monotonic()
+        buckets = [("connection", bucket)]
+        if username:
+            buckets.append(("user", self._user_bucket(username, role)))
+        for scope, b in buckets:
+            b.refill(now)
+            if b.tokens < 1:
+                metrics.inc("audioci_controller_commands_total", (role or "anonymous", "throttled"))
+                if username:
+                    self.throttled_users[username] = self.throttled_users.get(username, 0) + 1
+                return {"scope": scope, "retry_after": round(b.retry_after(), 3)}
+        for _, b in buckets:
+            b.tokens -= 1
+        metrics.inc("audioci_controller_commands_total", (role or "anonymous", "accepted"))
+        return None
+
+    async def toggle(self, action: str, send) -> bool:
+        """Invia (o accoda per la fine della finestra) un comando idempotente; False se e' stato fuso"""
+        slot = self._toggles.setdefault(self.TOGGLE_GROUPS[action], ToggleSlot())
+        now = time.monotonic()
+        if slot.task is None and now - slot.sent_at >= CONTROLLER_TOGGLE_WINDOW:
+            slot.sent, slot.sent_at = action, now
+            await send(action)
+            return True
+        slot.pending = action
+        if slot.task is None:
+            slot.task = asyncio.create_task(self._flush(slot, send, slot.sent_at + CONTROLLER_TOGGLE_WINDOW - now))
+        return False
+
+    async def _flush(self, slot: ToggleSlot, send, delay: float):
+        await asyncio.sleep(delay)
+        action, slot.pending, slot.task = slot.pending, None, None
+        if action is not None and (action != slot.sent or action == "music_shuffle"):
+            slot.sent, slot.sent_at = action, time.monotonic()
+            await send(action)
+
+    def cancel_pending(self):
+        """Annulla i toggle fusi in attesa (es. all'avvio del Master)"""
+        for slot in self._toggles.values():
+            if slot.task is not None:
+                slot.task.cancel()
+                slot.task = None
+            slot.pending = None
+
+    def shutdown(self):
+        self.cancel_pending()
+
+    def status(self) -> dict:
+        return {
+            "limits": {role: {"rate": r, "burst": b} for role, (r, b) in
+                       [*CONTROLLER_RATE_LIMITS.items(), ("anonymous", CONTROLLER_ANONYMOUS_LIMIT)]},
+            "user_factor": CONTROLLER_USER_FACTOR,
+            "toggle_window": CONTROLLER_TOGGLE_WINDOW,
+            "throttled_users": dict(self.throttled_users),
+        }
+
+controller_limiter = ControllerLimiter()
+
+@metrics.collector
+def _controller_limit_metrics():
+    for role, (rate, burst) in [*CONTROLLER_RATE_LIMITS.items(), ("anonymous", CONTROLLER_ANONYMOUS_LIMIT)]:
+        yield "audioci_controller_rate_limit", (role, "rate"), rate
+        yield "audioci_controller_rate_limit", (role, "burst"), burst
+
+@app.get("/api/controllers/limits")
+async def get_controller_limits(admin: dict = Depends(get_admin_user)):
+    return controller_limiter.status()
+
+# ============== SCHEDULER (annunci programmati) ==============
+
+def _parse_cron_field(field: str, lo: int, hi: int) -> List[int]:
+    """Espande un campo cron ("*", "1,5", "8-18", "*/15", "10-40/10") nei valori ammessi"""
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            end = hi if step != 1 else start
+        if start < lo or end > hi or start > end or step < 1:
+            raise ValueError(f"campo cron fuori intervallo: {field}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+class CronRule:
+    """Espressione cron a 5 campi: minuto ora giorno-mese mese giorno-settimana (0/7 = domenica)"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("l'espressione cron deve avere 5 campi")
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = set(_parse_cron_field(fields[2], 1, 31))
+        self.months = set(_parse_cron_field(fields[3], 1, 12))
+        self.weekdays = {d % 7 for d in _parse_cron_field(fields[4], 0, 7)}
+        # Semantica cron classica: se entrambi i giorni sono ristretti basta che uno corrisponda
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, day) -> bool:
+        dom = day.day in self.days
+        dow = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return dow
+        if self.any_weekday:
+            return dom
+        return dom or dow
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(4 * 366 + 1):
+            if day.month in self.months and self._day_matches(day):
+                first_day = day == start.date()
+                for hour in self.hours:
+                    if first_day and hour < start.hour:
+                        continue
+                    for minute in self.minutes:
+                        if first_day and hour == start.hour and minute < start.minute:
+                            continue
+                        return datetime(day.year, day.month, day.day, hour, minute)
+            day += timedelta(days=1)
+        return None
+
+class OnceRule:
+    def __init__(self, value: str):
+        when = datetime.fromisoformat(value)
+        if when.tzinfo is not None:
+            when = when.astimezone().replace(tzinfo=None)
+        self.when = when
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        return self.when if self.when > after else None
+
+class DailyRule:
+    def __init__(self, value: str):
+        parts = [int(p) for p in value.split(":")]
+        if len(parts) not in (2, 3):
+            raise ValueError("formato orario atteso HH:MM")
+        self.at = dt_time(*parts)
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        candidate = datetime.combine(after.date(), self.at)
+        if candidate <= after:
+            candidate = datetime.combine(after.date() + timedelta(days=1), self.at)
+        return candidate
+
+SCHEDULE_RULES = {"once": OnceRule, "daily": DailyRule, "cron": CronRule}
+
+def compile_schedule_rule(rule_type: str, rule: str):
+    if rule_type not in SCHEDULE_RULES:
+        raise ValueError(f"tipo di regola sconosciuto: {rule_type}")
+    return SCHEDULE_RULES[rule_type](rule.strip())
+
+def _utc_db_timestamp_to_local(value: Optional[str]) -> Optional[datetime]:
+    """Converte un CURRENT_TIMESTAMP di SQLite (UTC) in datetime locale naive"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+class AnnouncementScheduler:
+    """
+    Motore degli annunci programmati.
+    Le prossime esecuzioni stanno in un min-heap (fire_ts, schedule_id, generation):
+    una modifica incrementa la generation della regola e inserisce una nuova voce,
+    le voci obsolete vengono scartate quando arrivano in cima. Un solo task asyncio
+    dorme fino alla prossima scadenza, quindi migliaia di regole non costano nulla
+    tra un'esecuzione e l'altra.
+    Ogni scadenza ha un esito (last_outcome): played/queued se l'annuncio e'
+    stato accettato dalla coda, altrimenti missed, skipped_master, no_files,
+    coalesced, rejected o error. Solo i primi due aggiornano last_run_at e
+    contano come "fired".
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._generation = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.stats = {
+            "fired": 0,
+            "missed": 0,
+            "deferred": 0,
+            "skipped_master": 0,
+            "failed": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "lag_last_ms": 0.0,
+            "lag_max_ms": 0.0,
+            "lag_total_ms": 0.0,
+        }
+
+    async def start(self):
+        async with db_connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT * FROM schedules WHERE enabled = 1")
+            rows = await cursor.fetchall()
+        for row in rows:
+            row = dict(row)
+            # Si riparte dall'ultima scadenza valutata, eseguita o no
+            evaluated = [datetime.fromisoformat(row[c]) for c in ("last_run_at", "last_outcome_at") if row.get(c)]
+            anchor = max(evaluated) if evaluated else _utc_db_timestamp_to_local(row["created_at"])
+            self._load(row, anchor or datetime.now())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def reload(self):
+        """Ricarica tutte le programmazioni dal DB (es. dopo un ripristino)"""
+        await self.stop()
+        self._entries.clear()
+        self._heap.clear()
+        await self.start()
+
+    def _load(self, row: dict, anchor: datetime):
+        try:
+            rule = compile_schedule_rule(row["rule_type"], row["rule"])
+        except ValueError:
+            logger.warning("Regola non valida per la programmazione %s", row["id"])
+            return
+        self._generation += 1
+        entry = dict(row, compiled=rule, generation=self._generation, due=None)
+        self._entries[row["id"]] = entry
+        self._push(entry, rule.next_after(anchor))
+
+    def _push(self, entry: dict, due: Optional[datetime]):
+        entry["due"] = due
+        entry["deferred"] = False
+        if due is None:
+            return
+        ts = due.timestamp()
+        wake = not self._heap or ts < self._heap[0][0]
+        heapq.heappush(self._heap, (ts, entry["id"], entry["generation"]))
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+        if wake:
+            self._wakeup.set()
+
+    def _compact(self):
+        self._heap = [item for item in self._heap if self._is_current(item)]
+        heapq.heapify(self._heap)
+
+    def _is_current(self, item) -> bool:
+        entry = self._entries.get(item[1])
+        return entry is not None and entry["generation"] == item[2]
+
+    def upsert(self, row: dict):
+        """Da chiamare dopo ogni INSERT/UPDATE: ricalcola solo la regola modificata"""
+        self._entries.pop(row["id"], None)
+        if row["enabled"]:
+            self._load(row, datetime.now())
+
+    def remove(self, schedule_id: int):
+        self._entries.pop(schedule_id, None)
+
+    def next_fire(self, schedule_id: int) -> Optional[datetime]:
+        entry = self._entries.get(schedule_id)
+        return entry["due"] if entry else None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            while self._heap and not self._is_current(self._heap[0]):
+                heapq.heappop(self._heap)
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, SCHEDULER_MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, schedule_id, _ = heapq.heappop(self._heap)
+            entry = self._entries[schedule_id]
+            try:
+                await self._fire(entry)
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Errore esecuzione programmazione %s", schedule_id)
+                # La voce e' gia' fuori dallo heap: senza _advance la regola non scatterebbe piu'
+                await self._advance(entry, "error")
+
+    def _latest_missed(self, entry: dict, now: float) -> Optional[datetime]:
+        """Esecuzione piu' recente non oltre adesso, entro SCHEDULER_CATCHUP_MAX_AGE"""
+        rule = entry["compiled"]
+        window_start = datetime.fromtimestamp(now - SCHEDULER_CATCHUP_MAX_AGE)
+        candidate = entry["due"] if entry["due"] >= window_start else rule.next_after(window_start)
+        latest = None
+        while candidate is not None and candidate.timestamp() <= now:
+            latest = candidate
+            candidate = rule.next_after(candidate)
+        return latest
+
+    async def _fire(self, entry: dict):
+        now = time.time()
+        due_ts = entry["due"].timestamp()
+        lag = now - due_ts
+
+        if not entry["deferred"] and lag > SCHEDULER_MISFIRE_GRACE:
+            # fire_once recupera solo l'ultima esecuzione persa (se abbastanza recente)
+            latest = self._latest_missed(entry, now) if entry["catch_up"] == "fire_once" else None
+            if latest is None:
+                self.stats["missed"] += 1
+                await self._advance(entry, "missed")
+                return
+            if latest != entry["due"]:
+                self.stats["missed"] += 1
+                entry["due"] = latest
+                due_ts = latest.timestamp()
+                lag = now - due_ts
+
+        if manager.master_active:
+            if entry["master_policy"] == "defer" and lag < SCHEDULER_MAX_DEFER:
+                self.stats["deferred"] += 1
+                entry["deferred"] = True
+                heapq.heappush(self._heap, (now + SCHEDULER_DEFER_SECONDS, entry["id"], entry["generation"]))
+                return
+            self.stats["skipped_master"] += 1
+            await self._advance(entry, "skipped_master")
+            return
+
+        files = await self._resolve_files(entry["target_type"], entry["target_id"])
+        if not files:
+            self.stats["failed"] += 1
+            await self._advance(entry, "no_files")
+            return
+        result = await playback.submit("announcement", {
+            "type": "play",
+            "content": "announcement",
+            "id": entry["target_id"],
+            "files": files
+        }, (entry["target_id"], tuple(files)), "scheduler",
+            log=(entry["target_type"], entry["target_id"], f"schedule:{entry['id']}"))
+        outcome = result["status"]
+        if outcome in ("played", "queued"):
+            await manager.send_to_controllers({
+                "type": "schedule_fired",
+                "schedule_id": entry["id"],
+                "name": entry["name"],
+                "status": outcome
+            })
+            lag_ms = (time.time() - due_ts) * 1000
+            metrics.observe("audioci_scheduler_dispatch_lag_seconds", (), lag_ms / 1000)
+            self.stats["fired"] += 1
+            self.stats["lag_last_ms"] = lag_ms
+            self.stats["lag_max_ms"] = max(self.stats["lag_max_ms"], lag_ms)
+            self.stats["lag_total_ms"] += lag_ms
+        else:
+            self.stats[outcome] += 1
+            logger.warning("Programmazione %s non eseguita: %s %s", entry["id"], outcome, result.get("reason", ""))
+        await self._advance(entry, outcome)
+
+    async def _advance(self, entry: dict, outcome: str):
+        """
+        Accoda l'esecuzione successiva (saltando quelle gia' passate) e ne
+        registra l'esito nel DB; last_run_at solo se l'annuncio e' partito o
+        e' in coda. La coda in memoria si aggiorna per prima: un errore del DB
+        non ferma la regola, al peggio si perde l'esito.
+        """
+        due = entry["due"]
+        next_due = entry["compiled"].next_after(max(due, datetime.now()))
+        if next_due is None:
+            if self._entries.get(entry["id"]) is entry:
+                self._entries.pop(entry["id"])
+        else:
+            self._push(entry, next_due)
+        try:
+            async with db_connect() as db:
+                if outcome in ("played", "queued"):
+                    await db.execute("UPDATE schedules SET last_run_at = ? WHERE id = ?",
+                                     (due.isoformat(), entry["id"]))
+                await db.execute(
+                    "UPDATE schedules SET last_outcome = ?, last_outcome_at = ?, enabled = ? WHERE id = ?",
+                    (outcome, due.isoformat(), 1 if next_due else 0, entry["id"])
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Impossibile registrare l'esecuzione della programmazione %s", entry["id"])
+
+    async def _resolve_files(self, target_type: str, target_id: int) -> List[str]:
+        async with db_connect() as db:
+            if target_type == "sequence":
+                cursor = await db.execute("""
+                    SELECT af.file_path FROM sequence_items si
+                    JOIN announcement_files af ON af.announcement_id = si.announcement_id
+                    WHERE si.sequence_id = ?
+                    ORDER BY si.position, af.file_order
+                """, (target_id,))
+            else:
+                cursor = await db.execute(
+                    "SELECT file_path FROM announcement_files WHERE announcement_id = ? ORDER BY file_order",
+                    (target_id,)
+                )
+            return [row[0] for row in await cursor.fetchall()]
+
+    def status(self) -> dict:
+        fired = self.stats["fired"]
+        upcoming = sorted(
+            (e["due"], e["id"]) for e in self._entries.values() if e["due"] is not None
+        )[:10]
+        return {
+            "active_schedules": len(self._entries),
+            "heap_size": len(self._heap),
+            "lag_avg_ms": self.stats["lag_total_ms"] / fired if fired else 0.0,
+            **self.stats,
+            "upcoming": [{"schedule_id": sid, "fire_at": due.isoformat()} for due, sid in upcoming],
+        }
+
+scheduler = AnnouncementScheduler()
+
+@metrics.collector
+def _scheduler_metrics():
+    for outcome in ("fired", "missed", "deferred", "skipped_master", "failed", "coalesced", "rejected"):
+        yield "audioci_scheduler_events_total", (outcome,), scheduler.stats[outcome]
+
+async def validate_schedule(data: ScheduleCreate):
+    if data.target_type not in ("announcement", "sequence"):
+        raise HTTPException(status_code=400, detail="target_type deve essere 'announcement' o 'sequence'")
+    if data.catch_up not in ("skip", "fire_once"):
+        raise HTTPException(status_code=400, detail="catch_up deve essere 'skip' o 'fire_once'")
+    if data.master_policy not in ("defer", "skip"):
+        raise HTTPException(status_code=400, detail="master_policy deve essere 'defer' o 'skip'")
+    try:
+        rule = compile_schedule_rule(data.rule_type, data.rule)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Regola non valida: {e}")
+    # Un "once" passato si puo' conservare disattivato; un cron senza date possibili mai
+    if rule.next_after(datetime.now()) is None and (data.enabled or data.rule_type != "once"):
+        raise HTTPException(status_code=400, detail="Regola non valida: nessuna esecuzione futura")
+    table, label = ("sequences", "Sequenza") if data.target_type == "sequence" else ("announcements", "Annuncio")
+    async with db_connect() as db:
+        cursor = await db.execute(f"SELECT 1 FROM {table} WHERE id = ?", (data.target_id,))
+        if await cursor.fetchone() is None:
+            raise HTTPException(status_code=400, detail=f"{label} {data.target_id} inesistente")
+
+def schedule_response(row: dict) -> ScheduleResponse:
+    next_fire = scheduler.next_fire(row["id"])
+    return ScheduleResponse(
+        id=row["id"],
+        name=row["name"],
+        target_type=row["target_type"],
+        target_id=row["target_id"],
+        rule_type=row["rule_type"],
+        rule=row["rule"],
+        catch_up=row["catch_up"],
+        master_policy=row["master_policy"],
+        enabled=bool(row["enabled"]),
+        last_run_at=row["last_run_at"],
+        last_outcome=row.get("last_outcome"),
+        last_outcome_at=row.get("last_outcome_at"),
+        next_fire_at=next_fire.isoformat() if next_fire else None
+    )
+
+@app.get("/api/schedules", response_model=List[ScheduleResponse])
+async def get_schedules(current_user: dict = Depends(get_current_user)):
+    async with db_connect() as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("SELECT * FROM schedules ORDER BY name")
+        return [schedule_response(dict(r)) for r in await cursor.fetchall()]
+
+@app.get("/api/schedules/status")
+async def get_schedules_status(admin: dict = Depends(get_admin_user)):
+    return scheduler.status()
+
+@app.post("/api/schedules", response_model=ScheduleResponse)
+async def create_schedule(data: ScheduleCreate, admin: dict = Depends(get_admin_user)):
+    await validate_schedule(data)
+    async with db_connect() as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            """INSERT INTO schedules (name, target_type, target_id, rule_type, rule, catch_up, master_policy, enabled)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (data.name, data.target_type, data.target_id, data.rule_type, data.rule.strip(),
+             data.catch_up, data.master_policy, int(data.enabled))
+        )
+        await db.commit()
+        cursor = await db.execute("SELECT * FROM schedules WHERE id = ?", (cursor.lastrowid,))
+        row = dict(await cursor.fetchone())
+    scheduler.upsert(row)
+    return schedule_response(row)
+
+@app.put("/api/schedules/{schedule_id}", response_model=ScheduleResponse)
+async def update_schedule(schedule_id: int, data: ScheduleCreate, admin: dict = Depends(get_admin_user)):
+    await validate_schedule(data)
+    async with db_connect() as db:
+        db.row_factory = aiosqlite.Row
+        await db.execute(
+            """UPDATE schedules SET name = ?, target_type = ?, target_id = ?, rule_type = ?, rule = ?,
+               catch_up = ?, master_policy = ?, enabled = ? WHERE id = ?""",
+            (data.name, data.target_type, data.target_id, data.rule_type, data.rule.strip(),
+             data.catch_up, data.master_policy, int(data.enabled), schedule_id)
+        )
+        await db.commit()
+        cursor = await db.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,))
+        row = await cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Programmazione non trovata")
+        row = dict(row)
+    scheduler.upsert(row)
+    return schedule_response(row)
+
+@app.delete("/api/schedules/{schedule_id}")
+async def delete_schedule(schedule_id: int, admin: dict = Depends(get_admin_user)):
+    async with db_connect() as db:
+        await db.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+        await db.commit()
+    scheduler.remove(schedule_id)
+    return {"status": "ok"}
+
+# ============== MIXER LATO SERVER (opzionale) ==============
+
+def _load_numpy():
+    """NumPy serve solo al mixer: import alla prima attivazione"""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+def wav_frames_to_pcm(numpy, raw: bytes, width: int, src_channels: int, channels: int):
+    """Frame WAV PCM interi -> float32 (frames, channels), senza ricampionamento"""
+    dtype = {1: numpy.uint8, 2: numpy.int16, 4: numpy.int32}[width]
+    pcm = numpy.frombuffer(raw, dtype=dtype).astype(numpy.float32)
+    if width == 1:
+        pcm = (pcm - 128) / 128
+    else:
+        pcm /= float(2 ** (8 * width - 1))
+    pcm = pcm.reshape(-1, src_channels)
+    if src_channels != channels:
+        pcm = numpy.repeat(pcm.mean(axis=1, keepdims=True), channels, axis=1)
+    return pcm
+
+def decode_audio_file(path: str, sample_rate: int, channels: int):
+    """
+    Decodifica un file audio in PCM float32 (frames, channels).
+    Eseguita nei processi del pool: WAV PCM con la sola stdlib, gli altri
+    formati (MP3, ...) tramite ffmpeg. Solo per file brevi (annunci): i brani
+    del mixer si decodificano a blocchi con TrackStream.
+    """
+    import wave
+    import subprocess
+    import numpy
+
+    if path.lower().endswith(".wav"):
+        try:
+            with wave.open(path, "rb") as w:
+                width, src_channels, src_rate = w.getsampwidth(), w.getnchannels(), w.getframerate()
+                raw = w.readframes(w.getnframes())
+            pcm = wav_frames_to_pcm(numpy, raw, width, src_channels, channels)
+            if src_rate != sample_rate and len(pcm):
+                n_out = int(len(pcm) * sample_rate / src_rate)
+                src_x = numpy.arange(len(pcm), dtype=numpy.float64)
+                dst_x = numpy.linspace(0, len(pcm) - 1, n_out)
+                pcm = numpy.stack([numpy.interp(dst_x, src_x, pcm[:, c]) for c in range(channels)], axis=1)
+            return numpy.ascontiguousarray(pcm, dtype=numpy.float32)
+        except (wave.Error, KeyError):
+            pass
+
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-f", "f32le", "-ac", str(channels), "-ar", str(sample_rate), "-"],
+        capture_output=True, check=True
+    )
+    return numpy.frombuffer(result.stdout, dtype=numpy.float32).reshape(-1, channels)
+
+_audio_pool = None
+
+def audio_pool() -> ProcessPoolExecutor:
+    """Pool di processi condiviso da mixer e forme d'onda, creato al primo uso"""
+    global _audio_pool
+    if _audio_pool is None:
+        _audio_pool = ProcessPoolExecutor(max_workers=AUDIO_POOL_WORKERS)
+    return _audio_pool
+
+def shutdown_audio_pool():
+    global _audio_pool
+    if _audio_pool is not None:
+        _audio_pool.shutdown(wait=False, cancel_futures=True)
+        _audio_pool = None
+
+class PcmSource:
+    """PCM decodificato con posizione di lettura; read() ritorna viste, non copie"""
+
+    def __init__(self, pcm, label: str = ""):
+        self.pcm = pcm
+        self.pos = 0
+        self.label = label
+
+    @property
+    def remaining(self) -> int:
+        return len(self.pcm) - self.pos
+
+    def read(self, frames: int):
+        chunk = self.pcm[self.pos:self.pos + frames]
+        self.pos += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+class _WavChunks:
+    """Lettura a blocchi di un WAV PCM con ricampionamento lineare continuo tra un blocco e l'altro"""
+
+    def __init__(self, path: str, rate: int, channels: int):
+        import wave
+        self.w = wave.open(path, "rb")
+        self.width, self.src_channels, self.src_rate = self.w.getsampwidth(), self.w.getnchannels(), self.w.getframerate()
+        self.rate = rate
+        self.channels = channels
+        self.src_pos = 0     # frame sorgente letti
+        self.out_pos = 0     # frame prodotti
+        self.prev = None     # ultimo frame sorgente del blocco precedente
+
+    def read(self, out_frames: int):
+        src_frames = max(1, int(out_frames * self.src_rate / self.rate))
+        raw = self.w.readframes(src_frames)
+        if not raw:
+            return None
+        pcm = wav_frames_to_pcm(np, raw, self.width, self.src_channels, self.channels)
+        if self.src_rate == self.rate:
+            return pcm
+        ext = pcm if self.prev is None else np.concatenate([self.prev, pcm])
+        base = self.src_pos - (0 if self.prev is None else 1)
+        self.src_pos += len(pcm)
+        self.prev = pcm[-1:]
+        # Frame di uscita k con posizione sorgente k * ratio entro il blocco letto
+        ratio = self.src_rate / self.rate
+        end = int((self.src_pos - 1) / ratio) + 1
+        x = np.arange(self.out_pos, end) * ratio - base
+        self.out_pos = end
+        src_x = np.arange(len(ext))
+        return np.stack([np.interp(x, src_x, ext[:, c]) for c in range(self.channels)], axis=1).astype(np.float32)
+
+    def close(self):
+        self.w.close()
+
+class TrackStream:
+    """
+    Brano del mixer decodificato a blocchi mentre suona: in memoria restano
+    al piu' MIXER_DECODE_AHEAD_SECONDS di PCM (ffmpeg in un sottoprocesso con
+    backpressure sulla pipe, oppure un WAV PCM letto in un thread), quindi un
+    brano lungo non occupa centinaia di MB. Stessa interfaccia di PcmSource;
+    remaining e' esatto solo a decodifica conclusa, prima e' "lontano dalla
+    fine" (il crossfade parte quando il resto e' tutto in buffer).
+    """
+
+    FAR = 1 << 62
+
+    def __init__(self, path: str, rate: int, channels: int, ffmpeg: Optional[str]):
+        self.label = path
+        self.rate = rate
+        self.channels = channels
+        self.ffmpeg = ffmpeg
+        self.ahead = int(rate * MIXER_DECODE_AHEAD_SECONDS)
+        self.chunk_frames = int(rate * MIXER_DECODE_CHUNK_SECONDS)
+        self.buffer = deque()
+        self.buffered = 0
+        self.eof = False
+        self.error = None
+        self._space = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._task = None
+
+    async def open(self) -> bool:
+        """Avvia la decodifica e attende il primo blocco; False se il file non e' decodificabile"""
+        self._task = asyncio.create_task(self._decode())
+        await self._ready.wait()
+        return self.buffered > 0
+
+    @property
+    def remaining(self) -> int:
+        return self.buffered if self.eof else self.FAR
+
+    def _push(self, pcm):
+        if len(pcm):
+            self.buffer.append(pcm)
+            self.buffered += len(pcm)
+            self._ready.set()
+
+    async def _wait_space(self):
+        while self.buffered >= self.ahead:
+            self._space.clear()
+            await self._space.wait()
+
+    async def _decode(self):
+        try:
+            wav = None
+            if self.label.lower().endswith(".wav"):
+                try:
+                    wav = await asyncio.to_thread(_WavChunks, self.label, self.rate, self.channels)
+                except Exception as e:
+                    self.error = e    # non e' un WAV PCM leggibile: si prova con ffmpeg
+            if wav is not None:
+                try:
+                    while True:
+                        await self._wait_space()
+                        pcm = await asyncio.to_thread(wav.read, self.chunk_frames)
+                        if pcm is None:
+                            break
+                        self._push(pcm)
+                finally:
+                    wav.close()
+            elif self.ffmpeg:
+                await self._decode_ffmpeg()
+            elif self.error is None:
+                self.error = RuntimeError("ffmpeg non disponibile")
+        except Exception as e:
+            self.error = e
+        finally:
+            self.eof = True
+            self._ready.set()
+
+    async def _decode_ffmpeg(self):
+        proc = await asyncio.create_subprocess_exec(
+            self.ffmpeg, "-v", "error", "-i", self.label, "-f", "f32le",
+            "-ac", str(self.channels), "-ar", str(self.rate), "-",
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        frame_bytes = 4 * self.channels
+        pending = b""
+        try:
+            while True:
+                await self._wait_space()
+                data = await proc.stdout.read(self.chunk_frames * frame_bytes)
+                if not data:
+                    break
+                pending += data
+                usable = len(pending) - len(pending) % frame_bytes
+                self._push(np.frombuffer(pending[:usable], dtype=np.float32).reshape(-1, self.channels))
+                pending = pending[usable:]
+            if await proc.wait() != 0 and not self.buffered:
+                self.error = RuntimeError(f"ffmpeg terminato con codice {proc.returncode}")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+    def read(self, frames: int):
+        parts = []
+        needed = frames
+        while needed and self.buffer:
+            head = self.buffer[0]
+            if len(head) <= needed:
+                parts.append(self.buffer.popleft())
+                needed -= len(head)
+            else:
+                parts.append(head[:needed])
+                self.buffer[0] = head[needed:]
+                needed = 0
+        read = frames - needed
+        self.buffered -= read
+        if self.buffered < self.ahead:
+            self._space.set()
+        if not parts:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self.buffer.clear()
+        self.buffered = 0
+
+class MasterPcmFeed:
+    """
+    Audio del Master per le zone del mixer: i chunk WebM/Opus ricevuti da
+    /ws/master passano in un ffmpeg e il PCM decodificato resta disponibile
+    per MIXER_MASTER_BUFFER_SECONDS. Ogni zona lo legge dalla propria
+    posizione, dopo aver accumulato MIXER_MASTER_JITTER_SECONDS. Senza
+    ffmpeg l'audio Opus non e' decodificabile e le zone restano in silenzio
+    durante il Master (il flusso /stream/live resta disponibile).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.session = 0
+        self.chunks = deque()    # (frame iniziale, pcm) in ordine
+        self.start_frame = 0     # primo frame ancora in buffer
+        self.end_frame = 0
+        self.active = False
+        self._proc = None
+        self._reader = None
+        self.stats = {"sessions": 0, "bytes": 0, "errors": 0}
+
+    async def begin(self):
+        if self._proc is not None or not self.engine.zones:
+            return
+        self.session += 1
+        self.chunks.clear()
+        self.start_frame = self.end_frame = 0
+        self.active = True
+        if not self.engine.ffmpeg:
+            logger.warning("Mixer: ffmpeg non disponibile, le zone restano in silenzio durante il Master")
+            return
+        self.stats["sessions"] += 1
+        self._proc = await asyncio.create_subprocess_exec(
+            self.engine.ffmpeg, "-v", "error", "-i", "-", "-f", "f32le",
+            "-ac", str(MIXER_CHANNELS), "-ar", str(MIXER_SAMPLE_RATE), "-",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        self._reader = asyncio.create_task(self._read(self._proc))
+
+    async def feed(self, data: bytes):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.write(data)
+            await self._proc.stdin.drain()
+            self.stats["bytes"] += len(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.stats["errors"] += 1
+            logger.warning("Mixer: decodifica dell'audio Master interrotta")
+            await self._close()
+
+    async def end(self):
+        self.active = False
+        await self._close()
+
+    async def _close(self):
+        proc, reader = self._proc, self._reader
+        self._proc = self._reader = None
+        if proc is None:
+            return
+        with contextlib.suppress(OSError):
+            proc.stdin.close()
+        try:
+            await asyncio.wait_for(reader, timeout=2)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+
+    async def _read(self, proc):
+        frame_bytes = 4 * MIXER_CHANNELS
+        max_frames = int(MIXER_MASTER_BUFFER_SECONDS * MIXER_SAMPLE_RATE)
+        pending = b""
+        while True:
+            data = await proc.stdout.read(65536)
+            if not data:
+                return
+            pending += data
+            usable = len(pending) - len(pending) % frame_bytes
+            if usable:
+                self.append(np.frombuffer(pending[:usable], dtype=np.float32).reshape(-1, MIXER_CHANNELS), max_frames)
+                pending = pending[usable:]
+
+    def append(self, pcm, max_frames: int):
+        self.chunks.append((self.end_frame, pcm))
+        self.end_frame += len(pcm)
+        while self.chunks and self.end_frame - (self.chunks[0][0] + len(self.chunks[0][1])) >= max_frames:
+            self.chunks.popleft()
+        self.start_frame = self.chunks[0][0] if self.chunks else self.end_frame
+
+    def read(self, pos: int, frames: int):
+        """PCM da pos (al piu' frames): ritorna (pcm, nuova posizione)"""
+        pos = max(pos, self.start_frame)
+        out = np.zeros((frames, MIXER_CHANNELS), dtype=np.float32)
+        filled = 0
+        for start, pcm in self.chunks:
+            if filled == frames:
+                break
+            if start + len(pcm) <= pos + filled:
+                continue
+            offset = pos + filled - start
+            part = pcm[offset:offset + frames - filled]
+            out[filled:filled + len(part)] = part
+            filled += len(part)
+        return out, pos + filled
+
+class ZoneMixer:
+    """
+    Programma continuo di una zona: musica della playlist con crossfade,
+    annunci in coda con ducking della musica e pre-emption del Master
+    (durante l'annuncio live la zona trasmette l'audio del Master decodificato
+    da MasterPcmFeed, la musica resta ferma al punto in cui era e l'annuncio
+    in corso viene annullato). I brani si decodificano a blocchi (TrackStream);
+    un brano non decodificabile viene saltato.
+    Il mix e' interamente vettoriale (NumPy) a blocchi di MIXER_BLOCK_SECONDS.
+    """
+
+    def __init__(self, engine, name: str):
+        self.engine = engine
+        self.name = name
+        self.rate = MIXER_SAMPLE_RATE
+        self.channels = MIXER_CHANNELS
+        self.block_frames = int(MIXER_SAMPLE_RATE * MIXER_BLOCK_SECONDS)
+        self.crossfade_frames = int(MIXER_SAMPLE_RATE * MIXER_CROSSFADE_SECONDS)
+        self.ring = LiveStreamRing(LIVE_RING_BYTES)
+        self.playlist = []
+        self.playlist_index = -1
+        self.music = None
+        self.next_music = None
+        self._next_future = None
+        self.fading = None
+        self.fade_pos = 0
+        self.announcements = deque()
+        self.announcement = None
+        self.music_gain = 1.0
+        self._was_master = False
+        self._master_session = None
+        self._master_pos = 0
+        self._master_primed = False
+        self._task = None
+        self._encoder = None
+        self._encoder_reader = None
+        self.stats = {"blocks": 0, "render_seconds": 0.0, "underruns": 0, "tracks": 0, "announcements": 0,
+                      "decode_errors": 0}
+
+    # --- Controllo ---
+
+    def _release_music(self):
+        for source in (self.music, self.next_music, self.fading):
+            if source is not None:
+                source.close()
+        self.music = self.next_music = self.fading = None
+        if self._next_future is not None:
+            self._next_future.cancel()
+            self._next_future = None
+
+    def set_playlist(self, files: List[str], shuffle: bool = False, seed: Optional[int] = None):
+        self.playlist = list(files)
+        if shuffle:
+            random.Random(seed).shuffle(self.playlist)
+        self.playlist_index = -1
+        self._release_music()
+        self._prefetch_next()
+
+    def skip(self):
+        if self.next_music is not None:
+            for source in (self.music, self.fading):
+                if source is not None:
+                    source.close()
+            self.music, self.next_music = self.next_music, None
+            self.fading = None
+            self.stats["tracks"] += 1
+            self._prefetch_next()
+
+    def stop(self):
+        self.playlist = []
+        self._release_music()
+        self.announcement = None
+        self.announcements.clear()
+
+    async def announce(self, files: List[str]):
+        parts = await asyncio.gather(*(self.engine.decode(f) for f in files))
+        parts = [p for p in parts if len(p)]
+        if parts:
+            self.announcements.append(PcmSource(np.concatenate(parts), label=",".join(files)))
+
+    def _prefetch_next(self):
+        if not self.playlist or self._next_future is not None:
+            return
+        self._next_future = asyncio.ensure_future(self._open_next())
+
+    async def _open_next(self):
+        """Apre il prossimo brano decodificabile; quelli in errore vengono saltati (un giro al massimo)"""
+        stream = None
+        try:
+            for _ in range(len(self.playlist)):
+                self.playlist_index = (self.playlist_index + 1) % len(self.playlist)
+                candidate = TrackStream(self.playlist[self.playlist_index], self.rate, self.channels,
+                                        self.engine.ffmpeg)
+                try:
+                    opened = await candidate.open()
+                except asyncio.CancelledError:
+                    candidate.close()
+                    raise
+                if opened:
+                    stream = candidate
+                    break
+                candidate.close()
+                self.stats["decode_errors"] += 1
+                logger.warning("Mixer %s: decodifica fallita per %s (%s), brano saltato",
+                               self.name, candidate.label, candidate.error)
+        finally:
+            if self._next_future is asyncio.current_task():
+                self._next_future = None
+        if stream is None:
+            logger.error("Mixer %s: nessun brano della playlist e' decodificabile", self.name)
+            return
+        if self.music is None:
+            self.music = stream
+            self.stats["tracks"] += 1
+            self._prefetch_next()
+        else:
+            self.next_music = stream
+
+    # --- Rendering ---
+
+    def _render_music(self, frames: int):
+        out = np.zeros((frames, self.channels), dtype=np.float32)
+        if self.music is None:
+            return out
+        # Avvio del crossfade quando la traccia corrente sta per finire
+        if self.fading is None and self.next_music is not None and self.music.remaining <= self.crossfade_frames:
+            self.fading, self.music, self.next_music = self.music, self.next_music, None
+            self.fade_pos = 0
+            self.stats["tracks"] += 1
+            self._prefetch_next()
+
+        chunk = self.music.read(frames)
+        if self.fading is None:
+            out[:len(chunk)] = chunk
+        else:
+            old = self.fading.read(frames)
+            t = (self.fade_pos + np.arange(frames, dtype=np.float32)) / max(1, self.crossfade_frames)
+            np.clip(t, 0.0, 1.0, out=t)
+            fade_in = np.sin(t * (np.pi / 2))[:, None]
+            fade_out = np.cos(t * (np.pi / 2))[:, None]
+            out[:len(chunk)] = chunk * fade_in[:len(chunk)]
+            out[:len(old)] += old * fade_out[:len(old)]
+            self.fade_pos += frames
+            if self.fade_pos >= self.crossfade_frames or self.fading.remaining == 0:
+                self.fading.close()
+                self.fading = None
+
+        if self.music.remaining == 0:
+            # Traccia finita senza crossfade (successiva non ancora pronta)
+            self.music.close()
+            self.music, self.next_music = self.next_music, None
+            if self.music is not None:
+                self.stats["tracks"] += 1
+                self._prefetch_next()
+            elif self.playlist:
+                self.stats["underruns"] += 1
+        elif len(chunk) < frames:
+            self.stats["underruns"] += 1    # decodifica in ritardo sul consumo
+        return out
+
+    def _render_master(self, frames: int):
+        """Audio live del Master, con un piccolo accumulo iniziale contro il jitter della rete"""
+        feed = self.engine.master_feed
+        if self._master_session != feed.session:
+            self._master_session = feed.session
+            self._master_pos = 0
+            self._master_primed = False
+        if not self._master_primed:
+            if feed.end_frame - self._master_pos < MIXER_MASTER_JITTER_SECONDS * self.rate:
+                return np.zeros((frames, self.channels), dtype=np.float32)
+            self._master_primed = True
+        out, self._master_pos = feed.read(self._master_pos, frames)
+        return out
+
+    def render(self, frames: int):
+        """Produce il prossimo blocco PCM float32 (frames, channels)"""
+        master = manager.master_active
+        if master:
+            if not self._was_master:
+                self.announcement = None
+                self.announcements.clear()
+            self._was_master = True
+            self.music_gain = 0.0
+            return self._render_master(frames)
+        self._was_master = False
+
+        if self.announcement is None and self.announcements:
+            self.announcement = self.announcements.popleft()
+            self.stats["announcements"] += 1
+
+        target = MIXER_DUCK_GAIN if self.announcement is not None else 1.0
+        step = frames / (self.rate * MIXER_DUCK_SECONDS)
+        end_gain = min(target, self.music_gain + step) if target > self.music_gain else max(target, self.music_gain - step)
+        gains = np.linspace(self.music_gain, end_gain, frames, dtype=np.float32)[:, None]
+        self.music_gain = end_gain
+
+        out = self._render_music(frames)
+        out *= gains
+        if self.announcement is not None:
+            chunk = self.announcement.read(frames)
+            out[:len(chunk)] += chunk
+            if self.announcement.remaining == 0:
+                self.announcement = None
+        np.clip(out, -1.0, 1.0, out=out)
+        return out
+
+    # --- Streaming ---
+
+    async def start(self):
+        if self.engine.ffmpeg:
+            self.ring.begin(header=b"")
+            self._encoder = await asyncio.create_subprocess_exec(
+                self.engine.ffmpeg, "-v", "error", "-f", "s16le", "-ar", str(self.rate), "-ac", str(self.channels),
+                "-i", "-", "-f", "mp3", "-b:a", MIXER_MP3_BITRATE, "-",
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+            )
+            self._encoder_reader = asyncio.create_task(self._read_encoder())
+        else:
+            self.ring.begin(header=wav_stream_header(self.rate, self.channels))
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._release_music()
+        for task in (self._task, self._encoder_reader):
+            if task:
+                task.cancel()
+        if self._encoder:
+            self._encoder.stdin.close()
+            try:
+                await asyncio.wait_for(self._encoder.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self._encoder.kill()
+        self.ring.end()
+
+    async def _read_encoder(self):
+        while True:
+            data = await self._encoder.stdout.read(4096)
+            if not data:
+                return
+            self.ring.write(data)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        block_seconds = self.block_frames / self.rate
+        next_tick = loop.time()
+        while True:
+            start = time.perf_counter()
+            pcm = self.render(self.block_frames)
+            data = (pcm * 32767).astype("<i2").tobytes()
+            self.stats["render_seconds"] += time.perf_counter() - start
+            self.stats["blocks"] += 1
+            if self._encoder:
+                self._encoder.stdin.write(data)
+                await self._encoder.stdin.drain()
+            else:
+                self.ring.write(data)
+            # Ritmo in tempo reale, con MIXER_LEAD_SECONDS di anticipo sul consumo
+            next_tick += block_seconds
+            delay = next_tick - loop.time() - MIXER_LEAD_SECONDS
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -1.0:
+                next_tick = loop.time()
+
+    def status(self) -> dict:
+        blocks = self.stats["blocks"]
+        audio_seconds = blocks * self.block_frames / self.rate
+        return {
+            "zone": self.name,
+            "playlist_length": len(self.playlist),
+            "playlist_index": self.playlist_index,
+            "music": self.music.label if self.music else None,
+            "announcement": self.announcement.label if self.announcement else None,
+            "queued_announcements": len(self.announcements),
+            "music_gain": round(self.music_gain, 3),
+            "listeners": self.ring.listeners,
+            "realtime_factor": round(audio_seconds / self.stats["render_seconds"], 1) if self.stats["render_seconds"] else None,
+            **self.stats,
+        }
+
+def wav_stream_header(rate: int, channels: int) -> bytes:
+    """Intestazione WAV per uno stream PCM 16 bit di lunghezza indefinita"""
+    byte_rate = rate * channels * 2
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVEfmt " +
+            struct.pack("<IHHIIHH", 16, 1, channels, rate, byte_rate, channels * 2, 16) +
+            b"data" + struct.pack("<I", 0xFFFFFFFF))
+
+class MixerEngine:
+    """Zone del mixer; gli annunci si decodificano nel pool di processi audio condiviso"""
+
+    def __init__(self):
+        self.zones: Dict[str, ZoneMixer] = {}
+        self.ffmpeg = None
+        self.started = False
+        self.master_feed = MasterPcmFeed(self)
+
+    def _ensure_started(self):
+        if not MIXER_ENABLED:
+            raise HTTPException(status_code=503, detail="Mixer lato server disabilitato (AUDIOCI_MIXER=1)")
+        if not self.started:
+            _load_numpy()
+            self.ffmpeg = shutil.which("ffmpeg")
+            self.started = True
+
+    async def decode(self, path: str):
+        return await asyncio.get_running_loop().run_in_executor(
+            audio_pool(), decode_audio_file, path, MIXER_SAMPLE_RATE, MIXER_CHANNELS
+        )
+
+    async def zone(self, name: str) -> ZoneMixer:
+        self._ensure_started()
+        zone = self.zones.get(name)
+        if zone is None:
+            zone = self.zones[name] = ZoneMixer(self, name)
+            await zone.start()
+        return zone
+
+    async def remove_zone(self, name: str):
+        zone = self.zones.pop(name, None)
+        if zone:
+            await zone.close()
+
+    async def shutdown(self):
+        await self.master_feed.end()
+        for name in list(self.zones):
+            await self.remove_zone(name)
+
+mixer = MixerEngine()
+
+@metrics.collector
+def _mixer_metrics():
+    for zone in mixer.zones.values():
+        yield "audioci_mixer_listeners", (zone.name,), zone.ring.listeners
+        yield "audioci_mixer_render_seconds_total", (zone.name,), zone.stats["render_seconds"]
+        yield "audioci_mixer_audio_seconds_total", (zone.name,), zone.stats["blocks"] * MIXER_BLOCK_SECONDS
+        yield "audioci_mixer_underruns_total", (zone.name,), zone.stats["underruns"]
+        yield "audioci_mixer_decode_errors_total", (zone.name,), zone.stats["decode_errors"]
+
+class MixerPlaylistRequest(BaseModel):
+    playlist_id: int
+    shuffle: bool = False
+    seed: Optional[int] = None
+
+class MixerAnnounceRequest(BaseModel):
+    announcement_id: Optional[int] = None
+    sequence_id: Optional[int] = None
+
+@app.get("/api/mixer")
+async def get_mixer_status(current_user: dict = Depends(get_current_user)):
+    return {
+        "enabled": MIXER_ENABLED,
+        "encoder": "mp3" if mixer.ffmpeg else "wav",
+        "zones": [z.status() for z in mixer.zones.values()],
+    }
+
+@app.post("/api/mixer/zones/{zone_name}/playlist")
+async def mixer_play_playlist(zone_name: str, req: MixerPlaylistRequest, current_user: dict = Depends(get_current_user)):
+    zone = await mixer.zone(zone_name)
+    async with db_connect() as db:
+        cursor = await db.execute("""
+            SELECT m.file_path FROM music m
+            JOIN playlist_items pi ON m.id = pi.music_id
+            WHERE pi.playlist_id = ?
+            ORDER BY pi.position
+        """, (req.playlist_id,))
+        files = [str(audio_file(MUSIC_DIR, row[0])) for row in await cursor.fetchall()]
+    if not files:
+        raise HTTPException(status_code=404, detail="Playlist vuota o inesistente")
+    zone.set_playlist(files, req.shuffle, req.seed)
+    return zone.status()
+
+@app.post("/api/mixer/zones/{zone_name}/announce")
+async def mixer_announce(zone_name: str, req: MixerAnnounceRequest, current_user: dict = Depends(get_current_user)):
+    zone = await mixer.zone(zone_name)
+    if manager.master_active:
+        raise HTTPException(status_code=409, detail="Annuncio master in corso")
+    if req.sequence_id is not None:
+        files = await scheduler._resolve_files("sequence", req.sequence_id)
+    elif req.announcement_id is not None:
+        files = await scheduler._resolve_files("announcement", req.announcement_id)
+    else:
+        raise HTTPException(status_code=400, detail="Indicare announcement_id o sequence_id")
+    if not files:
+        raise HTTPException(status_code=404, detail="Nessun file da riprodurre")
+    await zone.announce([str(audio_file(ANNOUNCEMENTS_DIR, f)) for f in files])
+    return zone.status()
+
+@app.post("/api/mixer/zones/{zone_name}/next")
+async def mixer_next(zone_name: str, current_user: dict = Depends(get_current_user)):
+    zone = await mixer.zone(zone_name)
+    zone.skip()
+    return zone.status()
+
+@app.post("/api/mixer/zones/{zone_name}/stop")
+async def mixer_stop(zone_name: str, current_user: dict = Depends(get_current_user)):
+    zone = await mixer.zone(zone_name)
+    zone.stop()
+    return zone.status()
+
+@app.delete("/api/mixer/zones/{zone_name}")
+async def mixer_remove_zone(zone_name: str, admin: dict = Depends(get_admin_user)):
+    await mixer.remove_zone(zone_name)
+    return {"status": "ok"}
+
+@app.get("/stream/zone/{zone_name}")
+async def stream_zone(zone_name: str):
+    """Programma continuo della zona (MP3 se ffmpeg e' disponibile, altrimenti WAV PCM)"""
+    zone = mixer.zones.get(zone_name)
+    if zone is None:
+        raise HTTPException(status_code=404, detail="Zona non attiva")
+    return StreamingResponse(
+        _ring_stream_body(zone.ring),
+        media_type="audio/mpeg" if mixer.ffmpeg else "audio/wav",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    )
+
+# ============== ANALISI AUDIO: FORME D'ONDA E IMPRONTE ==============
+
+def peaks_path(audio_path: Path) -> Path:
+    return audio_path.with_name(audio_path.name + PEAKS_SUFFIX)
+
+def write_peaks_file(pcm, target: str) -> int:
+    """
+    Calcola i peaks multi-risoluzione di un PCM mono e li scrive in target.
+    Formato (little endian): PEAKS_MAGIC, versione (u8), numero di livelli
+    (u8), riservato (u16), frequenza (u32), frame decodificati (u32), coppie
+    per livello (u32 ciascuno), poi per ogni livello, dal piu' fine, le
+    coppie (min, max) in int8.
+    """
+    import numpy
+
+    frames = len(pcm)
+    finest = PEAKS_LEVELS[0]
+    if frames < finest:
+        pcm = numpy.pad(pcm, (0, finest - frames))
+    # Livello piu' fine in un solo passaggio vettoriale, gli altri per riduzione del precedente
+    starts = numpy.arange(finest, dtype=numpy.int64) * len(pcm) // finest
+    mins = numpy.minimum.reduceat(pcm, starts)
+    maxs = numpy.maximum.reduceat(pcm, starts)
+    body = []
+    for count in PEAKS_LEVELS:
+        mins = mins.reshape(count, -1).min(axis=1)
+        maxs = maxs.reshape(count, -1).max(axis=1)
+        pairs = numpy.round(numpy.stack([mins, maxs], axis=1) * 127)
+        body.append(numpy.clip(pairs, -127, 127).astype(numpy.int8).tobytes())
+
+    data = (struct.pack("<4sBBHII", PEAKS_MAGIC, PEAKS_VERSION, len(PEAKS_LEVELS), 0, PEAKS_SAMPLE_RATE, frames) +
+            struct.pack(f"<{len(PEAKS_LEVELS)}I", *PEAKS_LEVELS) + b"".join(body))
+    tmp = target + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, target)
+    return len(data)
+
+def build_peaks_file(audio_path: str, target: str) -> int:
+    """Decodifica e peaks di un file (eseguita nei processi del pool)"""
+    return write_peaks_file(decode_audio_file(audio_path, PEAKS_SAMPLE_RATE, 1)[:, 0], target)
+
+def audio_fingerprint(pcm, rate: int):
+    """
+    Impronta acustica compatta: per ogni segmento di durata e banda di
+    frequenza, 1 se l'energia e' chiaramente sopra la media della banda
+    sull'intero file. Il silenzio iniziale e finale viene scartato e le bande
+    quasi mute restano a 0, cosi' padding dell'encoder, volume, rumore e
+    ricampionamento cambiano pochi bit. Ritorna (impronta, durata
+    senza silenzi) oppure None per un file muto.
+    """
+    import numpy
+
+    level = numpy.abs(pcm)
+    if not len(level):
+        return None
+    audible = numpy.flatnonzero(level > max(float(level.max()) * FINGERPRINT_SILENCE, 1e-4))
+    if not len(audible):
+        return None
+    pcm = pcm[audible[0]:audible[-1] + 1]
+    duration = len(pcm) / rate
+
+    frame = FINGERPRINT_FRAME
+    n = max(len(pcm) // frame, FINGERPRINT_SEGMENTS)
+    pcm = numpy.pad(pcm, (0, max(0, n * frame - len(pcm))))[:n * frame]
+    spectrum = numpy.abs(numpy.fft.rfft(pcm.reshape(n, frame) * numpy.hanning(frame), axis=1)) ** 2
+    edges = numpy.geomspace(FINGERPRINT_MIN_HZ, FINGERPRINT_MAX_HZ, FINGERPRINT_BANDS + 1)
+    bins = numpy.round(edges * frame / rate).astype(numpy.int64)
+    bands = numpy.add.reduceat(spectrum, bins, axis=1)[:, :FINGERPRINT_BANDS]
+    starts = numpy.arange(FINGERPRINT_SEGMENTS) * n // FINGERPRINT_SEGMENTS
+    energy = numpy.add.reduceat(bands, starts, axis=0) / numpy.diff(numpy.append(starts, n))[:, None]
+    # Pavimento e margine: le bande quasi mute non producono bit casuali
+    energy = numpy.log10(energy + energy.mean() * FINGERPRINT_FLOOR)
+    bits = energy - energy.mean(axis=0) > FINGERPRINT_MARGIN
+    return numpy.packbits(bits.ravel()).tobytes(), duration
+
+def analyze_audio_file(audio_path: str, peaks_target: Optional[str]):
+    """Una sola decodifica per file importato: peaks (se richiesti) e impronta"""
+    pcm = decode_audio_file(audio_path, PEAKS_SAMPLE_RATE, 1)[:, 0]
+    if peaks_target:
+        write_peaks_file(pcm, peaks_target)
+    return audio_fingerprint(pcm, PEAKS_SAMPLE_RATE)
+
+def fingerprint_distance(a: bytes, b: bytes) -> int:
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).bit_count()
+
+async def find_duplicate(db, kind: str, fingerprint: bytes, duration: float) -> Optional[dict]:
+    """
+    Probabile duplicato gia' registrato: l'indice (kind, duration) restringe
+    i candidati ai file di durata compatibile, poi si confrontano le impronte.
+    """
+    tolerance = max(FINGERPRINT_DURATION_TOLERANCE, duration * 0.02)
+    cursor = await db.execute(
+        "SELECT ref_id, file_path, fingerprint FROM audio_fingerprints WHERE kind = ? AND duration BETWEEN ? AND ?",
+        (kind, duration - tolerance, duration + tolerance)
+    )
+    best = None
+    for ref_id, file_path, candidate in await cursor.fetchall():
+        distance = fingerprint_distance(fingerprint, candidate)
+        if distance <= FINGERPRINT_MAX_DISTANCE and (best is None or distance < best["distance"]):
+            best = {"kind": kind, "id": ref_id, "file_path": file_path, "distance": distance}
+    return best
+
+async def register_fingerprint(db, kind: str, ref_id: int, file_path: str, fingerprint: bytes, duration: float):
+    await db.execute(
+        "INSERT INTO audio_fingerprints (kind, ref_id, file_path, duration, fingerprint) VALUES (?, ?, ?, ?, ?)",
+        (kind, ref_id, file_path, duration, fingerprint)
+    )
+
+def count_duplicates(kind: str, duplicates: List[dict]):
+    for item in duplicates:
+        metrics.inc("audioci_import_duplicates_total", (kind, "skipped" if item["skipped"] else "flagged"))
+
+FINGERPRINT_SOURCES = {
+    "announcements": (ANNOUNCEMENTS_DIR, "SELECT announcement_id, file_path FROM announcement_files"),
+    "music": (MUSIC_DIR, "SELECT id, file_path FROM music"),
+}
+
+class AudioAnalyzer:
+    """
+    Analisi dei file audio nel pool di processi, fuori dall'event loop:
+    forme d'onda per l'anteprima e impronte acustiche per i duplicati.
+    Upload singoli e TTS accodano il file con schedule() (richieste
+    concorrenti per lo stesso file condividono un'unica decodifica); i bulk
+    upload analizzano l'intero lotto con analyze_batch() prima di
+    registrarlo. Dopo PEAKS_BACKFILL_DELAY dall'avvio completa peaks e
+    impronte mancanti della libreria esistente. Al massimo
+    AUDIO_ANALYSIS_WORKERS analisi occupano il pool insieme, cosi' un import
+    di massa non lascia in coda le decodifiche del mixer.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._failed = set()              # file non decodificabili: nessun nuovo tentativo
+        self._task = None
+        self._slots = asyncio.Semaphore(AUDIO_ANALYSIS_WORKERS)
+        self.stats = {"built": 0, "failed": 0, "fingerprinted": 0, "seconds": 0.0}
+
+    async def start(self):
+        import importlib.util
+        # Senza NumPy non si analizza nulla: niente peaks (404) e import senza controllo duplicati
+        self.enabled = importlib.util.find_spec("numpy") is not None
+        if self.enabled:
+            self._task = asyncio.create_task(self._backfill())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, audio_path: Path, owner: Optional[tuple] = None) -> asyncio.Future:
+        """
+        Accoda l'analisi; il future ritorna il percorso dei peaks o None.
+        Con owner = (kind, ref_id) registra anche l'impronta del file.
+        """
+        key = str(audio_path)
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.ensure_future(self._build(audio_path, owner))
+            future.add_done_callback(lambda f: self._pending.pop(key, None))
+        return future
+
+    async def _build(self, audio_path: Path, owner: Optional[tuple]) -> Optional[Path]:
+        if not self.enabled or str(audio_path) in self._failed:
+            return None
+        target = peaks_path(audio_path)
+        start = time.perf_counter()
+        try:
+            if owner is None:
+                await self._run(build_peaks_file, str(audio_path), str(target))
+            else:
+                analysis = await self._run(analyze_audio_file, str(audio_path), str(target))
+        except Exception as e:
+            self.stats["failed"] += 1
+            self._failed.add(str(audio_path))
+            logger.warning("Analisi audio fallita per %s: %s", audio_path.name, e)
+            return None
+        finally:
+            self.stats["seconds"] += time.perf_counter() - start
+        self.stats["built"] += 1
+        if owner is not None and analysis:
+            async with db_connect() as db:
+                await register_fingerprint(db, owner[0], owner[1], audio_path.name, *analysis)
+                await db.commit()
+            self.stats["fingerprinted"] += 1
+        return target
+
+    async def _run(self, func, *args):
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(audio_pool(), func, *args)
+
+    async def get(self, audio_path: Path) -> Optional[Path]:
+        """Peaks pronti, generati al volo se mancanti"""
+        target = peaks_path(audio_path)
+        if target.exists():
+            return target
+        return await self.schedule(audio_path)
+
+    async def analyze_batch(self, paths: List[Path]) -> list:
+        """
+        Impronte (e peaks) di un lotto di file, in parallelo su
+        AUDIO_ANALYSIS_WORKERS processi del pool. Per ogni file (impronta,
+        durata) oppure None se non analizzabile.
+        """
+        if not self.enabled:
+            return [None] * len(paths)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            self._run(analyze_audio_file, str(path), str(peaks_path(path)))
+            for path in paths
+        ), return_exceptions=True)
+        self.stats["seconds"] += time.perf_counter() - start
+        analyses = []
+        for path, result in zip(paths, results):
+            if isinstance(result, Exception):
+                self.stats["failed"] += 1
+                logger.warning("Analisi audio fallita per %s: %s", path.name, result)
+                result = None
+            else:
+                self.stats["built"] += 1
+                self.stats["fingerprinted"] += result is not None
+            analyses.append(result)
+        return analyses
+
+    async def _backfill(self):
+        await asyncio.sleep(PEAKS_BACKFILL_DELAY)
+        rows = []
+        async with db_connect() as db:
+            for kind, (directory, sql) in FINGERPRINT_SOURCES.items():
+                cursor = await db.execute("SELECT file_path FROM audio_fingerprints WHERE kind = ?", (kind,))
+                fingerprinted = {row[0] for row in await cursor.fetchall()}
+                cursor = await db.execute(sql)
+                rows.extend((directory, file_path, (kind, ref_id) if file_path not in fingerprinted else None)
+                            for ref_id, file_path in await cursor.fetchall())
+
+        def pending():
+            jobs = []
+            for directory, file_path, owner in rows:
+                path = audio_file(directory, file_path)
+                if path.exists() and (owner is not None or not peaks_path(path).exists()):
+                    jobs.append((path, owner))
+            return jobs
+
+        jobs = await asyncio.to_thread(pending)
+        if jobs:
+            logger.info("Analisi audio mancanti (peaks/impronte): %d file", len(jobs))
+        # A piccoli gruppi, per non accodare migliaia di decodifiche nel pool
+        for start in range(0, len(jobs), AUDIO_ANALYSIS_WORKERS):
+            await asyncio.gather(*(self.schedule(path, owner)
+                                   for path, owner in jobs[start:start + AUDIO_ANALYSIS_WORKERS]))
+
+analyzer = AudioAnalyzer()
+
+@metrics.collector
+def _analyzer_metrics():
+    yield "audioci_audio_analysis_total", ("ok",), analyzer.stats["built"]
+    yield "audioci_audio_analysis_total", ("failed",), analyzer.stats["failed"]
+    yield "audioci_audio_analysis_seconds_total", (), analyzer.stats["seconds"]
+
+PEAKS_DIRS = {"announcements": ANNOUNCEMENTS_DIR, "music": MUSIC_DIR}
+
+@app.get("/api/peaks/{kind}/{filename}")
+async def get_peaks(kind: str, filename: str):
+    """
+    Forma d'onda precalcolata di un file audio (pochi KB, formato descritto in
+    build_peaks_file). I nomi dei file caricati sono univoci e non vengono mai
+    riscritti, quindi la risposta e' cacheabile come immutabile.
+    """
+    directory = PEAKS_DIRS.get(kind)
+    if directory is None:
+        raise HTTPException(status_code=404, detail="Tipo non valido")
+    audio_path = audio_file(directory, filename)
+    if not audio_path.is_file():
+        raise HTTPException(status_code=404, detail="File non trovato")
+    target = await analyzer.get(audio_path)
+    if target is None:
+        raise HTTPException(status_code=404, detail="Forma d'onda non disponibile")
+    return FileResponse(
+        target, media_type="application/octet-stream",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+# ============== PROFILING (solo admin, opt-in) ==============
+
+PROFILE_OTHER_FRAME = "[altri task / loop]"
+
+class StackSampler(threading.Thread):
+    """
+    Campiona lo stack del thread dell'event loop e lo accumula in formato
+    "folded" (flame graph). Il thread e' condiviso da tutte le richieste: i
+    campioni presi mentre gira un task diverso da quello profilato (o il loop
+    e' in attesa) finiscono sotto la radice PROFILE_OTHER_FRAME, separati da
+    quelli della richiesta.
+    """
+
+    def __init__(self, thread_id: int, interval: float, max_seconds: float,
+                 loop: asyncio.AbstractEventLoop, task: asyncio.Task):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.deadline = time.monotonic() + max_seconds
+        self.loop = loop
+        self.task = task
+        self.counts = {}
+        self.samples = 0
+        self.task_samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval) and time.monotonic() < self.deadline:
+            running = asyncio.current_task(self.loop)
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if running is self.task:
+                self.task_samples += 1
+            else:
+                stack.append(PROFILE_OTHER_FRAME)
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.items())
+
+class RequestProfiler:
+    """
+    Profiling a richiesta: si arma per le prossime N richieste (opzionalmente solo
+    su un path, anche di un WebSocket come /ws/controller). Da disarmato costa un
+    solo controllo di attributo nel middleware. Un solo profilo alla volta;
+    ogni sessione e' limitata a max_seconds.
+    Modi: "cprofile" (file .prof per pstats/snakeviz) e "sample" (stack campionati
+    in formato folded, pronti per flamegraph.pl / speedscope, overhead minimo).
+    Ambito: entrambi osservano l'intero thread dell'event loop per la durata
+    della richiesta. Il .prof di cProfile include quindi anche gli altri task
+    eseguiti nel frattempo (heartbeat, broadcast, altre richieste); nel modo
+    "sample" quei campioni sono separati sotto PROFILE_OTHER_FRAME. I lavori
+    nei thread (to_thread) e nei processi del pool non compaiono.
+    """
+
+    def __init__(self):
+        self.armed = False
+        self.path = None
+        self.remaining = 0
+        self.mode = "sample"
+        self.interval = 0.005
+        self.max_seconds = 30.0
+        self.busy = False
+        self.last_samples = None          # campioni dell'ultimo profilo "sample": totali e della richiesta
+
+    def arm(self, path: Optional[str], count: int, mode: str, interval_ms: float, max_seconds: float):
+        self.path = path
+        self.remaining = count
+        self.mode = mode
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self.armed = True
+
+    def disarm(self):
+        self.armed = False
+        self.remaining = 0
+
+    def _matches(self, path: str) -> bool:
+        if path.startswith("/api/admin/profiling"):
+            return False
+        if not self.path:
+            return True
+        if self.path.endswith("*"):
+            return path.startswith(self.path[:-1])
+        return path == self.path
+
+    def claim(self, scope) -> bool:
+        if self.busy or not self._matches(scope["path"]):
+            return False
+        self.busy = True
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.armed = False
+        return True
+
+    def wrap(self, app):
+        async def profiled_app(scope, receive, send):
+            label = f"{scope.get('method', 'WS')}_{re.sub(r'[^A-Za-z0-9]+', '_', scope['path']).strip('_') or 'root'}"
+            stamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+            try:
+                if self.mode == "cprofile":
+                    prof = cProfile.Profile()
+                    timer = asyncio.get_running_loop().call_later(self.max_seconds, prof.disable)
+                    prof.enable()
+                    try:
+                        await app(scope, receive, send)
+                    finally:
+                        prof.disable()
+                        timer.cancel()
+                        await asyncio.to_thread(prof.dump_stats, str(PROFILES_DIR / f"{stamp}_{label}.prof"))
+                else:
+                    sampler = StackSampler(threading.get_ident(), self.interval, self.max_seconds,
+                                           asyncio.get_running_loop(), asyncio.current_task())
+                    sampler.start()
+                    try:
+                        await app(scope, receive, send)
+                    finally:
+                        await asyncio.to_thread(sampler.stop)
+                        await asyncio.to_thread((PROFILES_DIR / f"{stamp}_{label}.folded").write_text, sampler.folded())
+                        self.last_samples = {"total": sampler.samples, "task": sampler.task_samples}
+                await asyncio.to_thread(self._prune)
+            finally:
+                self.busy = False
+        return profiled_app
+
+    def _prune(self):
+        files = sorted(PROFILES_DIR.glob("*"), key=lambda p: p.stat().st_mtime)
+        for old in files[:-PROFILE_MAX_FILES]:
+            old.unlink(missing_ok=True)
+
+    def status(self) -> dict:
+        files = sorted(PROFILES_DIR.glob("*"), reverse=True) if PROFILES_DIR.exists() else []
+        return {
+            "armed": self.armed,
+            "path": self.path,
+            "remaining": self.remaining,
+            "mode": self.mode,
+            "busy": self.busy,
+            "scope": {
+                "cprofile": "intero thread dell'event loop: include gli altri task eseguiti durante la richiesta",
+                "sample": f"intero thread dell'event loop; i campioni di altri task sono sotto '{PROFILE_OTHER_FRAME}'",
+            },
+            "last_samples": self.last_samples,
+            "files": [{"name": f.name, "size": f.stat().st_size} for f in files],
+        }
+
+profiler = RequestProfiler()
+
+class ProfilingRequest(BaseModel):
+    path: Optional[str] = None  # es. "/api/music", "/ws/controller", "/api/*"; None = qualsiasi
+    count: int = 1
+    mode: str = "sample"  # "sample" | "cprofile"
+    interval_ms: float = 5.0
+    max_seconds: float = 30.0
+
+@app.get("/api/admin/profiling")
+async def get_profiling(admin: dict = Depends(get_admin_user)):
+    return profiler.status()
+
+@app.post("/api/admin/profiling")
+async def arm_profiling(req: ProfilingRequest, admin: dict = Depends(get_admin_user)):
+    """
+    Arma il profiler per le prossime count richieste. I profili coprono tutto
+    il thread dell'event loop, non solo la richiesta (vedi "scope" nella risposta).
+    """
+    if req.mode not in ("sample", "cprofile"):
+        raise HTTPException(status_code=400, detail="mode deve essere 'sample' o 'cprofile'")
+    if not 1 <= req.count <= PROFILE_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"count deve essere tra 1 e {PROFILE_MAX_REQUESTS}")
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    profiler.arm(req.path, req.count, req.mode, max(1.0, req.interval_ms),
+                 min(max(req.max_seconds, 1.0), PROFILE_MAX_SECONDS))
+    return profiler.status()
+
+@app.delete("/api/admin/profiling")
+async def disarm_profiling(admin: dict = Depends(get_admin_user)):
+    profiler.disarm()
+    return profiler.status()
+
+@app.get("/api/admin/profiling/files/{filename}")
+async def download_profile(filename: str, admin: dict = Depends(get_admin_user)):
+    filepath = PROFILES_DIR / sanitize_filename(filename)
+    if not filepath.is_file():
+        raise HTTPException(status_code=404, detail="Profilo non trovato")
+    return FileResponse(filepath, media_type="application/octet-stream", filename=filepath.name)
+
+@app.delete("/api/admin/profiling/files/{filename}")
+async def delete_profile(filename: str, admin: dict = Depends(get_admin_user)):
+    (PROFILES_DIR / sanitize_filename(filename)).unlink(missing_ok=True)
+    return {"status": "ok"}
+
+# ============== BACKUP / RESTORE (solo admin) ==============
+
+def _tar_header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+def _tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+def _backup_referenced_files(db: sqlite3.Connection) -> List[str]:
+    """File (relativi a BASE_DIR) citati dallo snapshot: annunci, musica, registrazioni"""
+    files = set()
+    for sql, base in (("SELECT file_path FROM announcement_files", ANNOUNCEMENTS_DIR),
+                      ("SELECT file_path FROM music", MUSIC_DIR),
+                      ("SELECT file_path FROM recordings", RECORDINGS_DIR)):
+        for (path,) in db.execute(sql):
+            files.add((base / path).relative_to(BASE_DIR).as_posix())
+    return sorted(files)
+
+def _backup_file_path(rel: str, create: bool = False) -> Path:
+    """
+    Percorso reale di una voce dell'archivio. I nomi nell'archivio restano
+    logici (directory/nome, come nel DB) e non dipendono dal layout a shard.
+    """
+    path = BASE_DIR / rel
+    if path.parent in SHARD_DIRS.values():
+        return (new_audio_file if create else audio_file)(path.parent, path.name)
+    if create:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _backup_prepare(incremental: bool, base_id: Optional[int]) -> dict:
+    """
+    Snapshot coerente del DB con la backup API di SQLite (senza bloccare gli
+    scrittori) in un file temporaneo in BASE_DIR, che _backup_stream invia a
+    blocchi ed elimina, e manifest di riferimento per l'incrementale.
+    """
+    fd, snapshot_path = tempfile.mkstemp(prefix=".backup-", suffix=".db", dir=BASE_DIR)
+    os.close(fd)
+    snapshot = sqlite3.connect(snapshot_path)
+    source = sqlite3.connect(str(DB_PATH))
+    try:
+        source.backup(snapshot)
+        base = None
+        if incremental or base_id is not None:
+            if base_id is None:
+                row = source.execute("SELECT id, manifest FROM backups ORDER BY id DESC LIMIT 1").fetchone()
+            else:
+                row = source.execute("SELECT id, manifest FROM backups WHERE id = ?", (base_id,)).fetchone()
+            if row is None:
+                raise HTTPException(status_code=404, detail="Nessun backup di riferimento per l'incrementale")
+            base = {"id": row[0], "files": json.loads(row[1])["files"]}
+        files = _backup_referenced_files(snapshot)
+    except BaseException:
+        snapshot.close()
+        os.unlink(snapshot_path)
+        raise
+    finally:
+        source.close()
+    snapshot.close()
+    return {"db": Path(snapshot_path), "files": files, "base": base}
+
+def _tar_file_body(f, size: int, digest):
+    """Contenuto di una voce tar letto a blocchi da f, con sha256 e padding"""
+    remaining = size
+    while remaining:
+        # Un file troncato nel frattempo viene completato con zeri (e lo sha256 lo riflette)
+        chunk = f.read(min(BACKUP_CHUNK_BYTES, remaining)) or b"\0" * remaining
+        digest.update(chunk)
+        remaining -= len(chunk)
+        yield chunk
+    yield _tar_padding(size)
+
+def _backup_stream(prepared: dict):
+    """
+    Archivio tar generato al volo: DB (dallo snapshot su disco, poi eliminato),
+    file audio, manifest.json in coda (con gli sha256 calcolati durante
+    l'invio). Ogni file viene letto a blocchi di BACKUP_CHUNK_BYTES, quindi la
+    memoria non dipende dalla dimensione. Per l'incrementale un file e'
+    invariato se dimensione e mtime coincidono con il backup di riferimento.
+    Il manifest viene registrato in backups solo se l'archivio e' stato
+    prodotto per intero.
+    """
+    base = prepared["base"]
+    base_files = base["files"] if base else {}
+    snapshot_path = prepared["db"]
+    manifest = {
+        "version": BACKUP_FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "kind": "incremental" if base else "full",
+        "base_id": base["id"] if base else None,
+        "db": {},
+        "files": {},
+    }
+
+    try:
+        with open(snapshot_path, "rb") as f:
+            db_size = os.fstat(f.fileno()).st_size
+            digest = hashlib.sha256()
+            yield _tar_header(BACKUP_DB_NAME, db_size, time.time())
+            yield from _tar_file_body(f, db_size, digest)
+        manifest["db"] = {"size": db_size, "sha256": digest.hexdigest()}
+    finally:
+        snapshot_path.unlink(missing_ok=True)
+
+    included = sent = 0
+    for rel in prepared["files"]:
+        path = _backup_file_path(rel)
+        try:
+            st = os.stat(path)
+        except OSError:
+            manifest["files"][rel] = {"missing": True}
+            continue
+        previous = base_files.get(rel)
+        if (previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns
+                and "sha256" in previous):
+            manifest["files"][rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                      "sha256": previous["sha256"], "included": False}
+            continue
+        try:
+            f = open(path, "rb")
+        except OSError:
+            manifest["files"][rel] = {"missing": True}
+            continue
+        with f:
+            digest = hashlib.sha256()
+            yield _tar_header(rel, st.st_size, st.st_mtime)
+            yield from _tar_file_body(f, st.st_size, digest)
+        manifest["files"][rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                  "sha256": digest.hexdigest(), "included": True}
+        included += 1
+        sent += st.st_size
+
+    data = json.dumps(manifest, indent=1).encode()
+    yield _tar_header(BACKUP_MANIFEST_NAME, len(data), time.time()) + data + _tar_padding(len(data))
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+    db = sqlite3.connect(str(DB_PATH))
+    try:
+        db.execute(
+            "INSERT INTO backups (created_at, kind, base_id, files, included, bytes, manifest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (manifest["created_at"], manifest["kind"], manifest["base_id"], len(manifest["files"]),
+             included, sent + db_size, json.dumps(manifest))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+class _QueueReader:
+    """File-like in sola lettura alimentato a chunk dal corpo della richiesta (per tarfile 'r|')"""
+
+    def __init__(self, maxsize: int):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+        self.aborted = False
+        self._buffer = b""
+        self._eof = False
+
+    def feed(self, chunk: Optional[bytes]):
+        """Dal lato async (in un thread): attende spazio finche' il lettore e' attivo"""
+        while not self.closed:
+            try:
+                self.queue.put(chunk, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            try:
+                chunk = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.aborted:
+                    raise ValueError("Caricamento dell'archivio interrotto")
+                continue
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def _restore_member_allowed(name: str) -> bool:
+    if name in (BACKUP_DB_NAME, BACKUP_MANIFEST_NAME):
+        return True
+    parts = Path(name).parts
+    return (not name.startswith("/") and ".." not in parts
+            and name.startswith(("audio/announcements/", "audio/music/", "recordings/")))
+
+def _restore_extract(reader: _QueueReader, staging: Path) -> dict:
+    """
+    Legge l'archivio in streaming, scrive ogni file in staging calcolando lo
+    sha256 e alla fine lo confronta con il manifest. Solleva ValueError
+    se qualcosa non torna: in quel caso nulla e' stato toccato.
+    """
+    received = {}
+    manifest = None
+    try:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            for member in tar:
+                if not member.isfile() or not _restore_member_allowed(member.name):
+                    raise ValueError(f"Voce non ammessa nell'archivio: {member.name}")
+                source = tar.extractfile(member)
+                if member.name == BACKUP_MANIFEST_NAME:
+                    manifest = json.loads(source.read())
+                    continue
+                target = staging / member.name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                digest = hashlib.sha256()
+                with open(target, "wb") as out:
+                    while True:
+                        chunk = source.read(BACKUP_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        digest.update(chunk)
+                        out.write(chunk)
+                received[member.name] = digest.hexdigest()
+    except tarfile.TarError as e:
+        raise ValueError(f"Archivio non valido: {e}")
+    finally:
+        reader.closed = True
+
+    if manifest is None or manifest.get("version") != BACKUP_FORMAT_VERSION:
+        raise ValueError("Manifest mancante o di versione non supportata")
+    if received.get(BACKUP_DB_NAME) != manifest["db"]["sha256"]:
+        raise ValueError("Checksum del database non valido")
+    expected = {rel: info for rel, info in manifest["files"].items() if info.get("included")}
+    for rel, info in expected.items():
+        if received.get(rel) != info["sha256"]:
+            raise ValueError(f"Checksum non valido o file mancante: {rel}")
+    unexpected = set(received) - set(expected) - {BACKUP_DB_NAME}
+    if unexpected:
+        raise ValueError(f"File non presenti nel manifest: {', '.join(sorted(unexpected))}")
+    return manifest
+
+def _restore_commit(staging: Path, manifest: dict) -> dict:
+    """Sposta i file verificati al loro posto e sostituisce il DB con la backup API (online)"""
+    restored = 0
+    for rel, info in manifest["files"].items():
+        if info.get("included"):
+            os.replace(staging / rel, _backup_file_path(rel, create=True))
+            restored += 1
+    missing = [rel for rel, info in manifest["files"].items()
+               if not info.get("included") and not info.get("missing") and not _backup_file_path(rel).exists()]
+
+    source = sqlite3.connect(str(staging / BACKUP_DB_NAME))
+    target = sqlite3.connect(str(DB_PATH))
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return {"restored_files": restored, "missing_files": missing}
+
+@app.get("/api/admin/backup")
+async def download_backup(incremental: bool = False, base_id: Optional[int] = None, admin: dict = Depends(get_admin_user)):
+    """
+    Backup online in formato tar, generato in streaming. Con incremental=true
+    (o base_id) include solo i file non presenti nel manifest di riferimento.
+    """
+    prepared = await asyncio.to_thread(_backup_prepare, incremental, base_id)
+    kind = "incremental" if prepared["base"] else "full"
+    filename = f"audioci-{kind}-{datetime.now().strftime('%Y%m%d%H%M%S')}.tar"
+    return StreamingResponse(
+        _backup_stream(prepared),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        # Lo snapshot lo elimina il generatore; qui anche se l'invio non e' mai iniziato
+        background=BackgroundTask(prepared["db"].unlink, missing_ok=True)
+    )
+
+@app.get("/api/admin/backups", response_model=List[BackupResponse])
+async def list_backups(admin: dict = Depends(get_admin_user)):
+    async with db_connect() as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            "SELECT id, created_at, kind, base_id, files, included, bytes FROM backups ORDER BY id DESC"
+        )
+        return [BackupResponse(**dict(r)) for r in await cursor.fetchall()]
+
+@app.post("/api/admin/restore")
+async def restore_backup(request: Request, admin: dict = Depends(get_admin_user)):
+    """
+    Ripristino da un archivio prodotto da /api/admin/backup, inviato come corpo
+    della richiesta. I file vengono verificati (sha256) mentre arrivano e messi
+    al loro posto solo se l'intero archivio e' valido. Per un incrementale i
+    file non inclusi devono essere gia' presenti (vedi missing_files).
+    """
+    staging = Path(tempfile.mkdtemp(prefix=".restore-", dir=BASE_DIR))
+    reader = _QueueReader(BACKUP_RESTORE_QUEUE_CHUNKS)
+    extract = asyncio.ensure_future(asyncio.to_thread(_restore_extract, reader, staging))
+    try:
+        try:
+            async for chunk in request.stream():
+                if extract.done():
+                    break
+                if chunk:
+                    await asyncio.to_thread(reader.feed, chunk)
+            await asyncio.to_thread(reader.feed, None)
+        finally:
+            # Anche in caso di disconnessione: il thread di estrazione deve terminare
+            reader.aborted = True
+            await asyncio.wait([extract])
+        try:
+            manifest = extract.result()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = await asyncio.to_thread(_restore_commit, staging, manifest)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, staging, True)
+
+    # Schema aggiornato (archivi di versioni precedenti) e programmazioni ricaricate
+    await init_db()
+    await scheduler.reload()
+    logger.info("Ripristino backup %s del %s completato", manifest["kind"], manifest["created_at"])
+    return {"kind": manifest["kind"], "created_at": manifest["created_at"], **result}
+
+# ============== RICONCILIAZIONE STORAGE (file orfani) ==============
+
+# Riferimenti "vivi": file di annunci che appartengono a un gruppo esistente, brani in libreria
+STORAGE_LIVE_REFERENCES = {
+    "announcements": (ANNOUNCEMENTS_DIR, """
+        SELECT af.file_path FROM announcement_files af
+        JOIN announcements a ON a.id = af.announcement_id
+        JOIN groups g ON g.id = a.group_id
+    """),
+    "music": (MUSIC_DIR, "SELECT file_path FROM music"),
+}
+
+# Righe orfane (le FOREIGN KEY non sono attive). L'ordine conta: eliminando
+# prima annunci e sequenze, le righe figlie diventano orfane nello stesso giro.
+STORAGE_ORPHAN_ROWS = {
+    "announcements": "SELECT id FROM announcements WHERE group_id NOT IN (SELECT id FROM groups)",
+    "sequences": "SELECT id FROM sequences WHERE group_id NOT IN (SELECT id FROM groups)",
+    "announcement_files": "SELECT id FROM announcement_files WHERE announcement_id NOT IN (SELECT id FROM announcements)",
+    "sequence_items": """SELECT id FROM sequence_items WHERE sequence_id NOT IN (SELECT id FROM sequences)
+                         OR announcement_id NOT IN (SELECT id FROM announcements)""",
+    "playlist_items": """SELECT id FROM playlist_items WHERE playlist_id NOT IN (SELECT id FROM playlists)
+                         OR music_id NOT IN (SELECT id FROM music)""",
+    "audio_fingerprints": """SELECT id FROM audio_fingerprints
+                             WHERE (kind = 'music' AND ref_id NOT IN (SELECT id FROM music))
+                             OR (kind = 'announcements' AND ref_id NOT IN (SELECT id FROM announcements))""",
+}
+
+def _scan_batch(iterator, size: int) -> Optional[list]:
+    """Prossime voci (nome, byte, mtime) di os.scandir, None a fine directory"""
+    batch = []
+    for entry in iterator:
+        try:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                batch.append((entry.name, st.st_size, st.st_mtime))
+        except OSError:
+            continue
+        if len(batch) >= size:
+            return batch
+    return batch or None
+
+def _storage_owner(name: str) -> str:
+    """File audio a cui appartiene una voce di directory (le forme d'onda seguono il loro audio)"""
+    return name[:-len(PEAKS_SUFFIX)] if name.endswith(PEAKS_SUFFIX) else name
+
+async def _live_references(kind: str) -> set:
+    async with db_connect() as db:
+        cursor = await db.execute(STORAGE_LIVE_REFERENCES[kind][1])
+        return {row[0] for row in await cursor.fetchall()}
+
+class StorageReconciler:
+    """
+    Confronta periodicamente ANNOUNCEMENTS_DIR e MUSIC_DIR (shard compresi) con il DB.
+    La scansione e' a fette: STORAGE_SCAN_BATCH voci per volta lette in un
+    thread, con una pausa tra una fetta e l'altra, cosi' anche librerie molto
+    grandi non occupano l'event loop ne' il disco in modo continuo.
+    Il report (dry-run) elenca file non referenziati (con i byte recuperabili),
+    file mancanti e righe orfane; clean() li mette in quarantena o li elimina
+    ricontrollando i riferimenti al momento dell'azione.
+    """
+
+    def __init__(self):
+        self.report = None
+        self._candidates = []
+        self.running = False
+        self._task = None
+        self._scan_task = None
+        self.stats = {"scans": 0, "quarantined": 0, "deleted": 0, "rows_deleted": 0, "reclaimed_bytes": 0}
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self._scan_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._scan_task = None
+
+    async def _run(self):
+        await asyncio.sleep(STORAGE_SCAN_START_DELAY)
+        while True:
+            try:
+                await self.scan()
+            except Exception:
+                logger.exception("Riconciliazione storage fallita")
+            await asyncio.sleep(STORAGE_SCAN_INTERVAL)
+
+    def trigger(self) -> bool:
+        """Avvia una scansione in background; False se ce n'e' gia' una in corso"""
+        if self.running:
+            return False
+        self._scan_task = asyncio.create_task(self.scan())
+        return True
+
+    async def scan(self) -> dict:
+        if self.running:
+            return self.report
+        self.running = True
+        started = time.perf_counter()
+        try:
+            report = {
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+                "scanned": 0,
+                "unreferenced": [],
+                "unreferenced_count": 0,
+                "reclaimable_bytes": 0,
+                "missing": [],
+                "missing_count": 0,
+                "orphan_rows": {},
+            }
+            candidates = []
+            min_mtime = time.time() - STORAGE_MIN_AGE
+            for kind, (directory, _) in STORAGE_LIVE_REFERENCES.items():
+                references = await _live_references(kind)
+                seen = set()
+                if directory.exists():
+                    iterator = iter_audio_entries(directory)
+                    try:
+                        while True:
+                            batch = await asyncio.to_thread(_scan_batch, iterator, STORAGE_SCAN_BATCH)
+                            if batch is None:
+                                break
+                            for name, size, mtime in batch:
+                                seen.add(name)
+                                # I file appena scritti possono non avere ancora la riga nel DB
+                                if _storage_owner(name) not in references and mtime < min_mtime:
+                                    candidates.append({"kind": kind, "file": name, "bytes": size, "mtime": mtime})
+                                    report["reclaimable_bytes"] += size
+                            report["scanned"] += len(batch)
+                            await asyncio.sleep(STORAGE_SCAN_PAUSE)
+                    finally:
+                        iterator.close()
+                missing = references - seen
+                report["missing_count"] += len(missing)
+                report["missing"].extend(
+                    {"kind": kind, "file": name} for name in sorted(missing)[:STORAGE_REPORT_LIMIT - len(report["missing"])]
+                )
+
+            async with db_connect() as db:
+                for table, sql in STORAGE_ORPHAN_ROWS.items():
+                    cursor = await db.execute(f"SELECT COUNT(*) FROM ({sql})")
+                    report["orphan_rows"][table] = (await cursor.fetchone())[0]
+
+            report["unreferenced_count"] = len(candidates)
+            report["unreferenced"] = candidates[:STORAGE_REPORT_LIMIT]
+            report["duration_s"] = round(time.perf_counter() - started, 3)
+            self.report = report
+            self._candidates = candidates
+            self.stats["scans"] += 1
+            return report
+        finally:
+            self.running = False
+
+    async def clean(self, action: str, orphan_rows: bool) -> dict:
+        """
+        Agisce sull'ultimo report: i file non referenziati vengono spostati in
+        QUARANTINE_DIR (action="quarantine") o eliminati (action="delete").
+        Con orphan_rows=True elimina anche le righe orfane.
+        """
+        if self.report is None:
+            raise HTTPException(status_code=409, detail="Nessuna scansione disponibile, avviarne una prima")
+        result = {"action": action, "files": 0, "bytes": 0, "skipped": 0, "rows_deleted": {}}
+
+        if orphan_rows:
+            async with db_connect() as db:
+                for table, sql in STORAGE_ORPHAN_ROWS.items():
+                    cursor = await db.execute(f"DELETE FROM {table} WHERE id IN ({sql})")
+                    result["rows_deleted"][table] = cursor.rowcount
+                await db.commit()
+            self.stats["rows_deleted"] += sum(result["rows_deleted"].values())
+
+        references = {kind: await _live_references(kind) for kind in STORAGE_LIVE_REFERENCES}
+        target_dir = QUARANTINE_DIR / datetime.now().strftime("%Y%m%d-%H%M%S")
+        candidates = [item for item in self._candidates
+                      if _storage_owner(item["file"]) not in references[item["kind"]]]
+        result["skipped"] = len(self._candidates) - len(candidates)
+        for start in range(0, len(candidates), STORAGE_SCAN_BATCH):
+            done = await asyncio.to_thread(
+                self._apply, candidates[start:start + STORAGE_SCAN_BATCH], action, target_dir
+            )
+            result["files"] += done[0]
+            result["bytes"] += done[1]
+            result["skipped"] += done[2]
+            await asyncio.sleep(STORAGE_SCAN_PAUSE)
+
+        self.stats["quarantined" if action == "quarantine" else "deleted"] += result["files"]
+        self.stats["reclaimed_bytes"] += result["bytes"]
+        logger.info("Pulizia storage (%s): %d file, %d byte", action, result["files"], result["bytes"])
+        # Il report precedente non e' piu' valido
+        self.report = None
+        self._candidates = []
+        return result
+
+    @staticmethod
+    def _apply(items: list, action: str, target_dir: Path):
+        done = size = skipped = 0
+        for item in items:
+            path = audio_file(STORAGE_LIVE_REFERENCES[item["kind"]][0], item["file"])
+            try:
+                st = path.stat()
+                if st.st_mtime != item["mtime"]:
+                    skipped += 1
+                    continue
+                if action == "quarantine":
+                    destination = target_dir / item["kind"] / item["file"]
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(path, destination)
+                else:
+                    path.unlink()
+            except OSError:
+                skipped += 1
+                continue
+            done += 1
+            size += st.st_size
+        return done, size, skipped
+
+    def status(self) -> dict:
+        return {"running": self.running, "report": self.report, **self.stats}
+
+storage_reconciler = StorageReconciler()
+
+@metrics.collector
+def _storage_metrics():
+    report = storage_reconciler.report
+    if report:
+        yield "audioci_storage_reclaimable_bytes", (), report["reclaimable_bytes"]
+        yield "audioci_storage_issues", ("unreferenced",), report["unreferenced_count"]
+        yield "audioci_storage_issues", ("missing",), report["missing_count"]
+        yield "audioci_storage_issues", ("orphan_rows",), sum(report["orphan_rows"].values())
+    for key in ("quarantined", "deleted", "rows_deleted"):
+        yield "audioci_storage_cleaned_total", (key,), storage_reconciler.stats[key]
+
+class StorageCleanRequest(BaseModel):
+    action: str = "quarantine"
+    orphan_rows: bool = False
+
+@app.get("/api/admin/storage")
+async def get_storage_status(admin: dict = Depends(get_admin_user)):
+    """Ultimo report (dry-run): nessun file viene toccato"""
+    return storage_reconciler.status()
+
+@app.get("/api/admin/storage/sharding")
+async def get_sharding_status(admin: dict = Depends(get_admin_user)):
+    """Stato della migrazione dal layout piatto a quello a shard"""
+    return shard_migration.status()
+
+@app.post("/api/admin/storage/scan")
+async def scan_storage(wait: bool = False, admin: dict = Depends(get_admin_user)):
+    if wait:
+        return await storage_reconciler.scan()
+    started = storage_reconciler.trigger()
+    return {"status": "started" if started else "running"}
+
+@app.post("/api/admin/storage/clean")
+async def clean_storage(req: StorageCleanRequest, admin: dict = Depends(get_admin_user)):
+    if req.action not in ("quarantine", "delete"):
+        raise HTTPException(status_code=400, detail="Azione non valida (quarantine o delete)")
+    if storage_reconciler.running:
+        raise HTTPException(status_code=409, detail="Scansione in corso")
+    return await storage_reconciler.clean(req.action, req.orphan_rows)
+
+# ============== CACHE AUDIO (file piccoli e ricorrenti) ==============
+
+class CachedAudio:
+    __slots__ = ("view", "size", "identity", "last_modified", "etag")
+
+    def __init__(self, view: memoryview, st: os.stat_result):
+        self.view = view
+        self.size = st.st_size
+        self.identity = (st.st_ino, st.st_size, st.st_mtime_ns)
+        # Stessi validatori di FileResponse: il browser non vede differenze tra cache e disco
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        etag_base = f"{st.st_mtime}-{st.st_size}"
+        self.etag = f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+def _map_audio(path: Path) -> CachedAudio:
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())    # attributi del file effettivamente mappato
+        region = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_WILLNEED"):
+        region.madvise(mmap.MADV_WILLNEED)
+    return CachedAudio(memoryview(region), st)
+
+class AudioFileCache:
+    """
+    Cache LRU dei file audio fino a AUDIO_CACHE_MAX_FILE byte, mappati in
+    memoria (mmap) per un totale di AUDIO_CACHE_MAX_BYTES. Le risposte sono
+    fette della mappa, senza copie ne' letture dal disco; le richieste Range
+    ricevono solo la fetta richiesta. Ogni accesso confronta inode, dimensione
+    e mtime con il file: un file sostituito (restore) o spostato (migrazione a
+    shard) viene ricaricato, uno eliminato esce dalla cache. Le regioni non
+    vengono chiuse esplicitamente: una risposta in corso puo' ancora usarle e
+    il munmap avviene quando l'ultima fetta viene rilasciata.
+    """
+
+    def __init__(self, max_bytes: int, max_file: int):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self._entries = OrderedDict()    # percorso -> CachedAudio, dal meno recente
+        self.resident = 0
+        self.stats = {"hit": 0, "miss": 0, "bypass": 0}
+        self.evictions = {"capacity": 0, "stale": 0, "deleted": 0}
+
+    def _drop(self, key: str, reason: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.resident -= entry.size
+            self.evictions[reason] += 1
+
+    async def get(self, path: Path) -> Optional[CachedAudio]:
+        """Contenuto in cache del file, None se va servito dal disco (o non esiste)"""
+        key = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._drop(key, "deleted")
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.identity == (st.st_ino, st.st_size, st.st_mtime_ns):
+                self._entries.move_to_end(key)
+                self.stats["hit"] += 1
+                return entry
+            self._drop(key, "stale")
+        if not 0 < st.st_size <= self.max_file:
+            self.stats["bypass"] += 1
+            return None
+        self.stats["miss"] += 1
+        try:
+            entry = await asyncio.to_thread(_map_audio, path)
+        except (OSError, ValueError):
+            return None
+        self._drop(key, "stale")    # caricato in parallelo da un'altra richiesta
+        self._entries[key] = entry
+        self.resident += entry.size
+        while self.resident > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)), "capacity")
+        return entry
+
+    def invalidate(self, paths: List[Path]):
+        for path in paths:
+            self._drop(str(path), "deleted")
+
+    def status(self) -> dict:
+        lookups = self.stats["hit"] + self.stats["miss"]
+        return {
+            "files": len(self._entries),
+            "resident_bytes": self.resident,
+            "hit_rate": round(self.stats["hit"] / lookups, 4) if lookups else None,
+            **self.stats,
+            "evictions": dict(self.evictions),
+        }
+
+audio_cache = AudioFileCache(AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_MAX_FILE)
+
+@metrics.collector
+def _audio_cache_metrics():
+    for result, value in audio_cache.stats.items():
+        yield "audioci_audio_cache_requests_total", (result,), value
+    for reason, value in audio_cache.evictions.items():
+        yield "audioci_audio_cache_evictions_total", (reason,), value
+    yield "audioci_audio_cache_resident_bytes", (), audio_cache.resident
+    yield "audioci_audio_cache_files", (), len(audio_cache._entries)
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _cached_audio_response(request: Request, entry: CachedAudio) -> Response:
+    headers = {"accept-ranges": "bytes", "last-modified": entry.last_modified, "etag": entry.etag}
+    header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if header is None or (if_range is not None and if_range not in (entry.etag, entry.last_modified)):
+        return Response(entry.view, media_type="audio/mpeg", headers=headers)
+    match = RANGE_RE.match(header.strip())
+    start = end = None
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), entry.size - 1) if match.group(2) else entry.size - 1
+        else:
+            start = max(entry.size - int(match.group(2)), 0)
+            end = entry.size - 1
+    if start is None or start > end:
+        headers["content-range"] = f"bytes */{entry.size}"
+        return Response(status_code=416, headers=headers)
+    headers["content-range"] = f"bytes {start}-{end}/{entry.size}"
+    return Response(entry.view[start:end + 1], status_code=206, media_type="audio/mpeg", headers=headers)
+
+async def serve_audio(request: Request, directory: Path, filename: str):
+    filepath = audio_file(directory, filename)
+    entry = await audio_cache.get(filepath)
+    # Intervalli multipli (raro): li gestisce FileResponse leggendo dal disco
+    if entry is not None and "," not in request.headers.get("range", ""):
+        return _cached_audio_response(request, entry)
     if not filepath.exists():
         raise HTTPException(status_code=404, detail="File non trovato")
     return FileResponse(filepath, media_type="audio/mpeg")
 
+@app.get("/api/admin/audio-cache")
+async def get_audio_cache_status(admin: dict = Depends(get_admin_user)):
+    return audio_cache.status()
+
+# ============== Audio file serving ==============
+
+@app.get("/audio/announcements/{filename}")
+async def get_announcement_audio(filename: str, request: Request):
+    return await serve_audio(request, ANNOUNCEMENTS_DIR, filename)
+
+@app.get("/audio/music/{filename}")
+async def get_music_audio(filename: str, request: Request):
+    return await serve_audio(request, MUSIC_DIR, filename)
+
 # WebSocket endpoints
+async def receive_json(websocket: WebSocket) -> dict:
+    """receive_json che tratta come disconnessione solo il socket gia' chiuso (es. da _evict dopo un invio fallito)"""
+    if websocket.application_state != WebSocketState.CONNECTED:
+        raise WebSocketDisconnect(1001)
+    try:
+        return await websocket.receive_json()
+    except RuntimeError:
+        if (websocket.application_state == WebSocketState.CONNECTED
+                and websocket.client_state == WebSocketState.CONNECTED):
+            raise
+        raise WebSocketDisconnect(1001)
+
 @app.websocket("/ws/player")
-async def websocket_player(websocket: WebSocket):
-    await manager.connect_player(websocket)
+async def websocket_player(websocket: WebSocket, token: Optional[str] = None):
+    await manager.connect_player(websocket, username_from_token(token))
     try:
+        await playback.player_joined(websocket)
         while True:
-            data = await websocket.receive_json()
+            data = await receive_json(websocket)
+            metrics.inc("audioci_ws_messages_in_total", ("player",))
+            manager.touch(websocket)
+            msg_type = data.get("type")
+            if msg_type == "pong":
+                continue
+            if msg_type == "time_sync":
+                # Scambio stile NTP: t0 del player, ricezione (t1) e risposta (t2) in ms del server
+                received = time.time() * 1000
+                await websocket.send_json({"type": "time_sync", "t0": data.get("t0"), "t1": received,
+                                           "t2": time.time() * 1000})
+                continue
+            if msg_type == "clock":
+                manager.player_clock(websocket, data.get("offset_ms"), data.get("rtt_ms"))
+                continue
+            if msg_type == "skew":
+                manager.player_skew(websocket, data.get("skew_ms"))
+                continue
+            if msg_type == "track_ended":
+                await playback.track_ended(data.get("generation"))
+                continue
+            await playback.player_report(websocket, data.get("status"))
             await manager.send_to_all({"type": "player_status", "data": data})
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Anche con un errore inatteso (che si propaga e viene loggato) il player esce dai registri
         manager.disconnect_player(websocket)
+        await playback.player_report(websocket, "stopped")
 
 @app.websocket("/ws/controller")
-async def websocket_controller(websocket: WebSocket):
-    await manager.connect_controller(websocket)
+async def websocket_controller(websocket: WebSocket, token: Optional[str] = None):
+    username = username_from_token(token)
+    role = await user_role(username)
+    await manager.connect_controller(websocket, username)
+    bucket = controller_limiter.connection_bucket(role)
     try:
         while True:
-            data = await websocket.receive_json()
-            if manager.master_active:
-                await websocket.send_json({"type": "blocked", "reason": "master_active"})
+            data = await receive_json(websocket)
+            metrics.inc("audioci_ws_messages_in_total", ("controller",))
+            manager.touch(websocket)
+            if data.get("type") == "pong":
+                continue
+            action = data.get("action")
+            throttled = controller_limiter.check(bucket, username, role)
+            if throttled is not None:
+                await websocket.send_json({"type": "throttled", "action": action, **throttled})
                 continue
-            if data.get("action") == "play_announcement":
-                await manager.send_to_players({
+            # I comandi di riproduzione passano dalla coda, anche durante il Master (restano in attesa)
+            if action == "play_announcement":
+                kind = "sequence" if data.get("isSequence") else "announcement"
+                files = [str(f) for f in data.get("files", [])]
+                priority = "safety" if data.get("priority") == "safety" else "announcement"
+                result = await playback.submit("announcement", {
                     "type": "play",
                     "content": "announcement",
                     "id": data.get("id"),
-                    "files": data.get("files", [])
-                })
-            elif data.get("action") == "stop":
-                await manager.send_to_players({"type": "stop"})
-            elif data.get("action") == "play_music":
-                await manager.send_to_players({
+                    "files": files
+                }, (data.get("id"), tuple(files)), username, priority, log=(kind, data.get("id")))
+            elif action == "play_music":
+                result = await playback.submit("music", {
                     "type": "play",
                     "content": "music",
                     "file": data.get("file")
-                })
-            elif data.get("action") == "play_playlist":
-                await manager.send_to_players({
-                    "type": "play_playlist",
-                    "playlist_id": data.get("playlist_id"),
-                    "tracks": data.get("tracks", []),
-                    "shuffle": data.get("shuffle", False)
-                })
-            elif data.get("action") == "music_next":
-                await manager.send_to_players({"type": "music_next"})
-            elif data.get("action") == "music_prev":
-                await manager.send_to_players({"type": "music_prev"})
-            elif data.get("action") == "music_shuffle":
-                await manager.send_to_players({"type": "music_shuffle"})
-            elif data.get("action") == "pause":
-                await manager.send_to_players({"type": "pause"})
-            elif data.get("action") == "resume":
-                await manager.send_to_players({"type": "resume"})
+                }, (data.get("file"),), username, log=("music", data.get("id"), data.get("file")))
+            elif action == "play_playlist":
+                # Brani e ordine li decide il server (da playlist_items); il seed rende lo shuffle riproducibile
+                shuffle = bool(data.get("shuffle", False))
+                loop = bool(data.get("loop", False))
+                seed = data.get("seed") if isinstance(data.get("seed"), int) else None
+                playlist = await PlaylistCursor.load(data.get("playlist_id"), shuffle, loop, seed)
+                if playlist is None:
+                    await websocket.send_json({"type": "rejected", "action": action, "reason": "empty_playlist"})
+                    continue
+                result = await playback.submit("music", playlist,
+                                               (data.get("playlist_id"), shuffle, loop, seed), username,
+                                               log=("playlist", data.get("playlist_id")))
+            else:
+                result = None
+            if result is not None:
+                if result["status"] != "played":
+                    await websocket.send_json({"type": result.pop("status"), "action": action, **result})
+                continue
+            if manager.master_active:
+                await websocket.send_json({"type": "blocked", "reason": "master_active"})
+                continue
+            if action == "stop":
+                play_log.record("stop", username)
+                await playback.stop()
+            elif action in ControllerLimiter.TOGGLE_GROUPS:
+                if not await controller_limiter.toggle(action, playback.music_command):
+                    metrics.inc("audioci_controller_commands_total", (role or "anonymous", "coalesced"))
+                    await websocket.send_json({"type": "coalesced", "action": action})
+            elif action in ("music_next", "music_prev"):
+                await playback.music_command(action)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect_controller(websocket)
 
 @app.websocket("/ws/master")
-async def websocket_master(websocket: WebSocket):
-    await manager.connect_master(websocket)
+async def websocket_master(websocket: WebSocket, token: Optional[str] = None):
+    await manager.connect_master(websocket, username_from_token(token))
     master_username = None
+    recording = None
     try:
         while True:
             message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            metrics.inc("audioci_ws_messages_in_total", ("master",))
+            manager.touch(websocket)
 
             if "text" in message:
                 data = json.loads(message["text"])
+                if data.get("type") == "pong":
+                    continue
                 if data.get("action") == "start_announcement":
                     master_username = data.get("username", "Master")
                     await manager.start_master_announcement(master_username)
-                    await manager.send_to_players({"type": "stop"})
+                    await mixer.master_feed.begin()
+                    recording = recorder.start(master_username)
+                    play_log.record("master_start", master_username, "recording", detail=recording)
                 elif data.get("action") == "stop_announcement":
                     await manager.stop_master_announcement()
+                    await mixer.master_feed.end()
+                    recorder.finish()
+                    play_log.record("master_stop", master_username, "recording", detail=recording)
                     master_username = None
             elif "bytes" in message:
                 if manager.master_active:
+                    recorder.feed(message["bytes"])
                     await manager.send_audio_to_players(message["bytes"])
+                    await mixer.master_feed.feed(message["bytes"])
     except WebSocketDisconnect:
         if manager.master_active and manager.master_username == master_username:
             await manager.stop_master_announcement()
+            await mixer.master_feed.end()
+            recorder.finish()
+            play_log.record("master_stop", master_username, "recording", detail=recording)
         manager.disconnect_master(websocket)
 
 # Stato sistema
@@ -1302,9 +6700,30 @@ async def get_status():
         "masters_connected": len(manager.masters),
         "master_active": manager.master_active,
         "master_username": manager.master_username,
+        "evictions": manager.evictions,
+        "startup": startup_timings,
         "status": "online"
     }
 
+@app.get("/api/connections")
+async def get_connections(admin: dict = Depends(get_admin_user)):
+    return manager.snapshot()
+
+metrics_bearer = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
+
+async def metrics_access(token: Optional[str] = Depends(metrics_bearer)):
+    """Scraper con AUDIOCI_METRICS_TOKEN oppure utente admin"""
+    if METRICS_TOKEN and token and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return
+    if token is None:
+        raise HTTPException(status_code=401, detail="Autenticazione richiesta",
+                            headers={"WWW-Authenticate": "Bearer"})
+    await get_admin_user(await get_current_user(token))
+
+@app.get("/metrics")
+async def get_metrics(access: None = Depends(metrics_access)):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Serve frontend
 FRONTEND_DIR = BASE_DIR / "frontend"
 
@@ -1319,6 +6738,8 @@ async def serve_static(path: str):
         return FileResponse(file_path)
     return FileResponse(FRONTEND_DIR / "index.html")
 
+startup_timings["import_ms"] = round((time.perf_counter() - _MODULE_LOAD_START) * 1000, 2)
+
 if __name__ == "__main__":
     import uvicorn
     import ssl
@@ -0,0 +1,61 @@
+"""
+AudioCi - Test
+main viene importato su una BASE_DIR temporanea; `manager` e il registro
+riproduzioni sono sostituiti da finti in memoria.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("AUDIOCI_BASE_DIR", tempfile.mkdtemp(prefix="audioci-test-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+class FakeManager:
+    """Tiene i messaggi inviati ai player invece di trasmetterli"""
+
+    def __init__(self, players: int = 1):
+        self.players = {object(): None for _ in range(players)}
+        self.master_active = False
+        self.sent = []
+        self.controller_messages = []
+
+    def start_at(self) -> int:
+        return 0
+
+    async def send_to_players(self, message: dict):
+        self.sent.append(message)
+
+    async def send_to_controllers(self, message: dict):
+        self.controller_messages.append(message)
+
+    def types(self) -> list:
+        return [m["type"] if m["type"] != "play" else ("play", m.get("id")) for m in self.sent]
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    fake = FakeManager()
+    monkeypatch.setattr(main, "manager", fake)
+    return fake
+
+
+@pytest.fixture(scope="session")
+def database():
+    """Schema applicato una volta sola sul DB della BASE_DIR temporanea"""
+    asyncio.run(main.init_db())
+    return main.DB_PATH
+
+
+@pytest.fixture
+def play_log(monkeypatch):
+    records = []
+    monkeypatch.setattr(main.play_log, "record", lambda *args, **kwargs: records.append(args))
+    return records
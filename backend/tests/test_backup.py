@@ -0,0 +1,70 @@
+import io
+import json
+import os
+import tarfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture(scope="module")
+def client(database):
+    with TestClient(main.app) as test_client:
+        token = test_client.post("/api/auth/login", data={"username": "admin", "password": "admin"}).json()
+        test_client.headers["Authorization"] = f"Bearer {token['access_token']}"
+        yield test_client
+
+
+def upload_track(client, content: bytes) -> dict:
+    response = client.post("/api/music", files={"file": ("track.mp3", io.BytesIO(content), "audio/mpeg")})
+    assert response.status_code == 200
+    return response.json()
+
+
+def manifest(archive: bytes) -> dict:
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        return json.load(tar.extractfile(main.BACKUP_MANIFEST_NAME))
+
+
+def test_full_backup_restores_deleted_track(client):
+    content = b"ID3" + os.urandom(4096)
+    track = upload_track(client, content)
+    archive = client.get("/api/admin/backup").content
+    assert manifest(archive)["kind"] == "full"
+
+    assert client.delete(f"/api/music/{track['id']}").status_code == 200
+    path = main.audio_file(main.MUSIC_DIR, track["file_path"])
+    assert not path.exists()
+
+    response = client.post("/api/admin/restore", content=archive)
+    assert response.status_code == 200
+    assert response.json()["missing_files"] == []
+    assert path.read_bytes() == content
+    assert any(t["id"] == track["id"] for t in client.get("/api/music").json())
+
+
+def test_tampered_archive_is_rejected(client):
+    content = b"ID3" + os.urandom(4096)
+    track = upload_track(client, content)
+    archive = bytearray(client.get("/api/admin/backup").content)
+    offset = archive.find(content)
+    assert offset > 0
+    archive[offset + 100] ^= 0xFF
+
+    response = client.post("/api/admin/restore", content=bytes(archive))
+    assert response.status_code == 400
+    # Nulla e' stato sovrascritto
+    assert main.audio_file(main.MUSIC_DIR, track["file_path"]).read_bytes() == content
+
+
+def test_incremental_backup_skips_unchanged_files(client):
+    upload_track(client, b"ID3" + os.urandom(2048))
+    full = client.get("/api/admin/backup")
+    assert full.status_code == 200
+    incremental = client.get("/api/admin/backup", params={"incremental": "true"}).content
+    entries = manifest(incremental)
+    assert entries["kind"] == "incremental"
+    assert not any(f["included"] for f in entries["files"].values())
+    assert client.get("/api/admin/backups").json()[0]["included"] == 0
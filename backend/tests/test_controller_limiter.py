@@ -0,0 +1,61 @@
+import asyncio
+
+import main
+
+
+def test_token_bucket_throttles_and_refills():
+    limiter = main.ControllerLimiter()
+    bucket = main.TokenBucket(rate=2.0, burst=3)
+    for _ in range(3):
+        assert limiter.check(bucket, None, "operator") is None
+
+    throttled = limiter.check(bucket, None, "operator")
+    assert throttled["scope"] == "connection"
+    assert 0 < throttled["retry_after"] <= 0.5
+
+    # Un secondo dopo: due gettoni (rate 2/s), non di piu'
+    bucket.updated -= 1.0
+    assert limiter.check(bucket, None, "operator") is None
+    assert limiter.check(bucket, None, "operator") is None
+    assert limiter.check(bucket, None, "operator") is not None
+
+    # Il bucket non supera mai burst
+    bucket.updated -= 60.0
+    bucket.refill(bucket.updated + 60.0)
+    assert bucket.tokens == 3
+
+
+def test_user_bucket_is_shared_between_connections():
+    limiter = main.ControllerLimiter()
+    rate, burst = limiter.limits("operator")
+    connections = [limiter.connection_bucket("operator") for _ in range(main.CONTROLLER_USER_FACTOR + 1)]
+    accepted = 0
+    for bucket in connections:
+        for _ in range(burst):
+            accepted += limiter.check(bucket, "alice", "operator") is None
+    assert accepted == burst * main.CONTROLLER_USER_FACTOR
+    assert limiter.throttled_users["alice"] == burst
+
+
+def test_coalesced_toggle_is_not_sent_during_master(manager, monkeypatch):
+    monkeypatch.setattr(main, "CONTROLLER_TOGGLE_WINDOW", 0.05)
+
+    async def scenario(cancel: bool):
+        limiter = main.ControllerLimiter()
+        queue = main.PlaybackQueue()
+        assert await limiter.toggle("pause", queue.music_command)
+        assert not await limiter.toggle("resume", queue.music_command)
+        manager.master_active = True
+        if cancel:
+            limiter.cancel_pending()
+        await asyncio.sleep(0.1)
+        limiter.shutdown()
+        return queue
+
+    # Annullato all'avvio del Master, oppure scartato da music_command se la finestra scade comunque
+    for cancel in (True, False):
+        manager.sent.clear()
+        manager.master_active = False
+        queue = asyncio.run(scenario(cancel))
+        assert manager.types() == ["pause"]
+        assert queue.music_paused
@@ -0,0 +1,103 @@
+import asyncio
+
+import main
+
+
+def announcement(item_id: int) -> dict:
+    return {"type": "play", "content": "announcement", "id": item_id, "files": []}
+
+
+async def submit(queue, item_id: int, priority: str = "announcement") -> dict:
+    return await queue.submit("announcement", announcement(item_id), (item_id,), "tester", priority,
+                              log=("announcement", item_id))
+
+
+async def finish(queue, manager):
+    """Tutti i player segnalano la fine dell'annuncio corrente"""
+    for player in list(manager.players):
+        await queue.player_report(player, "stopped")
+
+
+def test_safety_preempts_and_interrupted_announcement_restarts(manager, play_log):
+    async def scenario():
+        queue = main.PlaybackQueue()
+        assert (await submit(queue, 1))["status"] == "played"
+        assert (await submit(queue, 2, "safety"))["status"] == "played"
+        assert queue.current.message["id"] == 2
+        assert [item.message["id"] for item in queue._heap] == [1]
+
+        await finish(queue, manager)
+        assert queue.current.message["id"] == 1
+        await finish(queue, manager)
+        assert queue.current is None
+        queue.shutdown()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert manager.types() == [("play", 1), ("play", 2), ("play", 1)]
+    assert queue.stats["preempted"] == 1
+    assert queue.stats["completed"] == 2
+    # Una riga per richiesta, anche se l'annuncio interrotto e' ripartito
+    assert play_log == [("play", "tester", "announcement", 1), ("play", "tester", "announcement", 2)]
+
+
+def test_master_suspends_queue_and_resumes_it_afterwards(manager, play_log):
+    async def scenario():
+        queue = main.PlaybackQueue()
+        await queue.submit("music", {"type": "play", "content": "music", "file": "a.mp3"}, ("a.mp3",))
+        await submit(queue, 1)
+        manager.master_active = True
+        await queue.master_started()
+        assert queue.current is None
+
+        result = await submit(queue, 2)
+        assert result == {"status": "queued", "position": 2, "reason": "master_active"}
+        assert ("announcement", 2) not in [r[2:] for r in play_log]
+
+        manager.master_active = False
+        manager.sent.clear()
+        await queue.master_stopped()
+        assert queue.current.message["id"] == 1
+        await finish(queue, manager)
+        assert queue.current.message["id"] == 2
+        await finish(queue, manager)
+        queue.shutdown()
+
+    asyncio.run(scenario())
+    assert manager.types() == ["resume", ("play", 1), ("play", 2), "unduck"]
+    assert play_log[-1] == ("play", "tester", "announcement", 2)
+
+
+def test_identical_requests_are_coalesced_but_rejections_are_not_remembered(manager, monkeypatch):
+    monkeypatch.setattr(main, "PLAYBACK_QUEUE_MAX", 1)
+
+    async def scenario():
+        queue = main.PlaybackQueue()
+        assert (await submit(queue, 1))["status"] == "played"
+        assert (await submit(queue, 1))["status"] == "coalesced"
+        assert (await submit(queue, 2))["status"] == "queued"
+        assert (await submit(queue, 3))["reason"] == "queue_full"
+        # Il nuovo tentativo viene valutato di nuovo, non fuso con quello rifiutato
+        assert (await submit(queue, 3))["reason"] == "queue_full"
+        await finish(queue, manager)
+        assert (await submit(queue, 3))["status"] == "queued"
+        queue.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_announcement_expires_when_players_never_report(manager, monkeypatch):
+    monkeypatch.setattr(main, "PLAYBACK_END_GRACE", 0.01)
+
+    async def scenario():
+        queue = main.PlaybackQueue()
+        await submit(queue, 1)
+        await submit(queue, 2)
+        await asyncio.sleep(0.1)
+        queue.shutdown()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert queue.current is None
+    assert queue.stats["expired"] == 2
+    assert manager.types() == [("play", 1), ("play", 2)]
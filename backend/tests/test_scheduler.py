@@ -0,0 +1,206 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+class FakePlayback:
+    """Risponde a submit() con un esito prefissato e ricorda le richieste"""
+
+    def __init__(self, status: str = "played"):
+        self.status = status
+        self.submitted = []
+
+    async def submit(self, kind, message, key, username=None, priority="announcement", log=()):
+        self.submitted.append(message)
+        return {"status": self.status}
+
+
+@pytest.fixture
+def playback(monkeypatch):
+    fake = FakePlayback()
+    monkeypatch.setattr(main, "playback", fake)
+    return fake
+
+
+@pytest.fixture
+def schedule(database):
+    """Crea annuncio con un file e programmazione; ritorna una funzione che produce la riga"""
+    def create(rule: str, catch_up: str = "skip", master_policy: str = "defer", with_file: bool = True) -> dict:
+        db = sqlite3.connect(str(database))
+        db.row_factory = sqlite3.Row
+        group_id = db.execute("INSERT INTO groups (name, color, position) VALUES ('g', '#000000', 0)").lastrowid
+        announcement_id = db.execute(
+            "INSERT INTO announcements (group_id, name, color, position) VALUES (?, 'a', '#000000', 0)",
+            (group_id,)).lastrowid
+        if with_file:
+            db.execute("INSERT INTO announcement_files (announcement_id, file_path, file_order) VALUES (?, 'a.mp3', 1)",
+                       (announcement_id,))
+        schedule_id = db.execute(
+            """INSERT INTO schedules (name, target_type, target_id, rule_type, rule, catch_up, master_policy)
+               VALUES ('s', 'announcement', ?, 'cron', ?, ?, ?)""",
+            (announcement_id, rule, catch_up, master_policy)).lastrowid
+        db.commit()
+        row = dict(db.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone())
+        db.close()
+        return row
+    return create
+
+
+def stored(database, schedule_id: int) -> dict:
+    db = sqlite3.connect(str(database))
+    db.row_factory = sqlite3.Row
+    row = dict(db.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone())
+    db.close()
+    return row
+
+
+def fire_overdue(row: dict, minutes_late: float) -> tuple:
+    """Carica la regola con la prima scadenza spostata nel passato ed esegue _fire"""
+    async def scenario():
+        scheduler = main.AnnouncementScheduler()
+        scheduler._load(row, datetime.now() - timedelta(minutes=minutes_late))
+        entry = scheduler._entries[row["id"]]
+        await scheduler._fire(entry)
+        return scheduler, entry
+    return asyncio.run(scenario())
+
+
+def test_cron_fields_expand_ranges_and_steps():
+    assert main._parse_cron_field("*/15", 0, 59) == [0, 15, 30, 45]
+    assert main._parse_cron_field("10-40/10", 0, 59) == [10, 20, 30, 40]
+    assert main._parse_cron_field("5/20", 0, 59) == [5, 25, 45]
+    assert main._parse_cron_field("1,8-9", 0, 23) == [1, 8, 9]
+    for bad in ("60", "9-8", "*/0"):
+        with pytest.raises(ValueError):
+            main._parse_cron_field(bad, 0, 59)
+
+
+def test_cron_next_after():
+    rule = main.CronRule("*/20 8-9 * * 1")            # lunedi' 8:00-9:40 ogni 20 minuti
+    monday = datetime(2026, 10, 19, 9, 40)
+    assert rule.next_after(datetime(2026, 10, 19, 9, 25)) == monday
+    assert rule.next_after(monday) == datetime(2026, 10, 26, 8, 0)
+    # Giorno del mese e della settimana ristretti entrambi: basta uno dei due
+    either = main.CronRule("0 12 1 * 0")
+    assert either.next_after(datetime(2026, 10, 19)) == datetime(2026, 10, 25, 12, 0)
+    assert either.next_after(datetime(2026, 10, 25, 12, 0)) == datetime(2026, 11, 1, 12, 0)
+
+
+def test_impossible_date_never_fires():
+    assert main.CronRule("0 0 31 2 *").next_after(datetime(2026, 1, 1)) is None
+    assert main.CronRule("0 0 29 2 *").next_after(datetime(2026, 1, 1)) == datetime(2028, 2, 29)
+
+
+def test_validation_rejects_impossible_rules_and_missing_targets(schedule):
+    row = schedule("0 8 * * *")
+
+    def validate(**changes):
+        data = dict(name="s", target_type="announcement", target_id=row["target_id"], rule_type="cron",
+                    rule="0 8 * * *")
+        data.update(changes)
+        asyncio.run(main.validate_schedule(main.ScheduleCreate(**data)))
+
+    validate()
+    for changes in ({"rule": "0 0 31 2 *"}, {"rule": "0 0 31 2 *", "enabled": False}, {"target_id": 999999},
+                    {"target_type": "sequence"}, {"rule_type": "once", "rule": "2000-01-01T08:00"}):
+        with pytest.raises(HTTPException) as error:
+            validate(**changes)
+        assert error.value.status_code == 400
+    # Un "once" gia' passato resta salvabile se disattivato
+    validate(rule_type="once", rule="2000-01-01T08:00", enabled=False)
+
+
+def test_latest_missed_picks_most_recent_occurrence():
+    scheduler = main.AnnouncementScheduler()
+    rule = main.CronRule("*/10 * * * *")
+    now = datetime(2026, 10, 19, 10, 37, 30)
+    entry = {"compiled": rule, "due": datetime(2026, 10, 19, 10, 0)}
+    assert scheduler._latest_missed(entry, now.timestamp()) == datetime(2026, 10, 19, 10, 30)
+    # Oltre SCHEDULER_CATCHUP_MAX_AGE non si recupera nulla
+    entry = {"compiled": main.CronRule("0 3 * * *"), "due": datetime(2026, 10, 19, 3, 0)}
+    assert scheduler._latest_missed(entry, now.timestamp()) is None
+
+
+def test_fire_once_catches_up_latest_miss(manager, playback, schedule, database):
+    row = schedule("* * * * *", catch_up="fire_once")
+    scheduler, entry = fire_overdue(row, 10)
+    assert len(playback.submitted) == 1
+    assert scheduler.stats["fired"] == 1
+    assert scheduler.stats["missed"] == 1
+    saved = stored(database, row["id"])
+    # Eseguita l'occorrenza piu' recente, non la prima persa
+    assert datetime.now() - datetime.fromisoformat(saved["last_run_at"]) < timedelta(minutes=2)
+    assert saved["last_outcome"] == "played"
+    assert manager.controller_messages[0]["type"] == "schedule_fired"
+
+
+def test_skip_catch_up_records_missed_without_last_run(manager, playback, schedule, database):
+    row = schedule("* * * * *")
+    scheduler, _ = fire_overdue(row, 10)
+    assert playback.submitted == []
+    assert scheduler.stats["missed"] == 1
+    saved = stored(database, row["id"])
+    assert saved["last_run_at"] is None
+    assert saved["last_outcome"] == "missed"
+
+
+@pytest.mark.parametrize("status", ["coalesced", "rejected"])
+def test_refused_submission_is_not_counted_as_fired(manager, playback, schedule, database, status):
+    playback.status = status
+    row = schedule("* * * * *")
+    scheduler, _ = fire_overdue(row, 0.5)
+    assert scheduler.stats["fired"] == 0
+    assert scheduler.stats[status] == 1
+    assert manager.controller_messages == []
+    saved = stored(database, row["id"])
+    assert saved["last_run_at"] is None
+    assert saved["last_outcome"] == status
+
+
+def test_missing_files_are_recorded(manager, playback, schedule, database):
+    row = schedule("* * * * *", with_file=False)
+    scheduler, _ = fire_overdue(row, 0.5)
+    assert scheduler.stats["failed"] == 1
+    assert stored(database, row["id"])["last_outcome"] == "no_files"
+
+
+def test_master_defers_then_skips_after_max_defer(manager, playback, schedule, database):
+    manager.master_active = True
+    row = schedule("* * * * *")
+
+    async def scenario():
+        scheduler = main.AnnouncementScheduler()
+        scheduler._load(row, datetime.now())
+        entry = scheduler._entries[row["id"]]
+        entry["due"] = datetime.now() - timedelta(seconds=10)
+        await scheduler._fire(entry)
+        assert entry["deferred"] and scheduler.stats["deferred"] == 1
+        retry_at, schedule_id, _ = scheduler._heap[-1]
+        assert schedule_id == row["id"] and retry_at > time.time()
+
+        # Ancora Master oltre SCHEDULER_MAX_DEFER: l'esecuzione viene saltata
+        entry["due"] = datetime.now() - timedelta(seconds=main.SCHEDULER_MAX_DEFER + 1)
+        await scheduler._fire(entry)
+        return scheduler, entry
+
+    scheduler, entry = asyncio.run(scenario())
+    assert scheduler.stats["skipped_master"] == 1
+    assert not entry["deferred"]
+    assert playback.submitted == []
+    saved = stored(database, row["id"])
+    assert saved["last_run_at"] is None
+    assert saved["last_outcome"] == "skipped_master"
+
+
+def test_master_skip_policy_skips_immediately(manager, playback, schedule):
+    manager.master_active = True
+    row = schedule("* * * * *", master_policy="skip")
+    scheduler, _ = fire_overdue(row, 0.5)
+    assert scheduler.stats["skipped_master"] == 1
+    assert scheduler.stats["deferred"] == 0
@@ -0,0 +1,78 @@
+"""
+Costo CPU di un broadcast WebSocket al crescere dei player.
+Usa veri oggetti WebSocket di Starlette collegati a un send ASGI vuoto, cosi'
+si misura solo il lavoro dell'app (serializzazione + invio dei messaggi ASGI),
+senza rete ne' framing del server. Confronta ConnectionManager._broadcast
+(serializzazione unica) con l'invio per destinatario via send_json.
+"""
+
+import time
+
+from starlette.websockets import WebSocket, WebSocketState
+
+
+async def _receive():
+    return {"type": "websocket.disconnect"}
+
+
+def _fake_websocket(port: int, sent: list) -> WebSocket:
+    async def send(message):
+        sent[0] += 1
+
+    scope = {"type": "websocket", "path": "/ws/player", "headers": [], "client": ("127.0.0.1", port)}
+    ws = WebSocket(scope, _receive, send)
+    ws.client_state = WebSocketState.CONNECTED
+    ws.application_state = WebSocketState.CONNECTED
+    return ws
+
+
+def _message() -> dict:
+    return {
+        "type": "play_sequence",
+        "name": "Benvenuti a bordo - sequenza multilingua",
+        "files": [f"{i}_20250101120000_benvenuto_{i}.mp3" for i in range(20)],
+        "username": "controller",
+        "ts": time.time(),
+    }
+
+
+async def _cpu_per_broadcast(send_once, iterations: int) -> float:
+    start = time.thread_time()
+    for _ in range(iterations):
+        await send_once()
+    return (time.thread_time() - start) / iterations
+
+
+async def run(ctx) -> dict:
+    app = ctx.app
+    message = _message()
+    results = {}
+    iterations = ctx.args.broadcast_iterations
+
+    start = time.thread_time()
+    for _ in range(1000):
+        app.json_dumps(message)
+    results["broadcast_encode_us"] = round((time.thread_time() - start) / 1000 * 1e6, 2)
+
+    for players in (int(x) for x in ctx.args.broadcast_levels.split(",")):
+        manager = app.ConnectionManager()
+        sent = [0]
+        for i in range(players):
+            ws = _fake_websocket(10000 + i, sent)
+            manager.players[ws] = app.ConnectionInfo("player", ws)
+        recipients = list(manager.players)
+
+        async def serialize_once():
+            await manager.send_to_players(message)
+
+        async def per_recipient():
+            for ws in recipients:
+                await ws.send_json(message)
+
+        cpu = await _cpu_per_broadcast(serialize_once, iterations)
+        legacy = await _cpu_per_broadcast(per_recipient, iterations)
+        results[f"broadcast_{players}_cpu_us"] = round(cpu * 1e6, 1)
+        results[f"broadcast_{players}_cpu_per_player_us"] = round(cpu * 1e6 / players, 3)
+        results[f"broadcast_{players}_per_recipient_encode_cpu_us"] = round(legacy * 1e6, 1)
+        results[f"broadcast_{players}_speedup_ratio"] = round(legacy / cpu, 2)
+    return results
@@ -0,0 +1,72 @@
+"""
+Mixer lato server: velocita' del rendering rispetto al tempo reale.
+Rende offline (senza pacing) un programma sintetico con crossfade tra brani
+e un annuncio con ducking per ogni brano, poi misura la decodifica di un WAV
+con la stessa funzione eseguita dal pool di processi. Un rapporto di N vuol
+dire che un core produce N zone in tempo reale.
+"""
+
+import time
+import wave
+
+from common import percentile
+
+
+def _tone(np, seconds: float, freq: float, rate: int, channels: int):
+    t = np.arange(int(seconds * rate), dtype=np.float32) / rate
+    mono = (0.5 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    return np.repeat(mono[:, None], channels, axis=1)
+
+
+def _render(ctx, np, audio_seconds: float) -> dict:
+    app = ctx.app
+    zone = app.ZoneMixer(app.mixer, "bench")
+    rate, channels = zone.rate, zone.channels
+    track_seconds = 20.0
+    zone.music = app.PcmSource(_tone(np, track_seconds, 220, rate, channels), "t0")
+
+    block_times = []
+    blocks = int(audio_seconds * rate / zone.block_frames)
+    for i in range(blocks):
+        # Brano successivo sempre pronto (come con il prefetch) e un annuncio a meta' brano
+        if zone.next_music is None:
+            zone.next_music = app.PcmSource(_tone(np, track_seconds, 330, rate, channels), f"t{i}")
+        if i % int(track_seconds / app.MIXER_BLOCK_SECONDS) == int(track_seconds / app.MIXER_BLOCK_SECONDS) // 2:
+            zone.announcements.append(app.PcmSource(_tone(np, 3.0, 880, rate, channels), "a"))
+        start = time.perf_counter()
+        pcm = zone.render(zone.block_frames)
+        (pcm * 32767).astype("<i2").tobytes()
+        block_times.append(time.perf_counter() - start)
+
+    total = sum(block_times)
+    return {
+        "mixer_audio_seconds": round(blocks * app.MIXER_BLOCK_SECONDS, 1),
+        "mixer_tracks": zone.stats["tracks"],
+        "mixer_announcements": zone.stats["announcements"],
+        "mixer_block_p50_ms": round(percentile(block_times, 50) * 1000, 3),
+        "mixer_block_p99_ms": round(percentile(block_times, 99) * 1000, 3),
+        "mixer_realtime_ratio": round(blocks * app.MIXER_BLOCK_SECONDS / total, 1),
+    }
+
+
+def _decode(ctx, np, seconds: float) -> dict:
+    app = ctx.app
+    path = ctx.base_dir / "audio" / "music" / "bench_mixer.wav"
+    source_rate = 22050
+    pcm = (_tone(np, seconds, 440, source_rate, 1)[:, 0] * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(source_rate)
+        w.writeframes(pcm.tobytes())
+    start = time.perf_counter()
+    app.decode_audio_file(str(path), app.MIXER_SAMPLE_RATE, app.MIXER_CHANNELS)
+    elapsed = time.perf_counter() - start
+    return {"mixer_decode_wav_ms": round(elapsed * 1000, 1), "mixer_decode_realtime_ratio": round(seconds / elapsed, 1)}
+
+
+async def run(ctx) -> dict:
+    np = ctx.app._load_numpy()
+    results = _render(ctx, np, ctx.args.mixer_seconds)
+    results.update(_decode(ctx, np, 60.0))
+    return results
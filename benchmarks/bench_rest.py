@@ -0,0 +1,42 @@
+"""
+Latenza degli endpoint di catalogo (gruppi, annunci, sequenze, musica, playlist)
+"""
+
+import time
+
+import httpx
+
+from common import summarize_ms
+
+CATALOG_ENDPOINTS = [
+    "/api/groups",
+    "/api/announcements",
+    "/api/announcements?group_id=1",
+    "/api/sequences",
+    "/api/music",
+    "/api/music?limit=100",
+    "/api/music?limit=100&fields=id,title",
+    "/api/playlists",
+]
+
+
+async def run(ctx) -> dict:
+    results = {}
+    headers = {"Authorization": f"Bearer {ctx.token}"}
+    async with httpx.AsyncClient(base_url=ctx.server.http_url, headers=headers, timeout=120) as client:
+        for endpoint in CATALOG_ENDPOINTS:
+            # Una richiesta di riscaldamento, poi le misure
+            (await client.get(endpoint)).raise_for_status()
+            samples = []
+            size = 0
+            for _ in range(ctx.args.rest_iterations):
+                start = time.perf_counter()
+                resp = await client.get(endpoint)
+                samples.append(time.perf_counter() - start)
+                resp.raise_for_status()
+                size = len(resp.content)
+            name = endpoint.strip("/").replace("api/", "").replace("?", "_").replace("=", "").replace("/", "_") \
+                .replace("&", "_").replace(",", "_")
+            results.update(summarize_ms(f"rest_{name}", samples))
+            results[f"rest_{name}_bytes"] = size
+    return results
@@ -0,0 +1,74 @@
+"""
+Avvio a freddo: tempo dal lancio del processo alla prima risposta di
+/api/status e RSS a riposo. Il servizio viene avviato in un processo separato
+(uvicorn, come in produzione) due volte sulla stessa directory: la prima su
+una directory vuota (schema da creare, hash bcrypt dell'admin), la seconda con
+lo schema gia' alla versione corrente.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import urllib.request
+from pathlib import Path
+
+from common import BACKEND_DIR
+
+SERVER_CODE = "import uvicorn, main; uvicorn.run(main.app, host='127.0.0.1', port={port}, log_level='warning')"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _boot(base_dir: Path, idle_seconds: float) -> dict:
+    port = _free_port()
+    env = dict(os.environ, AUDIOCI_BASE_DIR=str(base_dir))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", SERVER_CODE.format(port=port)], cwd=BACKEND_DIR, env=env)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"il server e' terminato con codice {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/status", timeout=1) as resp:
+                    status = json.loads(resp.read())
+                break
+            except OSError:
+                time.sleep(0.005)
+        first_request = time.perf_counter() - start
+        time.sleep(idle_seconds)
+        rss = _rss_bytes(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {"first_request_ms": round(first_request * 1000, 1), "rss": rss, "startup": status["startup"]}
+
+
+async def run(ctx) -> dict:
+    base_dir = Path(tempfile.mkdtemp(prefix="audioci-startup-"))
+    results = {}
+    for label in ("cold", "warm"):
+        boot = _boot(base_dir, ctx.args.startup_idle_seconds)
+        startup = boot["startup"]
+        results[f"startup_{label}_first_request_ms"] = boot["first_request_ms"]
+        results[f"startup_{label}_import_ms"] = startup["import_ms"]
+        results[f"startup_{label}_app_startup_ms"] = startup["total_ms"]
+        results[f"startup_{label}_init_db_ms"] = startup["phases_ms"].get("init_db")
+        results[f"startup_{label}_schema"] = startup["schema"]
+        results[f"startup_{label}_idle_rss_bytes"] = boot["rss"]
+    return results
@@ -0,0 +1,90 @@
+"""
+/stream/live: memoria e consegna con centinaia di ascoltatori passivi.
+Per ogni livello di ascoltatori misura la memoria allocata dal codice
+dell'app (tracemalloc filtrato su backend/main.py) mentre l'annuncio e'
+in corso: l'audio sta solo nel buffer circolare condiviso, quindi per ogni
+ascoltatore resta un costo fisso di pochi KB di stato (cursore, generatore,
+risposta) indipendente dalla quantita' di audio trasmessa.
+"""
+
+import json
+import time
+import asyncio
+import tracemalloc
+
+import websockets
+
+from common import BACKEND_DIR, percentile
+
+
+async def _listener(port: int, ready: asyncio.Event, counter: list, result: list):
+    """Ascoltatore minimale su socket grezzo (un client httpx per connessione peserebbe sul benchmark)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stream/live HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+    await writer.drain()
+    counter[0] += 1
+    if counter[0] >= counter[1]:
+        ready.set()
+    received = 0
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        received += len(chunk)
+    writer.close()
+    result.append((received, time.perf_counter()))
+
+
+def _app_bytes(snapshot_before, snapshot_after) -> int:
+    main_py = str(BACKEND_DIR / "main.py")
+    diff = snapshot_after.filter_traces([tracemalloc.Filter(True, main_py)]).compare_to(
+        snapshot_before.filter_traces([tracemalloc.Filter(True, main_py)]), "filename")
+    return sum(stat.size_diff for stat in diff)
+
+
+async def _run_level(ctx, listeners: int) -> dict:
+    args = ctx.args
+    expected = args.stream_chunks * args.chunk_bytes
+    results = []
+    ready = asyncio.Event()
+    counter = [0, listeners]
+
+    before = tracemalloc.take_snapshot()
+    tasks = [asyncio.create_task(_listener(ctx.server.port, ready, counter, results)) for _ in range(listeners)]
+    await asyncio.wait_for(ready.wait(), timeout=60)
+    await asyncio.sleep(0.5)
+
+    async with websockets.connect(f"{ctx.server.ws_url}/ws/master?token={ctx.token}") as master:
+        await master.send(json.dumps({"action": "start_announcement", "username": "bench"}))
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        for seq in range(args.stream_chunks):
+            await master.send(bytes([seq % 256]) * args.chunk_bytes)
+            await asyncio.sleep(args.chunk_interval)
+            if seq == args.stream_chunks // 2:
+                during = tracemalloc.take_snapshot()
+        sent_at = time.perf_counter()
+        await master.send(json.dumps({"action": "stop_announcement"}))
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=120)
+
+    complete = sum(1 for received, _ in results if received >= expected)
+    tail = [(end - sent_at) for _, end in results]
+    app_bytes = _app_bytes(before, during)
+    return {
+        f"stream_{listeners}_app_bytes": app_bytes,
+        f"stream_{listeners}_app_bytes_per_listener": round(app_bytes / listeners, 1),
+        f"stream_{listeners}_complete_ratio": round(complete / listeners, 3),
+        f"stream_{listeners}_drain_p99_ms": round(percentile(tail, 99) * 1000, 3),
+        f"stream_{listeners}_duration_ms": round((sent_at - start) * 1000, 1),
+    }
+
+
+async def run(ctx) -> dict:
+    results = {"stream_ring_bytes": ctx.app.LIVE_RING_BYTES}
+    tracemalloc.start(1)
+    try:
+        for level in (int(x) for x in ctx.args.listener_levels.split(",")):
+            results.update(await _run_level(ctx, level))
+    finally:
+        tracemalloc.stop()
+    return results
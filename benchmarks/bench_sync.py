@@ -0,0 +1,147 @@
+"""
+Avvio sincronizzato dei player con rete disturbata.
+Ogni player simulato ha un orologio locale sfasato di alcuni secondi, riceve e
+invia i messaggi con un ritardo casuale (jitter) e impiega un tempo casuale a
+caricare il file. L'offset dell'orologio si stima con lo scambio time_sync
+(come il frontend: campione a RTT minimo) e gli annunci partono a start_at.
+Misura lo scarto reale dall'istante richiesto e la dispersione tra i player
+per comando, confrontata con l'avvio all'arrivo del messaggio (senza sync).
+"""
+
+import json
+import time
+import random
+import asyncio
+
+import websockets
+
+from common import summarize_ms
+
+SYNC_PROBES = 8
+SKEW_TOLERANCE_MS = 20
+
+
+def _true_ms() -> float:
+    """Ora "vera": il server gira nello stesso processo"""
+    return time.time() * 1000
+
+
+class SimulatedPlayer:
+    def __init__(self, ws, jitter_ms: float, load_ms: float, rng: random.Random):
+        self.ws = ws
+        self.jitter_ms = jitter_ms
+        self.load_ms = load_ms
+        self.rng = rng
+        self.clock_error = rng.uniform(-5000, 5000)    # orologio locale sfasato fino a +-5 s
+        self.offset = 0.0                              # stima di ora server - ora locale
+        self.samples = []
+        self.synced = asyncio.Event()
+        self.starts = {}                               # id -> (avvio sincronizzato, avvio all'arrivo) in ora vera
+        self.waiters = {}
+        self.task = asyncio.create_task(self._reader())
+
+    def local_ms(self) -> float:
+        return _true_ms() + self.clock_error
+
+    def _delay(self) -> float:
+        return self.rng.uniform(0, self.jitter_ms) / 1000
+
+    async def send(self, message: dict):
+        await asyncio.sleep(self._delay())
+        await self.ws.send(json.dumps(message))
+
+    async def _reader(self):
+        async for message in self.ws:
+            if isinstance(message, bytes):
+                continue
+            asyncio.create_task(self._handle(json.loads(message)))
+
+    async def _handle(self, data: dict):
+        await asyncio.sleep(self._delay())
+        kind = data.get("type")
+        if kind == "ping":
+            await self.ws.send(json.dumps({"type": "pong"}))
+        elif kind == "time_sync":
+            t3 = self.local_ms()
+            self.samples.append(((t3 - data["t0"]) - (data["t2"] - data["t1"]),
+                                 ((data["t1"] - data["t0"]) + (data["t2"] - t3)) / 2))
+            if len(self.samples) == SYNC_PROBES:
+                rtt, self.offset = min(self.samples)
+                await self.send({"type": "clock", "offset_ms": self.offset, "rtt_ms": rtt})
+                self.synced.set()
+        elif kind == "play":
+            await self._play(data)
+
+    async def _play(self, data: dict):
+        arrival = _true_ms()
+        ready = arrival + self.rng.uniform(0, self.load_ms)
+        # Avvio programmato: attesa fino a start_at secondo l'orologio locale corretto
+        target_local = data["start_at"] - self.offset
+        await asyncio.sleep(max(0.0, (target_local - self.local_ms()) / 1000))
+        if _true_ms() < ready:
+            await asyncio.sleep((ready - _true_ms()) / 1000)
+        fired = _true_ms()
+        late = self.local_ms() + self.offset - data["start_at"]
+        # Oltre la tolleranza il player recupera spostando la posizione nel file
+        effective = fired - late if late > SKEW_TOLERANCE_MS else fired
+        self.starts[data["id"]] = (effective, ready)
+        await self.send({"type": "skew", "skew_ms": effective - data["start_at"]})
+        await self.send({"status": "stopped"})
+        fut = self.waiters.pop(data["id"], None)
+        if fut is not None and not fut.done():
+            fut.set_result(data["start_at"])
+
+    def expect(self, key):
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[key] = fut
+        return fut
+
+    async def sync(self):
+        self.samples = []
+        self.synced.clear()
+        for _ in range(SYNC_PROBES):
+            await self.send({"type": "time_sync", "t0": self.local_ms()})
+            await asyncio.sleep(0.05)
+        await asyncio.wait_for(self.synced.wait(), timeout=30)
+
+
+async def run(ctx) -> dict:
+    args = ctx.args
+    url = ctx.server.ws_url
+    query = f"?token={ctx.token}"
+    rng = random.Random(46)
+    ctx.app.CONTROLLER_RATE_LIMITS["admin"] = (1e9, 10 ** 9)
+    ctx.app.controller_limiter._users.clear()
+
+    sockets = await asyncio.gather(*(
+        websockets.connect(f"{url}/ws/player{query}") for _ in range(args.sync_players)
+    ))
+    players = [SimulatedPlayer(ws, args.sync_jitter_ms, args.sync_load_ms, rng) for ws in sockets]
+    controller = await websockets.connect(f"{url}/ws/controller{query}")
+    try:
+        await asyncio.gather(*(p.sync() for p in players))
+        offset_errors = [abs(p.offset + p.clock_error) / 1000 for p in players]
+
+        skews, spreads, unsynced_spreads = [], [], []
+        for i in range(args.sync_commands):
+            waiters = [p.expect(i) for p in players]
+            await controller.send(json.dumps({"action": "play_announcement", "id": i, "files": [f"sync_{i}.mp3"]}))
+            start_at = (await asyncio.wait_for(asyncio.gather(*waiters), timeout=30))[0]
+            synced = [p.starts[i][0] for p in players]
+            unsynced = [p.starts[i][1] for p in players]
+            skews.extend(abs(t - start_at) / 1000 for t in synced)
+            spreads.append((max(synced) - min(synced)) / 1000)
+            unsynced_spreads.append((max(unsynced) - min(unsynced)) / 1000)
+            await asyncio.sleep(0.05)
+    finally:
+        for ws in [controller, *sockets]:
+            await ws.close()
+        for p in players:
+            p.task.cancel()
+
+    results = {}
+    results.update(summarize_ms("sync_offset_error", offset_errors))
+    results.update(summarize_ms("sync_start_skew", skews))
+    results.update(summarize_ms("sync_spread", spreads))
+    results.update(summarize_ms("unsynced_spread", unsynced_spreads))
+    return results
@@ -0,0 +1,71 @@
+"""
+Generazione TTS con il backend locale deterministico (nessuna rete):
+throughput di /api/tts/generate con tutte le lingue, con una latenza
+simulata per chiamata al backend, e comportamento in caso di guasto
+(richiesta in timeout, poi risposte immediate a circuito aperto).
+"""
+
+import time
+import asyncio
+
+import httpx
+
+from common import summarize_ms
+
+
+async def _generate(client, group_id: int, languages: list, label: str):
+    start = time.perf_counter()
+    resp = await client.post("/api/tts/generate", json={
+        "text": "Si avvisano i signori passeggeri che il ristorante e' aperto",
+        "languages": languages,
+        "group_id": group_id,
+        "announcement_name": label,
+        "create_sequence": True,
+    })
+    return time.perf_counter() - start, resp
+
+
+async def run(ctx) -> dict:
+    app = ctx.app
+    args = ctx.args
+    previous = app.tts.backend
+    languages = list(app.TTS_VOICES)
+    results = {}
+    headers = {"Authorization": f"Bearer {ctx.token}"}
+    async with httpx.AsyncClient(base_url=ctx.server.http_url, headers=headers, timeout=120) as client:
+        resp = await client.post("/api/groups", json={"name": "Bench TTS", "color": "#8B5CF6"})
+        resp.raise_for_status()
+        group_id = resp.json()["id"]
+        try:
+            # Throughput: richieste concorrenti, ognuna con tutte le lingue
+            app.tts.use(app.LocalTTSBackend(latency=args.tts_latency))
+            semaphore = asyncio.Semaphore(args.tts_concurrency)
+
+            async def one(i):
+                async with semaphore:
+                    elapsed, resp = await _generate(client, group_id, languages, f"bench {i}")
+                    resp.raise_for_status()
+                    return elapsed
+
+            start = time.perf_counter()
+            samples = await asyncio.gather(*(one(i) for i in range(args.tts_requests)))
+            total = time.perf_counter() - start
+            results.update(summarize_ms("tts_generate", samples))
+            results["tts_announcements_per_s"] = round(args.tts_requests * len(languages) / total, 1)
+
+            # Guasto: backend che non risponde entro il timeout, poi circuito aperto
+            hanging = app.LocalTTSBackend(latency=60)
+            hanging.translate_timeout = hanging.synth_timeout = args.tts_timeout
+            app.tts.use(hanging)
+            elapsed, resp = await _generate(client, group_id, languages, "timeout")
+            results["tts_timeout_request_ms"] = round(elapsed * 1000, 1)
+            results["tts_timeout_status"] = resp.status_code
+            failfast = []
+            for _ in range(20):
+                elapsed, resp = await _generate(client, group_id, languages, "circuito aperto")
+                failfast.append(elapsed)
+            results.update(summarize_ms("tts_failfast", failfast))
+            results["tts_failfast_status"] = resp.status_code
+        finally:
+            app.tts.use(previous)
+    return results
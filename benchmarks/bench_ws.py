@@ -0,0 +1,132 @@
+"""
+WebSocket: N player, M controller e un master su socket reali.
+Misura la latenza comando controller -> consegna a tutti i player e la latenza
+di inoltro dell'audio Master mentre i controller continuano a inviare comandi.
+"""
+
+import json
+import time
+import asyncio
+import struct
+
+import websockets
+
+from common import summarize_ms
+
+
+class PlayerClient:
+    def __init__(self, ws):
+        self.ws = ws
+        self.json_waiters = {}
+        self.audio_waiters = {}
+        self.task = asyncio.create_task(self._reader())
+
+    async def _reader(self):
+        async for message in self.ws:
+            now = time.perf_counter()
+            if isinstance(message, bytes):
+                seq = struct.unpack_from("!I", message)[0]
+                fut = self.audio_waiters.pop(seq, None)
+            else:
+                data = json.loads(message)
+                if data.get("type") == "ping":
+                    await self.ws.send(json.dumps({"type": "pong"}))
+                    continue
+                if data.get("type") != "play":
+                    continue
+                fut = self.json_waiters.pop(data.get("id"), None)
+                # Riproduzione istantanea: la coda del server passa subito all'annuncio successivo
+                await self.ws.send(json.dumps({"status": "stopped"}))
+            if fut is not None and not fut.done():
+                fut.set_result(now)
+
+    def expect_json(self, key):
+        fut = asyncio.get_running_loop().create_future()
+        self.json_waiters[key] = fut
+        return fut
+
+    def expect_audio(self, seq):
+        fut = asyncio.get_running_loop().create_future()
+        self.audio_waiters[seq] = fut
+        return fut
+
+
+async def _drain(ws):
+    """Consuma i messaggi non misurati per non creare contropressione sul server"""
+    try:
+        async for message in ws:
+            if isinstance(message, str) and '"ping"' in message:
+                await ws.send(json.dumps({"type": "pong"}))
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def _controller_noise(ws, stop: asyncio.Event, interval: float):
+    """Carico di fondo: comandi continui (durante il Master finiscono in coda o vengono limitati)"""
+    n = 0
+    while not stop.is_set():
+        await ws.send(json.dumps({"action": "play_announcement", "id": -1 - (n % 1000), "files": []}))
+        n += 1
+        await asyncio.sleep(interval)
+
+
+async def run(ctx) -> dict:
+    args = ctx.args
+    url = ctx.server.ws_url
+    query = f"?token={ctx.token}"
+    results = {}
+
+    # Si misura la consegna, non il limitatore: comandi dei controller senza limiti
+    ctx.app.CONTROLLER_RATE_LIMITS["admin"] = (1e9, 10 ** 9)
+    ctx.app.controller_limiter._users.clear()
+
+    player_sockets = await asyncio.gather(*(
+        websockets.connect(f"{url}/ws/player{query}", max_size=None) for _ in range(args.players)
+    ))
+    players = [PlayerClient(ws) for ws in player_sockets]
+    controllers = await asyncio.gather(*(
+        websockets.connect(f"{url}/ws/controller{query}") for _ in range(args.controllers)
+    ))
+    master = await websockets.connect(f"{url}/ws/master{query}")
+    drains = [asyncio.create_task(_drain(ws)) for ws in [*controllers, master]]
+
+    try:
+        # 1. Comando controller -> tutti i player (latenza dell'ultimo player e di ciascuno)
+        per_player, last_player = [], []
+        sender = controllers[0]
+        for i in range(args.ws_commands):
+            waiters = [p.expect_json(i) for p in players]
+            start = time.perf_counter()
+            await sender.send(json.dumps({"action": "play_announcement", "id": i, "files": ["bench.mp3"]}))
+            arrivals = await asyncio.wait_for(asyncio.gather(*waiters), timeout=30)
+            per_player.extend(t - start for t in arrivals)
+            last_player.append(max(arrivals) - start)
+        results.update(summarize_ms("ws_command_delivery", per_player))
+        results.update(summarize_ms("ws_command_fanout_last", last_player))
+
+        # 2. Audio Master sotto carico dei controller
+        stop = asyncio.Event()
+        noise = [asyncio.create_task(_controller_noise(c, stop, args.controller_interval))
+                 for c in controllers[1:]]
+        await master.send(json.dumps({"action": "start_announcement", "username": "bench"}))
+        await asyncio.sleep(0.2)
+        relay = []
+        payload = b"\0" * max(0, args.chunk_bytes - 4)
+        for seq in range(args.master_chunks):
+            waiters = [p.expect_audio(seq) for p in players]
+            start = time.perf_counter()
+            await master.send(struct.pack("!I", seq) + payload)
+            arrivals = await asyncio.wait_for(asyncio.gather(*waiters), timeout=30)
+            relay.extend(t - start for t in arrivals)
+            await asyncio.sleep(args.chunk_interval)
+        await master.send(json.dumps({"action": "stop_announcement"}))
+        stop.set()
+        await asyncio.gather(*noise, return_exceptions=True)
+        results.update(summarize_ms("master_relay", relay))
+        results["master_relay_bytes"] = len(relay) * args.chunk_bytes
+    finally:
+        for ws in [master, *controllers, *player_sockets]:
+            await ws.close()
+        for task in [*drains, *(p.task for p in players)]:
+            task.cancel()
+    return results
@@ -0,0 +1,131 @@
+"""
+AudioCi - Benchmark
+Utility comuni: app in-process su DB temporaneo, catalogo generato, client WebSocket
+"""
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+def prepare_environment(base_dir: str = None) -> Path:
+    """Punta AUDIOCI_BASE_DIR su una directory temporanea. Va chiamata prima di import main."""
+    base = Path(base_dir or tempfile.mkdtemp(prefix="audioci-bench-"))
+    (base / "audio" / "announcements").mkdir(parents=True, exist_ok=True)
+    (base / "audio" / "music").mkdir(parents=True, exist_ok=True)
+    os.environ["AUDIOCI_BASE_DIR"] = str(base)
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    return base
+
+
+def generate_catalog(db_path: Path, groups: int, announcements: int, sequences: int,
+                     music: int, playlists: int, playlist_size: int):
+    """Popola il DB (gia' inizializzato da init_db) con un catalogo sintetico"""
+    db = sqlite3.connect(str(db_path))
+    db.executemany(
+        "INSERT INTO groups (name, color, position) VALUES (?, ?, ?)",
+        [(f"Gruppo {g}", "#3B82F6", g) for g in range(groups)]
+    )
+    group_ids = [r[0] for r in db.execute("SELECT id FROM groups")]
+    db.executemany(
+        "INSERT INTO announcements (group_id, name, color, position) VALUES (?, ?, ?, ?)",
+        [(group_ids[i % len(group_ids)], f"Annuncio {i}", "#10B981", i) for i in range(announcements)]
+    )
+    ann_ids = [r[0] for r in db.execute("SELECT id FROM announcements")]
+    db.executemany(
+        "INSERT INTO announcement_files (announcement_id, file_path, file_order) VALUES (?, ?, ?)",
+        [(a, f"{a}_20250101000000_annuncio_{a}.mp3", 1) for a in ann_ids]
+    )
+    db.executemany(
+        "INSERT INTO sequences (group_id, name, color, position) VALUES (?, ?, ?, ?)",
+        [(group_ids[i % len(group_ids)], f"Sequenza {i}", "#8B5CF6", i) for i in range(sequences)]
+    )
+    seq_ids = [r[0] for r in db.execute("SELECT id FROM sequences")]
+    db.executemany(
+        "INSERT INTO sequence_items (sequence_id, announcement_id, position) VALUES (?, ?, ?)",
+        [(s, ann_ids[(s * 3 + k) % len(ann_ids)], k) for s in seq_ids for k in range(3)] if ann_ids else []
+    )
+    db.executemany(
+        "INSERT INTO music (title, artist, file_path) VALUES (?, ?, ?)",
+        [(f"Brano {i:06d}", f"Artista {i % 97}", f"20250101000000_brano_{i}.mp3") for i in range(music)]
+    )
+    music_ids = [r[0] for r in db.execute("SELECT id FROM music")]
+    db.executemany("INSERT INTO playlists (name) VALUES (?)", [(f"Playlist {p}",) for p in range(playlists)])
+    pl_ids = [r[0] for r in db.execute("SELECT id FROM playlists")]
+    db.executemany(
+        "INSERT INTO playlist_items (playlist_id, music_id, position) VALUES (?, ?, ?)",
+        [(p, music_ids[(p * playlist_size + k) % len(music_ids)], k)
+         for p in pl_ids for k in range(playlist_size)] if music_ids else []
+    )
+    db.commit()
+    db.close()
+
+
+class InProcessServer:
+    """Avvia l'app FastAPI con uvicorn in un thread dedicato (event loop separato dai client)"""
+
+    def __init__(self, app):
+        import uvicorn
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", ws_ping_interval=None)
+        self.server = uvicorn.Server(self.config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def http_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def ws_url(self):
+        return f"ws://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.time() + 30
+        while not self.server.started:
+            if time.time() > deadline or not self.thread.is_alive():
+                raise RuntimeError("Il server di benchmark non si e' avviato")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+async def login(http_url: str, username: str = "admin", password: str = "admin") -> str:
+    import httpx
+    async with httpx.AsyncClient(base_url=http_url) as client:
+        resp = await client.post("/api/auth/login", data={"username": username, "password": password})
+        resp.raise_for_status()
+        return resp.json()["access_token"]
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize_ms(prefix: str, samples_s) -> dict:
+    """p50/p99/max in millisecondi da una lista di durate in secondi"""
+    ms = [s * 1000 for s in samples_s]
+    return {
+        f"{prefix}_p50_ms": round(percentile(ms, 50), 3),
+        f"{prefix}_p99_ms": round(percentile(ms, 99), 3),
+        f"{prefix}_max_ms": round(max(ms) if ms else 0.0, 3),
+    }
+
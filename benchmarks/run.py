@@ -0,0 +1,159 @@
+"""
+AudioCi - Suite di benchmark riproducibile
+
+Avvia backend/main.py in-process su un AUDIOCI_BASE_DIR temporaneo, genera un
+catalogo della dimensione richiesta ed esegue le suite selezionate.
+I risultati vengono scritti in JSON; con --baseline si confrontano con una
+esecuzione precedente e il processo esce con codice 1 se una metrica peggiora
+oltre la tolleranza.
+
+Esempi:
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --players 50 --controllers 5 --music 20000 --baseline baseline.json
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from common import prepare_environment, generate_catalog, InProcessServer, login  # noqa: E402
+
+SUITES = ["rest", "ws", "stream", "broadcast", "mixer", "startup", "tts", "sync"]
+
+# Metriche in cui un valore piu' alto e' migliore (tutte le altre: piu' basso e' meglio)
+HIGHER_IS_BETTER_SUFFIXES = ("_per_s", "_ratio")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AudioCi (REST e WebSocket)")
+    parser.add_argument("--suites", default=",".join(SUITES), help="suite da eseguire, separate da virgola")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON di una esecuzione precedente da usare come riferimento")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="peggioramento relativo ammesso rispetto alla baseline (default 0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0,
+                        help="differenze assolute sotto questa soglia non contano come regressione")
+    # Catalogo
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--announcements", type=int, default=500)
+    parser.add_argument("--sequences", type=int, default=50)
+    parser.add_argument("--music", type=int, default=2000)
+    parser.add_argument("--playlists", type=int, default=20)
+    parser.add_argument("--playlist-size", type=int, default=50)
+    # REST
+    parser.add_argument("--rest-iterations", type=int, default=30)
+    # WebSocket
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--controllers", type=int, default=3)
+    parser.add_argument("--ws-commands", type=int, default=200)
+    parser.add_argument("--controller-interval", type=float, default=0.01)
+    parser.add_argument("--master-chunks", type=int, default=100)
+    parser.add_argument("--chunk-bytes", type=int, default=1600)
+    parser.add_argument("--chunk-interval", type=float, default=0.02)
+    # Stream live HTTP
+    parser.add_argument("--listener-levels", default="50,100,200,400",
+                        help="numero di ascoltatori /stream/live per livello, separati da virgola")
+    parser.add_argument("--stream-chunks", type=int, default=100)
+    # Broadcast (CPU per messaggio al crescere dei player)
+    parser.add_argument("--broadcast-levels", default="10,100,1000",
+                        help="numero di player per livello, separati da virgola")
+    parser.add_argument("--broadcast-iterations", type=int, default=200)
+    # Mixer lato server
+    parser.add_argument("--mixer-seconds", type=float, default=300.0, help="secondi di audio da rendere")
+    # TTS con backend locale (nessuna rete)
+    parser.add_argument("--tts-requests", type=int, default=30)
+    parser.add_argument("--tts-concurrency", type=int, default=4)
+    parser.add_argument("--tts-latency", type=float, default=0.05,
+                        help="latenza simulata per chiamata al backend TTS (secondi)")
+    parser.add_argument("--tts-timeout", type=float, default=0.5,
+                        help="timeout del backend nella prova di guasto (secondi)")
+    # Avvio sincronizzato dei player
+    parser.add_argument("--sync-players", type=int, default=10)
+    parser.add_argument("--sync-commands", type=int, default=30)
+    parser.add_argument("--sync-jitter-ms", type=float, default=40.0,
+                        help="ritardo casuale massimo per messaggio, in ciascuna direzione")
+    parser.add_argument("--sync-load-ms", type=float, default=200.0,
+                        help="tempo massimo di caricamento del file sul player")
+    # Avvio a freddo
+    parser.add_argument("--startup-idle-seconds", type=float, default=2.0,
+                        help="attesa dopo la prima risposta prima di misurare l'RSS a riposo")
+    return parser.parse_args(argv)
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    regressions = []
+    for suite, metrics in results.items():
+        for name, value in metrics.items():
+            ref = baseline.get(suite, {}).get(name)
+            if not isinstance(ref, (int, float)) or not isinstance(value, (int, float)):
+                continue
+            higher_better = name.endswith(HIGHER_IS_BETTER_SUFFIXES)
+            worse = ref - value if higher_better else value - ref
+            if name.endswith("_ms") and worse < min_delta_ms:
+                continue
+            if ref and worse > abs(ref) * tolerance:
+                regressions.append(f"{suite}.{name}: {value} (baseline {ref})")
+    return regressions
+
+
+async def run_suites(args, ctx) -> dict:
+    results = {}
+    for suite in args.suites.split(","):
+        suite = suite.strip()
+        module = __import__(f"bench_{suite}")
+        print(f"[{suite}] in esecuzione...", flush=True)
+        start = time.perf_counter()
+        results[suite] = await module.run(ctx)
+        print(f"[{suite}] completata in {time.perf_counter() - start:.1f}s", flush=True)
+    return results
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    base_dir = prepare_environment()
+
+    import main as audioci  # noqa: E402 - dopo prepare_environment()
+
+    asyncio.run(audioci.init_db())
+    generate_catalog(audioci.DB_PATH, args.groups, args.announcements, args.sequences,
+                     args.music, args.playlists, args.playlist_size)
+
+    with InProcessServer(audioci.app) as server:
+        token = asyncio.run(login(server.http_url))
+        ctx = SimpleNamespace(args=args, server=server, token=token, base_dir=base_dir, app=audioci)
+        results = asyncio.run(run_suites(args, ctx))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps(results, indent=2))
+    print(f"Risultati salvati in {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("REGRESSIONI rispetto alla baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("Nessuna regressione rispetto alla baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())